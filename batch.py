@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import time
+import typing
+
+from machine import DataPath, InputPort, ProgramImage, control_unit_class, read_code, run_control_unit, simulation_modes
+
+Job = dict[str, typing.Any]
+
+defaults: Job = {"input": None, "mode": "fast", "limit": 5_000, "tick_limit": None, "memory_size": 0x1FFF}
+
+
+def read_manifest(manifest: typing.TextIO) -> typing.Iterator[str]:
+    """Job lines of a manifest, they are parsed by the job itself so a broken line fails only its job."""
+    for line in manifest:
+        if line.strip() != "":
+            yield line.strip()
+
+
+def parse_job(line: str, base_dir: str = ".", job_defaults: Job | None = None) -> Job:
+    """Job from a JSON line: `program` is required, `input`, `mode`, `limit`, `tick_limit`
+    and `memory_size` are optional. Relative paths are taken from `base_dir`."""
+    job = json.loads(line)
+    assert isinstance(job, dict), f"manifest job must be an object, got {line}"
+    assert "program" in job, f"manifest job must have a program, got {line}"
+    job = {**defaults, **(job_defaults or {}), **job}
+    job["program"] = os.path.join(base_dir, job["program"])
+    if job["input"] is not None:
+        job["input"] = os.path.join(base_dir, job["input"])
+    return job
+
+
+@functools.cache
+def load_image(path: str) -> ProgramImage:
+    # cached per process, so every worker parses a program once
+    with open(path, "rb") as file:
+        code = read_code(file)
+    return code if isinstance(code, ProgramImage) else ProgramImage(code)
+
+
+def execute(job: Job, input_port: InputPort) -> Job:
+    data_path = DataPath(job["memory_size"], load_image(job["program"]), input_port)
+    control_unit = control_unit_class(job["mode"])(data_path)
+    reason = run_control_unit(control_unit, job["limit"], job["tick_limit"])
+    data_path.output_port.flush()
+    return {
+        "output": data_path.output_port.getvalue(),
+        "instr": control_unit.instr_counter,
+        "ticks": control_unit.ticks,
+        "reason": reason,
+    }
+
+
+def run_job(indexed_line: tuple[int, str], base_dir: str = ".", job_defaults: Job | None = None) -> Job:
+    index, line = indexed_line
+    result: Job = {"job": index}
+    started = time.perf_counter()
+    try:
+        job = parse_job(line, base_dir, job_defaults)
+        result.update({"program": job["program"], "input": job["input"]})
+        if job["input"] is None:
+            result.update(execute(job, InputPort(None)))
+        else:
+            with open(job["input"], encoding="utf-8") as in_file:
+                result.update(execute(job, InputPort(in_file)))
+    except Exception as e:
+        # a broken job or manifest line is reported and the batch goes on
+        result.update({"reason": "error", "error": f"{type(e).__name__}: {e}"})
+    result["wall_time"] = time.perf_counter() - started
+    return result
+
+
+def run_batch(
+    lines: typing.Iterable[str], workers: int | None = None, base_dir: str = ".", job_defaults: Job | None = None
+) -> typing.Iterator[Job]:
+    """Results in manifest order, each one as soon as it and all previous jobs are done."""
+    indexed_lines = enumerate(lines)
+    job_runner = functools.partial(run_job, base_dir=base_dir, job_defaults=job_defaults)
+    if workers == 1:
+        yield from map(job_runner, indexed_lines)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(job_runner, indexed_lines)
+
+
+def main(manifest: typing.TextIO, dst: typing.TextIO, workers: int | None = None, job_defaults: Job | None = None):
+    base_dir = str(pathlib.Path(manifest.name).resolve().parent) if hasattr(manifest, "name") else "."
+    for result in run_batch(read_manifest(manifest), workers, base_dir, job_defaults):
+        dst.write(json.dumps(result, ensure_ascii=False) + "\n")
+        dst.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Execute many (executable, input) jobs in a process pool.")
+    parser.add_argument(
+        "manifest", type=argparse.FileType(encoding="utf-8"), help="JSON lines with program and input paths"
+    )
+    parser.add_argument("--workers", "-w", dest="workers", type=int, help="worker processes (default: cpu count)")
+    parser.add_argument("--mode", "-m", dest="mode", choices=simulation_modes, help="default simulation engine")
+    parser.add_argument("--limit", "-l", dest="limit", type=int, help="default instruction limit")
+    parser.add_argument("--tick-limit", dest="tick_limit", type=int, help="default tick limit")
+    namespace = parser.parse_args()
+    job_defaults = {
+        name: getattr(namespace, name)
+        for name in ("mode", "limit", "tick_limit")
+        if getattr(namespace, name) is not None
+    }
+    main(namespace.manifest, sys.stdout, namespace.workers, job_defaults)
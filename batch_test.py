@@ -0,0 +1,66 @@
+import io
+import json
+import os
+
+import batch
+import isa
+import machine
+import pytest
+import translator
+from machine_test import examples, load_example
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    lines = []
+    for name in examples:
+        with open(os.path.join("examples", name), encoding="utf-8") as file:
+            (tmp_path / f"{name}.json").write_text(isa.serialize(translator.translate(file.read())), encoding="utf-8")
+        _, input_text = load_example(name)
+        (tmp_path / f"{name}.txt").write_text(input_text, encoding="utf-8")
+        lines.append({"program": f"{name}.json", "input": f"{name}.txt"})
+    lines.append({"program": "missing.json"})
+    lines.append({"program": "prob2.json", "limit": 100})
+    lines.append({"program": "prob2.json", "tick_limit": 1000, "mode": "block"})
+    path = tmp_path / "manifest.jsonl"
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+    return path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_matches_simulation(manifest, workers):
+    dst = io.StringIO()
+    with open(manifest, encoding="utf-8") as file:
+        batch.main(file, dst, workers)
+    results = [json.loads(line) for line in dst.getvalue().splitlines()]
+    assert [result["job"] for result in results] == list(range(len(examples) + 3))
+
+    for name, result in zip(examples, results):
+        code, input_text = load_example(name)
+        output, instr, ticks = machine.simulation(code, list(input_text))
+        assert (result["output"], result["instr"], result["ticks"]) == (output, instr, ticks)
+        assert result["reason"] in ("halt", "eof")
+
+    missing, limited, tick_limited = results[len(examples) :]
+    assert missing["reason"] == "error"
+    assert "FileNotFoundError" in missing["error"]
+    assert (limited["reason"], limited["instr"]) == ("limit", 100)
+    assert tick_limited["reason"] == "limit"
+    assert 1000 <= tick_limited["ticks"] < 1000 + 20
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_broken_manifest_lines_fail_only_their_jobs(tmp_path, workers):
+    (tmp_path / "hello.json").write_text(isa.serialize(translator.translate('(print "hi")')), encoding="utf-8")
+    lines = ['{"program": "hello.json"}', '{"program": ', '{"input": "in.txt"}', "[1]", '{"program": "hello.json"}']
+    path = tmp_path / "manifest.jsonl"
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    dst = io.StringIO()
+    with open(path, encoding="utf-8") as file:
+        batch.main(file, dst, workers)
+    results = [json.loads(line) for line in dst.getvalue().splitlines()]
+    assert [result["job"] for result in results] == list(range(5))
+    assert [result["reason"] for result in results] == ["halt", "error", "error", "error", "halt"]
+    assert "JSONDecodeError" in results[1]["error"]
+    assert "must have a program" in results[2]["error"]
+    assert results[4]["output"] == "hi"
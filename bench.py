@@ -0,0 +1,481 @@
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import hashlib
+import io
+import json
+import pathlib
+import platform
+import sys
+import time
+import tracemalloc
+import typing
+
+import inliner
+import peephole
+import translator
+from isa import AddressType, Opcode, serialize, serialize_binary
+from machine import DataPath, control_unit_class, instruction_ticks, read_code, run_control_unit, simulation_modes
+
+Results = dict[str, float]
+
+
+class Case:
+    def __init__(self, name: str, source: str, input_text: str = "", limit: int = 5_000, memory_size: int = 0x1FFF):
+        self.name = name
+        self.source = source
+        self.input_text = input_text
+        self.limit = limit
+        self.memory_size = memory_size
+
+    def lines(self) -> int:
+        return len(self.source.split("\n"))
+
+
+def example_cases(examples_dir: str = "examples") -> list[Case]:
+    cases = []
+    for path in sorted(pathlib.Path(examples_dir).iterdir()):
+        if not path.is_file():
+            continue
+        input_path = path.parent / "input" / path.name
+        input_text = input_path.read_text(encoding="utf-8") if input_path.is_file() else ""
+        cases.append(Case(path.name, path.read_text(encoding="utf-8"), input_text))
+    return cases
+
+
+def identifier(index: int, prefix: str = "fn_") -> str:
+    """Name made of letters only, identifiers can't contain digits:
+
+    >>> [identifier(i) for i in (0, 1, 26, 27)]
+    ['fn_a', 'fn_b', 'fn_ba', 'fn_bb']
+    """
+    letters = ""
+    while True:
+        index, digit = divmod(index, 26)
+        letters = chr(ord("a") + digit) + letters
+        if index == 0:
+            return prefix + letters
+
+
+def deep_recursion(depth: int) -> Case:
+    source = f"(defun depth (n)\n  (if (= n 0)\n    0\n    (+ 1 (depth (- n 1)))))\n\n(printi (depth {depth}))\n"
+    return Case(f"deep_recursion_{depth}", source, limit=100 * depth)
+
+
+def long_loop(statements: int, iterations: int) -> Case:
+    # loop takes one statement, so the body is a sum of assignments
+    body = "\n".join(f"    (set {identifier(i)} (+ {identifier(i)} {i + 1}))" for i in range(statements))
+    source = f"(loop\n  (+\n{body}))\n"
+    # the loop never ends, it is stopped by the instruction limit after about `iterations` passes
+    return Case(f"long_loop_{statements}", source, limit=iterations * 10 * statements)
+
+
+def large_strings(count: int, size: int) -> Case:
+    lines = [f'(print "{chr(ord("a") + i % 26) * size}")' for i in range(count)]
+    return Case(f"large_strings_{count}x{size}", "\n".join(lines) + "\n", limit=count * size * 20)
+
+
+def many_defuns(count: int) -> Case:
+    defuns = [f"(defun {identifier(i)} (a b)\n  (+ a (* b {i})))" for i in range(count)]
+    calls = [f"(printi ({identifier(i)} {i} 2))" for i in range(count)]
+    return Case(f"many_defuns_{count}", "\n".join(defuns + calls) + "\n", limit=count * 200)
+
+
+def synthetic_cases(scale: int = 1) -> list[Case]:
+    return [
+        deep_recursion(250 * scale),
+        long_loop(50 * scale, 20),
+        large_strings(4 * scale, 250),
+        many_defuns(50 * scale),
+    ]
+
+
+def generated_lines(count: int) -> typing.Iterator[str]:
+    """Source of a large generated program, line by line: defuns and their calls, tens of
+    thousands of distinct int and string constants, deep expressions and plain assignments."""
+    depth = 20
+    deep = "(+ 1 " * depth + "1" + ")" * depth
+    for index in range(count):
+        variable = identifier(index % 1000, "var_")
+        match index % 10:
+            case 0:
+                line = f"(defun {identifier(index)} (a b) (+ a (* b {index % 1000})))"
+            case 1:
+                line = f"(set {variable} {(1 << 20) + index % 50_000})"
+            case 2:
+                line = f'(print "s{index % 50_000}")'
+            case 3:
+                line = f"(set {variable} {deep})"
+            case 4:
+                line = f"(printi ({identifier(index - 4)} {index % 1000} 2))"
+            case _:
+                line = f"(set {variable} (- {variable} {index % 100}))"
+        yield line + "\n"
+
+
+def measure_scaling(max_lines: int) -> Results:
+    """Translation speed of generated programs from 1000 to `max_lines` lines, by powers of ten;
+    it stays flat while every phase is linear."""
+    results = {}
+    lines = 1000
+    while lines <= max_lines:
+        started = time.perf_counter()
+        translator.translate(generated_lines(lines))
+        results[f"translator/generated_{lines}/lines_per_s"] = lines / (time.perf_counter() - started)
+        lines *= 10
+    return results
+
+
+def stopwatch(func: typing.Callable[[], typing.Any]) -> typing.Callable[[], list[float]]:
+    def timed() -> list[float]:
+        started = time.perf_counter()
+        func()
+        return [time.perf_counter() - started]
+
+    return timed
+
+
+def best_times(run: typing.Callable[[], list[float]], repeat: int, min_time: float) -> list[float]:
+    """Least mean durations of `repeat` samples, every sample calls `run` for at least `min_time` seconds.
+
+    `run` returns durations of its parts; the first call warms up regex and handler caches and is not counted.
+    """
+    run()
+    best: list[float] | None = None
+    for _ in range(repeat):
+        totals, count, started = run(), 1, time.perf_counter()
+        while time.perf_counter() - started < min_time:
+            totals = [total + duration for total, duration in zip(totals, run())]
+            count += 1
+        means = [total / count for total in totals]
+        best = means if best is None else list(map(min, best, means))
+    return best
+
+
+translation_stages = ("lex", "build_ast", "extract_statements", "translate_into_code", "serialize")
+
+
+def translation_times(source: str, opt_level: int = 1) -> list[float]:
+    started = time.perf_counter()
+    tokens = list(translator.extract_tokens(source))
+    lexed = time.perf_counter()
+    ast = translator.build_ast(tokens)
+    built = time.perf_counter()
+    context = translator.ProgramContext(opt_level)
+    statements = translator.extract_statements(ast, context)
+    extracted = time.perf_counter()
+    code = translator.translate_into_code(statements, context)
+    translated = time.perf_counter()
+    serialize(code)
+    serialize_binary(code)
+    serialized = time.perf_counter()
+    return [lexed - started, built - lexed, extracted - built, translated - extracted, serialized - translated]
+
+
+def measure_translator(case: Case, repeat: int, min_time: float, opt_level: int = 1) -> Results:
+    """Source lines per second through every translation stage and through all of them."""
+    times = best_times(lambda: translation_times(case.source, opt_level), repeat, min_time)
+    lines = case.lines()
+    results = {f"{stage}_lines_per_s": lines / elapsed for stage, elapsed in zip(translation_stages, times)}
+    results["lines_per_s"] = lines / sum(times)
+    results["code_instr"] = len(translator.translate(case.source, opt_level))
+    return results
+
+
+def execute(case: Case, executable: bytes, mode: str) -> tuple[int, int]:
+    data_path = DataPath(case.memory_size, read_code(io.BytesIO(executable)), list(case.input_text))
+    control_unit = control_unit_class(mode)(data_path)
+    run_control_unit(control_unit, case.limit)
+    return control_unit.instr_counter, control_unit.ticks
+
+
+def measure_machine(case: Case, executable: bytes, mode: str, repeat: int, min_time: float) -> Results:
+    """Instructions and ticks per second, executable load time and peak memory of one run."""
+    (load_s,) = best_times(stopwatch(lambda: read_code(io.BytesIO(executable))), repeat, min_time)
+    (elapsed,) = best_times(stopwatch(lambda: execute(case, executable, mode)), repeat, min_time)
+    # tracemalloc slows the run down, so memory is measured apart from time
+    tracemalloc.start()
+    try:
+        instr, ticks = execute(case, executable, mode)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "instr": instr,
+        "ticks": ticks,
+        "instr_per_s": instr / elapsed,
+        "ticks_per_s": ticks / elapsed,
+        "load_s": load_s,
+        "peak_bytes": peak,
+    }
+
+
+def optimization_costs(
+    case: Case, peephole_rules: list[str] | None = None, inline_limit: int | None = None
+) -> tuple[int, int, int]:
+    code = translator.translate(case.source, peephole_rules=peephole_rules, inline_limit=inline_limit)
+    instr, ticks = execute(case, serialize_binary(code), "fast")
+    return len(code), instr, ticks
+
+
+def peephole_savings(cases: list[Case]) -> dict[str, tuple[int, int, int]]:
+    """Code instructions, executed instructions and ticks saved by every peephole rule and by all of them.
+
+    Rules are enabled one by one in order and each one is credited with the change it adds, since
+    later rules match what earlier ones leave, e.g. `store_pop` makes way for `commutative_operand`.
+    """
+    previous = [optimization_costs(case, []) for case in cases]
+    initial, savings = previous, {}
+    for count, rule in enumerate(peephole.all_rules, 1):
+        costs = [optimization_costs(case, peephole.all_rules[:count]) for case in cases]
+        savings[rule] = tuple(sum(before[i] - after[i] for before, after in zip(previous, costs)) for i in range(3))
+        previous = costs
+    savings["all"] = tuple(sum(before[i] - after[i] for before, after in zip(initial, previous)) for i in range(3))
+    return savings
+
+
+def write_savings(dst: typing.TextIO, savings: dict[str, tuple[int, int, int]]):
+    dst.write(f"{'rule':<20} {'code instr':>10} {'instr':>8} {'ticks':>8}\n")
+    for name, (code_instr, instr, ticks) in savings.items():
+        dst.write(f"{name:<20} {code_instr:>10} {instr:>8} {ticks:>8}\n")
+
+
+def inlined_sites(case: Case) -> list[inliner.Site]:
+    sites: list[inliner.Site] = []
+    translator.translate(case.source, inline_sites=sites)
+    return sites
+
+
+def write_inlining(dst: typing.TextIO, cases: list[Case]):
+    """Instructions every inlined call adds to the code and ticks it saves on each execution, `all` rows
+    are the change of whole programs against translation without inlining."""
+    ticks = instruction_ticks()
+    call_ticks = ticks[(Opcode.CALL, AddressType.ABSOLUTE)][0] + ticks[(Opcode.RETURN, None)][0]
+    # the callee of a tail call still returns, only the jump to it is saved
+    tail_ticks = ticks[(Opcode.JUMP, AddressType.ABSOLUTE)][1]
+    dst.write(f"{'case':<16} {'caller':<20} {'callee':<20} {'code instr':>10} {'ticks':>8}\n")
+    for case in cases:
+        sites = inlined_sites(case)
+        for site in sites:
+            saved = tail_ticks if site.tail else call_ticks
+            dst.write(f"{case.name:<16} {site.caller:<20} {site.callee:<20} {site.size:>+10} {-saved:>+8}\n")
+        if sites:
+            code_instr, _, total_ticks = optimization_costs(case, inline_limit=0)
+            inlined_instr, _, inlined_ticks = optimization_costs(case)
+            size, saved = inlined_instr - code_instr, inlined_ticks - total_ticks
+            dst.write(f"{case.name:<16} {'':<20} {'all':<20} {size:>+10} {saved:>+8}\n")
+
+
+def run_suite(
+    cases: list[Case], modes: list[str], repeat: int = 3, min_time: float = 0.1, opt_level: int = 1
+) -> dict[str, typing.Any]:
+    """Metrics of every case and meta of the run; `executables` in meta are digests of the measured machine code."""
+    metrics: Results = {}
+    executables = {}
+    for case in cases:
+        for name, value in measure_translator(case, repeat, min_time, opt_level).items():
+            metrics[f"translator/{case.name}/{name}"] = value
+        executable = serialize_binary(translator.translate(case.source, opt_level))
+        executables[case.name] = hashlib.sha256(executable).hexdigest()
+        for mode in modes:
+            for name, value in measure_machine(case, executable, mode, repeat, min_time).items():
+                metrics[f"machine/{case.name}/{mode}/{name}"] = value
+    meta = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "modes": modes,
+        "repeat": repeat,
+        "opt_level": opt_level,
+        "executables": executables,
+    }
+    return {"meta": meta, "metrics": metrics}
+
+
+def comparable_baseline(results: dict[str, typing.Any], baseline: dict[str, typing.Any]) -> tuple[Results, list[str]]:
+    """Baseline metrics to compare `results` with and notes on the skipped ones.
+
+    The machine runs different code once the translator changes, so machine metrics of a case
+    whose executable differs from the baseline one measure the code generator, not the machine.
+    """
+    executables, base_executables = results["meta"]["executables"], baseline["meta"].get("executables", {})
+    changed = sorted(name for name, digest in executables.items() if base_executables.get(name) != digest)
+    notes = [f"machine/{name}: executable differs from the baseline one, not compared" for name in changed]
+    skipped = tuple(f"machine/{name}/" for name in changed)
+    return {metric: value for metric, value in baseline["metrics"].items() if not metric.startswith(skipped)}, notes
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+
+def threshold_for(metric: str, thresholds: dict[str, float], default: float) -> float:
+    # the longest matching pattern is the most specific one
+    matching = [pattern for pattern in thresholds if fnmatch.fnmatchcase(metric, pattern)]
+    return thresholds[max(matching, key=len)] if matching else default
+
+
+def compare(
+    metrics: Results, baseline: Results, default_threshold: float = 0.3, thresholds: dict[str, float] | None = None
+) -> list[str]:
+    """Regressions of `metrics` against `baseline`, a metric regresses once it is worse by more than its threshold.
+
+    >>> compare({"a_per_s": 70.0, "ticks": 100}, {"a_per_s": 100.0, "ticks": 100}, 0.2)
+    ['a_per_s: 70 against 100 in baseline (-30.0%, threshold 20%)']
+    >>> compare({"a_per_s": 70.0}, {"a_per_s": 100.0}, 0.2, {"a_*": 0.5})
+    []
+    """
+    regressions = []
+    for metric, base in sorted(baseline.items()):
+        if metric not in metrics or base == 0:
+            continue
+        value, threshold = metrics[metric], threshold_for(metric, thresholds or {}, default_threshold)
+        change = (value - base) / base
+        worse = -change if higher_is_better(metric) else change
+        if worse > threshold:
+            regressions.append(
+                f"{metric}: {value:.4g} against {base:.4g} in baseline ({change:+.1%}, threshold {threshold:.0%})"
+            )
+    return regressions
+
+
+# loading takes microseconds, so its measurements are the noisiest
+default_thresholds = {"machine/*/load_s": 0.6}
+
+
+def parse_thresholds(values: list[str]) -> tuple[float, dict[str, float]]:
+    """`0.3` sets the default threshold, `pattern=0.3` the one of matching metrics."""
+    default, thresholds = 0.3, dict(default_thresholds)
+    for value in values:
+        pattern, _, fraction = value.rpartition("=")
+        if pattern:
+            thresholds[pattern] = float(fraction)
+        else:
+            default = float(fraction)
+    return default, thresholds
+
+
+def main(
+    dst: typing.TextIO,
+    baseline_file: typing.TextIO | None = None,
+    thresholds: list[str] | tuple[str, ...] = (),
+    modes: list[str] | None = None,
+    scale: int = 1,
+    repeat: int = 3,
+    min_time: float = 0.1,
+    scaling: int = 0,
+    peephole_report: bool = False,
+    inline_report: bool = False,
+    opt_level: int = 1,
+) -> int:
+    if peephole_report:
+        write_savings(dst, peephole_savings(example_cases()))
+        return 0
+    if inline_report:
+        write_inlining(dst, example_cases())
+        return 0
+    cases = example_cases() + synthetic_cases(scale)
+    results = run_suite(cases, modes or ["micro", "fast", "block"], repeat, min_time, opt_level)
+    results["metrics"].update(measure_scaling(scaling))
+    json.dump(results, dst, indent=2, sort_keys=True)
+    dst.write("\n")
+    if baseline_file is None:
+        return 0
+    baseline = json.load(baseline_file)
+    if baseline["meta"].get("opt_level") != opt_level:
+        print(f"baseline is taken at opt level {baseline['meta'].get('opt_level')}, not {opt_level}", file=sys.stderr)
+        return 2
+    base_metrics, notes = comparable_baseline(results, baseline)
+    default, patterns = parse_thresholds(list(thresholds))
+    regressions = compare(results["metrics"], base_metrics, default, patterns)
+    for message in notes + regressions:
+        print(message, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark translator and machine on examples and synthetic programs.")
+    parser.add_argument(
+        "--output",
+        "-o",
+        dest="dst",
+        type=argparse.FileType("w", encoding="utf-8"),
+        default="-",
+        metavar="results_file",
+        help="file for JSON results (default: stdout)",
+    )
+    parser.add_argument(
+        "--baseline",
+        "-b",
+        dest="baseline_file",
+        type=argparse.FileType(encoding="utf-8"),
+        metavar="baseline_file",
+        help="results to compare with, exit code is 1 on regression",
+    )
+    parser.add_argument(
+        "--threshold",
+        "-t",
+        dest="thresholds",
+        action="append",
+        default=[],
+        help="allowed regression: 0.3 for every metric or pattern=0.5 for matching ones, e.g. '*/peak_bytes=0.1'",
+    )
+    parser.add_argument(
+        "--mode",
+        "-m",
+        dest="modes",
+        action="append",
+        choices=simulation_modes,
+        help="engines (default: micro, fast, block)",
+    )
+    parser.add_argument("--scale", dest="scale", type=int, default=1, help="size of synthetic programs")
+    parser.add_argument(
+        "--repeat", "-r", dest="repeat", type=int, default=3, help="samples per measurement, best is kept"
+    )
+    parser.add_argument(
+        "--min-time", dest="min_time", type=float, default=0.1, help="least duration of a sample in seconds"
+    )
+    parser.add_argument(
+        "--scaling",
+        dest="scaling",
+        type=int,
+        default=0,
+        metavar="LINES",
+        help="translate generated programs up to LINES source lines, e.g. 1000000",
+    )
+    parser.add_argument(
+        "--peephole",
+        dest="peephole_report",
+        action="store_true",
+        help="only report code instructions, instructions and ticks saved by every peephole rule on examples",
+    )
+    parser.add_argument(
+        "--inline",
+        dest="inline_report",
+        action="store_true",
+        help="only report code instructions and ticks every inlined call site adds on examples",
+    )
+    parser.add_argument(
+        "-O",
+        dest="opt_level",
+        type=int,
+        choices=[0, 1],
+        default=1,
+        help="optimization level of translated cases, a baseline is compared only at its own level",
+    )
+    namespace = parser.parse_args()
+    sys.exit(
+        main(
+            namespace.dst,
+            namespace.baseline_file,
+            namespace.thresholds,
+            namespace.modes,
+            namespace.scale,
+            namespace.repeat,
+            namespace.min_time,
+            namespace.scaling,
+            namespace.peephole_report,
+            namespace.inline_report,
+            namespace.opt_level,
+        )
+    )
@@ -0,0 +1,85 @@
+import io
+import json
+
+import bench
+import isa
+import machine
+import pytest
+import translator
+
+
+@pytest.mark.parametrize("case", bench.synthetic_cases(1), ids=lambda case: case.name)
+def test_synthetic_cases_match_simulation(case):
+    code = isa.deserialize(isa.serialize(translator.translate(case.source)))
+    _, instr, ticks = machine.simulation(code, list(case.input_text), case.memory_size, case.limit, mode="fast")
+    metrics = bench.run_suite([case], ["fast"], repeat=1, min_time=0)["metrics"]
+    assert metrics[f"machine/{case.name}/fast/instr"] == instr
+    assert metrics[f"machine/{case.name}/fast/ticks"] == ticks
+    assert metrics[f"translator/{case.name}/code_instr"] == len(translator.translate(case.source))
+    assert metrics[f"translator/{case.name}/lines_per_s"] > 0
+
+
+def test_compare_with_baseline():
+    baseline = {"machine/a/fast/instr_per_s": 1000.0, "machine/a/fast/peak_bytes": 100, "machine/a/fast/ticks": 50}
+    metrics = {"machine/a/fast/instr_per_s": 900.0, "machine/a/fast/peak_bytes": 150, "machine/a/fast/ticks": 40}
+    assert bench.compare(metrics, baseline, 0.2) == [
+        "machine/a/fast/peak_bytes: 150 against 100 in baseline (+50.0%, threshold 20%)"
+    ]
+    default, thresholds = bench.parse_thresholds(["0.05", "*/peak_bytes=0.6"])
+    assert bench.compare(metrics, baseline, default, thresholds) == [
+        "machine/a/fast/instr_per_s: 900 against 1000 in baseline (-10.0%, threshold 5%)"
+    ]
+
+
+def test_main_reports_regressions(tmp_path, monkeypatch):
+    monkeypatch.setattr(bench, "example_cases", lambda: [bench.Case("hello", '(print "hi")')])
+    monkeypatch.setattr(bench, "synthetic_cases", lambda scale: [])
+    results = io.StringIO()
+    assert bench.main(results, modes=["fast"], repeat=1, min_time=0) == 0
+    baseline = json.loads(results.getvalue())
+    assert baseline["metrics"]["machine/hello/fast/instr"] > 0
+
+    baseline["metrics"]["machine/hello/fast/ticks"] //= 2
+    baseline_file = io.StringIO(json.dumps(baseline))
+    assert bench.main(io.StringIO(), baseline_file, ["*_per_s=1"], modes=["fast"], repeat=1, min_time=0) == 1
+
+
+def test_baseline_of_other_code_is_not_compared(monkeypatch, capsys):
+    monkeypatch.setattr(bench, "example_cases", lambda: [bench.Case("hello", '(print "hi")')])
+    monkeypatch.setattr(bench, "synthetic_cases", lambda scale: [])
+    results = io.StringIO()
+    assert bench.main(results, modes=["fast"], repeat=1, min_time=0, opt_level=0) == 0
+    baseline = json.loads(results.getvalue())
+    assert baseline["meta"]["opt_level"] == 0
+    assert bench.main(io.StringIO(), io.StringIO(json.dumps(baseline)), modes=["fast"], repeat=1, min_time=0) == 2
+
+    baseline["metrics"]["machine/hello/fast/ticks"] //= 2
+    baseline["meta"]["executables"]["hello"] = "other"
+    baseline_file = io.StringIO(json.dumps(baseline))
+    capsys.readouterr()
+    assert bench.main(io.StringIO(), baseline_file, ["*_per_s=1"], ["fast"], repeat=1, min_time=0, opt_level=0) == 0
+    assert "machine/hello: executable differs" in capsys.readouterr().err
+
+
+def test_generated_program_translates():
+    code = translator.translate(bench.generated_lines(50))
+    words = isa.deserialize(isa.serialize(code))
+    output, _, _ = machine.simulation(words, [], limit=50_000, mode="fast")
+    assert output.startswith("s24s1234s2264")
+    assert set(bench.measure_scaling(1000)) == {"translator/generated_1000/lines_per_s"}
+
+
+def test_peephole_savings_add_up():
+    savings = bench.peephole_savings([bench.long_loop(5, 3), bench.deep_recursion(20)])
+    assert set(savings) == {*bench.peephole.all_rules, "all"}
+    assert savings["all"] == tuple(sum(saved[i] for rule, saved in savings.items() if rule != "all") for i in range(3))
+    assert savings["all"][2] > 0
+
+
+def test_inlining_report_lists_call_sites():
+    report = io.StringIO()
+    bench.write_inlining(report, [bench.Case("cat", "(loop (printc (readchar)))", "ab")])
+    rows = [line.split() for line in report.getvalue().splitlines()[1:]]
+    assert [row[:3] for row in rows[:2]] == [["cat", "start", "readchar"], ["cat", "start", "printc"]]
+    assert rows[-1][:2] == ["cat", "all"]
+    assert int(rows[-1][3]) < 0
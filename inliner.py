@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import copy
+
+import peephole
+from isa import Address, AddressType, Opcode, Term, branch_ops, stack_top_ops
+
+stack_addresses = (AddressType.RELATIVE_SPR, AddressType.RELATIVE_INDIRECT_SPR)
+stack_effect = {Opcode.PUSH: 1, Opcode.POP: -1, Opcode.POPN: -1}
+
+
+class Site:
+    """Call of `callee` in `caller` replaced with its body, `size` instructions are added in place of the call."""
+
+    def __init__(self, caller: str, callee: str, size: int, tail: bool = False):
+        self.caller = caller
+        self.callee = callee
+        self.size = size
+        self.tail = tail
+
+
+class Callee:
+    """Function to inline: `body` replaces a call, the whole `code` with its `ret` replaces a tail call."""
+
+    def __init__(self, code: list[Term], body: list[Term]):
+        self.code = code
+        self.body = body
+
+
+def successors(code: list[Term], index: int) -> list[int] | None:
+    """Instructions executed after the one at `index`, None if the code leaves the function in an unknown way."""
+    term = code[index]
+    if term.op in (Opcode.RETURN, Opcode.HALT):
+        return []
+    if term.op == Opcode.JUMP and isinstance(term.arg, str):
+        return []
+    if term.op in branch_ops:
+        if not peephole.is_relative_jump(term):
+            return None
+        target = [index + term.arg.val]
+        return target if term.op == Opcode.JUMP else [index + 1, *target]
+    return [index + 1]
+
+
+def frame_depths(code: list[Term]) -> list[int | None] | None:
+    """Cells pushed since function entry before every instruction, None for unreachable ones.
+
+    Gives up with None if the depth at an instruction depends on the path to it.
+    """
+    depths: list[int | None] = [None] * len(code)
+    depths[0] = 0
+    pending = [0]
+    while pending:
+        index = pending.pop()
+        following = successors(code, index)
+        depth = depths[index] + stack_effect.get(code[index].op, 0)
+        if following is None or depth < 0:
+            return None
+        for target in following:
+            if not 0 <= target < len(code):
+                return None
+            if depths[target] is None:
+                depths[target] = depth
+                pending.append(target)
+            elif depths[target] != depth:
+                return None
+    return depths
+
+
+def uses_return_address(term: Term, depth: int) -> bool:
+    if term.op in stack_top_ops and depth == 0:
+        return True
+    arg = term.arg
+    return isinstance(arg, Address) and arg.tag in stack_addresses and arg.val == depth
+
+
+def frame_operand(arg: str | int | Address | None, depth: int) -> str | int | Address | None:
+    """Arguments are one cell closer to the top without the return address, cells pushed by the body stay."""
+    if isinstance(arg, Address) and arg.tag in stack_addresses and arg.val > depth:
+        return Address(arg.tag, arg.val - 1)
+    return copy.copy(arg)
+
+
+def leaves_function(term: Term) -> bool:
+    return term.op == Opcode.RETURN or (term.op == Opcode.JUMP and isinstance(term.arg, str))
+
+
+def is_inlinable(code: list[Term], depths: list[int | None]) -> bool:
+    """No access to the return address, `ret` and tail calls leave with an empty frame."""
+    for term, depth in zip(code, depths):
+        if depth is None:
+            continue
+        if term.op == Opcode.HALT or uses_return_address(term, depth):
+            return False
+        if leaves_function(term) and depth != 0:
+            return False
+    return True
+
+
+def inline_body(code: list[Term]) -> list[Term] | None:
+    """Code of a function to put in place of its call, None if it can't be inlined.
+
+    Unreachable instructions are dropped, stack offsets of arguments are moved by the missing
+    return address, `ret` becomes a jump to the end of the body and a tail call an ordinary call.
+    """
+    depths = frame_depths(code) if code else None
+    if depths is None or not is_inlinable(code, depths):
+        return None
+    last = max(index for index, depth in enumerate(depths) if depth is not None)
+    body: list[Term] = []
+    copies: dict[int, Term] = {}
+    jumps: list[tuple[Term, int | None]] = []
+    for index, (term, depth) in enumerate(zip(code, depths)):
+        if depth is None:
+            continue
+        if term.op != Opcode.RETURN:
+            copies[index] = Term(term.op, frame_operand(term.arg, depth), term.desc)
+            body.append(copies[index])
+        if peephole.is_relative_jump(term):
+            jumps.append((copies[index], index + term.arg.val))
+        elif leaves_function(term):
+            if term.op == Opcode.JUMP:
+                copies[index].op = Opcode.CALL
+            if index != last:
+                jumps.append((Term(Opcode.JUMP), None))
+                body.append(jumps[-1][0])
+                copies.setdefault(index, body[-1])
+    position = {term: index for index, term in enumerate(body)}
+    for jump, target in jumps:
+        # a jump to the last `ret` goes to the end of the body
+        offset = position[copies[target]] if target in copies else len(body)
+        jump.arg = Address(AddressType.RELATIVE_IPR, offset - position[jump])
+    return body
+
+
+def inlined_callee(term: Term, callees: dict[str, Callee]) -> str | None:
+    if term.op in (Opcode.CALL, Opcode.JUMP) and isinstance(term.arg, str) and term.arg in callees:
+        return term.arg
+    return None
+
+
+def copy_code(code: list[Term]) -> list[Term]:
+    return [Term(term.op, copy.copy(term.arg), term.desc) for term in code]
+
+
+def inline_calls(
+    code: list[Term], callees: dict[str, Callee], caller: str, sites: list[Site] | None = None
+) -> list[Term]:
+    """Replaces calls and tail calls of `callees` with copies of their code, jumps of `code` are retargeted.
+
+    At a tail call the frame is the one the callee expects at entry, so its code is copied as is.
+    """
+    if not any(inlined_callee(term, callees) for term in code):
+        return code
+    targets = peephole.jump_targets(code)
+    result: list[Term] = []
+    moved: dict[Term, Term | None] = {}
+    for index, term in enumerate(code):
+        callee = inlined_callee(term, callees)
+        if callee is None:
+            result.append(term)
+            continue
+        tail = term.op == Opcode.JUMP
+        body = copy_code(callees[callee].code if tail else callees[callee].body)
+        following = code[index + 1] if index + 1 < len(code) else None
+        moved[term] = body[0] if body else following
+        result.extend(body)
+        if sites is not None:
+            sites.append(Site(caller, callee, len(body) - 1, tail))
+    position = {term: index for index, term in enumerate(result)}
+    for jump, target in targets.items():
+        while target in moved:
+            target = moved[target]
+        offset = (len(result) if target is None else position[target]) - position[jump]
+        jump.arg = Address(AddressType.RELATIVE_IPR, offset)
+    return result
@@ -0,0 +1,71 @@
+import inliner
+import isa
+import machine
+import translator
+from isa import Address, AddressType, Opcode, Term
+
+
+def stack(offset: int) -> Address:
+    return Address(AddressType.RELATIVE_SPR, offset)
+
+
+def test_body_moves_arguments_and_drops_ret():
+    code = [
+        Term(Opcode.PUSH),
+        Term(Opcode.LOAD, stack(2)),
+        Term(Opcode.ADD, stack(0)),
+        Term(Opcode.POPN),
+        Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 3)),
+        Term(Opcode.JUMP, "other"),
+        Term(Opcode.HALT),
+        Term(Opcode.LOAD, Address(AddressType.EXACT, 1)),
+        Term(Opcode.RETURN),
+    ]
+    body = inliner.inline_body(code)
+    assert [str(term) for term in body] == [
+        "push",
+        "ld *sp+0x1",
+        "add *sp",
+        "popn",
+        "jme *ip+0x3",
+        "call other",
+        "jmp *ip+0x2",
+        "ld #0x1",
+    ]
+    assert inliner.inline_body([Term(Opcode.LOAD, stack(0)), Term(Opcode.RETURN)]) is None
+    assert inliner.inline_body([Term(Opcode.PUSH), Term(Opcode.RETURN)]) is None
+    assert inliner.inline_body([Term(Opcode.DIVMOD, Address(AddressType.EXACT, 10)), Term(Opcode.RETURN)]) is None
+
+
+def test_calls_are_replaced_and_jumps_retargeted():
+    loop = Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, -2))
+    code = [Term(Opcode.LOAD, "x"), Term(Opcode.CALL, "f"), loop, Term(Opcode.HALT)]
+    body = [Term(Opcode.STORE, "y"), Term(Opcode.LOAD, Address(AddressType.EXACT, 1))]
+    sites = []
+    result = inliner.inline_calls(code, {"f": inliner.Callee([*body, Term(Opcode.RETURN)], body)}, "start", sites)
+    assert [str(term) for term in result] == ["ld x", "st y", "ld #0x1", "jmp *ip-0x3", "halt"]
+    assert [(site.caller, site.callee, site.size) for site in sites] == [("start", "f", 1)]
+
+
+def run(code: isa.Code) -> tuple[str, int]:
+    output, _, ticks = machine.simulation(isa.deserialize(isa.serialize(code)), list("ab\n"), mode="fast")
+    return output, ticks
+
+
+def test_inlined_functions_are_dropped():
+    many = "(defun many (n) (+ n n n n n n n n n n))"
+    source = f"(defun twice (n) (+ n n)) {many} (printc (twice 33)) (printc (many 7)) (printc (many 7))"
+    code = translator.translate(source, inline_limit=4)
+    assert [block[2] for block in code.text] == ["#", "many", "start"]
+    output, ticks = run(code)
+    assert output == "BFF"
+    assert ticks < run(translator.translate(source, inline_limit=0))[1]
+
+
+def test_tail_call_of_inlined_function_returns_to_the_site():
+    source = "(defun show (a b) (printc b)) (defun swap (a b) (show b a)) (swap 65 (readchar)) (printi (swap 66 0))"
+    code = translator.translate(source)
+    assert [block[2] for block in code.text] == ["#", "swap", "print", "start"]
+    output, ticks = run(code)
+    assert output == "AB1"
+    assert ticks < run(translator.translate(source, inline_limit=0))[1]
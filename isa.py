@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import json
+import struct
+import sys
 from enum import Enum
 
 
@@ -34,6 +36,11 @@ class Opcode(str, Enum):
     DIVIDE = "div"
     INVERSE = "inv"
 
+    JUMP_ZERO = "jmz"
+    INCREMENT_JUMP_NONZERO = "ijnz"
+    DECREMENT_JUMP_NONZERO = "djnz"
+    DIVMOD = "divmod"
+
 
 no_arg_ops: list[Opcode] = [Opcode.HALT, Opcode.RETURN, Opcode.PUSH, Opcode.POP, Opcode.POPN, Opcode.INVERSE]
 
@@ -46,6 +53,9 @@ addr_ops: list[Opcode] = [
     Opcode.JUMP,
     Opcode.INCREMENT,
     Opcode.DECREMENT,
+    Opcode.JUMP_ZERO,
+    Opcode.INCREMENT_JUMP_NONZERO,
+    Opcode.DECREMENT_JUMP_NONZERO,
 ]
 
 value_ops: list[Opcode] = [
@@ -56,9 +66,21 @@ value_ops: list[Opcode] = [
     Opcode.SUBTRACT,
     Opcode.MULTIPLY,
     Opcode.DIVIDE,
+    Opcode.DIVMOD,
 ]
 
-branch_ops: list[Opcode] = [Opcode.JUMP_EQUAL, Opcode.JUMP_GREATER, Opcode.JUMP_GREATER_EQUAL, Opcode.JUMP]
+branch_ops: list[Opcode] = [
+    Opcode.JUMP_EQUAL,
+    Opcode.JUMP_GREATER,
+    Opcode.JUMP_GREATER_EQUAL,
+    Opcode.JUMP,
+    Opcode.JUMP_ZERO,
+    Opcode.INCREMENT_JUMP_NONZERO,
+    Opcode.DECREMENT_JUMP_NONZERO,
+]
+
+# counter of ijnz/djnz and quotient of divmod are the word at the stack top, besides the operand
+stack_top_ops: list[Opcode] = [Opcode.INCREMENT_JUMP_NONZERO, Opcode.DECREMENT_JUMP_NONZERO, Opcode.DIVMOD]
 
 
 class AddressType(str, Enum):
@@ -77,6 +99,8 @@ offset_addresses: list[AddressType] = [
 
 
 class Address:
+    __slots__ = fields = ("tag", "val")
+
     def __init__(self, tag: AddressType, val: int):
         self.tag = tag
         self.val = val
@@ -92,6 +116,10 @@ class Address:
 
 
 class Term:
+    # programs of millions of instructions are kept in memory by the translator
+    __slots__ = ("arg", "desc", "op")
+    fields = ("op", "arg", "desc")
+
     def __init__(self, op: Opcode, arg: str | int | Address | None = None, desc: str | None = None):
         self.op = op
         self.arg = arg
@@ -129,7 +157,8 @@ class Code:
 
 
 def default_serialize(obj):
-    return {k: v for k, v in obj.__dict__.items() if v is not None}
+    names = getattr(obj, "fields", None) or obj.__dict__
+    return {name: getattr(obj, name) for name in names if getattr(obj, name) is not None}
 
 
 def code_to_words(code: Code) -> list[Word]:
@@ -179,3 +208,98 @@ def deserialize(string: str) -> list[Word]:
                     word.val = ord(val)
         words.append(word)
     return words
+
+
+# Binary executable: header, one 8-byte record per word, optional debug section (JSON with block names and desc).
+# Record is (data value, instruction field); instruction field packs operand (bits 0-19), addressing mode
+# (bits 20-23) and opcode index + 1 (bits 24-31), it is zero for data words. New opcodes must be appended.
+BINARY_MAGIC = b"ACL3"
+BINARY_VERSION = 1
+binary_header = struct.Struct("<4sHHII")
+binary_word = struct.Struct("<II")
+NO_ADDRESS = 0xF
+
+binary_opcodes: list[Opcode] = list(Opcode)
+binary_address_types: list[AddressType] = list(AddressType)
+
+
+def encode_instruction(instr: Term) -> int:
+    field = (binary_opcodes.index(instr.op) + 1) << 24
+    if instr.arg is None:
+        return field | NO_ADDRESS << 20
+    assert -(1 << 19) <= instr.arg.val < (1 << 20), f"operand must fit in 20 bits, got {instr.arg.val}"
+    return field | binary_address_types.index(instr.arg.tag) << 20 | instr.arg.val & 0xFFFFF
+
+
+def decode_instruction(field: int) -> Term:
+    op, mode, val = binary_opcodes[(field >> 24) - 1], (field >> 20) & 0xF, field & 0xFFFFF
+    if mode == NO_ADDRESS:
+        return Term(op)
+    return Term(op, Address(binary_address_types[mode], val - (1 << 20) if val & 0x80000 else val))
+
+
+def debug_info(code: Code) -> dict:
+    return {
+        "blocks": [[start, size, name] for start, size, name, _ in code.text + code.data],
+        "desc": [
+            [addr, word.instr.desc] for addr, word in enumerate(code_to_words(code)) if word.instr and word.instr.desc
+        ],
+    }
+
+
+def serialize_words_binary(words: list[Word], debug_section: bytes = b"") -> bytes:
+    records = []
+    for word in words:
+        if word.tag == WordType.INSTRUCTION:
+            records.append(binary_word.pack(0, encode_instruction(word.instr)))
+        else:
+            records.append(binary_word.pack(ord(word.val) if isinstance(word.val, str) else word.val, 0))
+    header = binary_header.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(records), len(debug_section))
+    return b"".join([header, *records, debug_section])
+
+
+def serialize_binary(code: Code, debug: bool = True) -> bytes:
+    debug_section = json.dumps(debug_info(code), ensure_ascii=False).encode() if debug else b""
+    return serialize_words_binary(code_to_words(code), debug_section)
+
+
+def is_binary(buffer) -> bool:
+    return bytes(buffer[: len(BINARY_MAGIC)]) == BINARY_MAGIC
+
+
+def binary_sections(buffer) -> tuple[memoryview, memoryview]:
+    """Word records and debug section of a binary executable, without copying."""
+    magic, version, _, count, debug_size = binary_header.unpack_from(buffer)
+    assert magic == BINARY_MAGIC, "not a binary executable"
+    assert version == BINARY_VERSION, f"unsupported binary executable version, got {version}"
+    view = memoryview(buffer)
+    words_end = binary_header.size + count * binary_word.size
+    assert len(view) == words_end + debug_size, "binary executable is truncated"
+    return view[binary_header.size : words_end], view[words_end:]
+
+
+def read_debug_info(buffer) -> dict | None:
+    debug_section = binary_sections(buffer)[1]
+    return json.loads(bytes(debug_section).decode()) if len(debug_section) > 0 else None
+
+
+def deserialize_binary(buffer) -> list[Word]:
+    words = []
+    records, _ = binary_sections(buffer)
+    for val, field in binary_word.iter_unpack(records):
+        words.append(
+            Word(WordType.BINARY, val=val) if field == 0 else Word(WordType.INSTRUCTION, decode_instruction(field))
+        )
+    for addr, desc in (read_debug_info(buffer) or {"desc": []})["desc"]:
+        words[addr].instr.desc = desc
+    return words
+
+
+def export_json(buffer) -> str:
+    """JSON form of a binary executable for debugging."""
+    return json.dumps(deserialize_binary(buffer), default=default_serialize, indent=2)
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as file:
+        sys.stdout.write(export_json(file.read()))
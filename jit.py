@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import collections
+import functools
+import math
+import typing
+
+from isa import Address, AddressType, Opcode, Term, branch_ops
+from machine import (
+    PAGE_SHIFT,
+    DataPath,
+    FastControlUnit,
+    branch_conditions,
+    extend_bits,
+    fast_divide,
+    fast_modulo,
+    instruction_ticks,
+    mask_32,
+    value_branch_probes,
+)
+from stdlib import INPUT_PORT, OUTPUT_PORT
+
+HOT_THRESHOLD = 8
+BLOCK_LIMIT = 256
+
+terminators: list[Opcode] = [Opcode.HALT, Opcode.CALL, Opcode.RETURN, *branch_ops]
+
+math_operators = {Opcode.ADD: "+", Opcode.SUBTRACT: "-", Opcode.MULTIPLY: "*"}
+math_functions = {Opcode.DIVIDE: "divide", Opcode.MODULO: "modulo"}
+
+
+class Block:
+    """Straight-line run of instructions compiled into one Python function.
+
+    `function(data_path)` executes the whole block and returns its ticks. `size` is
+    the amount of instructions it retires (a final halt is not counted, see `halts`).
+    `addresses` and `prefix_ticks` locate the instruction an interrupted block stopped at.
+    """
+
+    def __init__(self, entry: int):
+        self.entry = entry
+        self.addresses: list[int] = []
+        self.prefix_ticks: list[int] = []
+        self.size = 0
+        self.halts = False
+        self.source = ""
+        self.function: typing.Callable[[DataPath], int] | None = None
+
+
+def operand(arg: Address) -> int:
+    return extend_bits(arg.val, 20) & mask_32
+
+
+class BlockCompiler:
+    def __init__(self, control_unit: BlockControlUnit):
+        self.control_unit = control_unit
+        self.data_path = control_unit.data_path
+        self.ticks_table = instruction_ticks()
+        self.special = frozenset(
+            [INPUT_PORT, OUTPUT_PORT, *(addr for addr, tag in enumerate(self.data_path.tags) if tag)]
+        )
+        self.emitters: dict[Opcode, typing.Callable[[Term], list[str]]] = {
+            Opcode.NOOP: lambda instr: ["pass"],
+            Opcode.LOAD: self.emit_load,
+            Opcode.STORE: self.emit_store,
+            Opcode.PUSH: lambda instr: ["sp = (sp - 1) & M", "ar = sp", *self.write("ar", "ac")],
+            Opcode.POP: lambda instr: ["ar = sp", f"ac = {self.read('ar')}", "sp = (sp + 1) & M"],
+            Opcode.POPN: lambda instr: ["sp = (sp + 1) & M"],
+            Opcode.COMPARE: self.emit_compare,
+            Opcode.INCREMENT: self.emit_add_to_memory,
+            Opcode.DECREMENT: self.emit_add_to_memory,
+            Opcode.MODULO: self.emit_math,
+            Opcode.ADD: self.emit_math,
+            Opcode.SUBTRACT: self.emit_math,
+            Opcode.MULTIPLY: self.emit_math,
+            Opcode.DIVIDE: self.emit_math,
+            Opcode.INVERSE: lambda instr: ["ac = -ac & M"],
+            Opcode.DIVMOD: self.emit_divmod,
+        }
+        self.terminator_emitters: dict[Opcode, typing.Callable[[Term, int, int], list[str]]] = {
+            Opcode.HALT: lambda instr, addr, ticks: [f"ip = {addr}"],
+            Opcode.CALL: self.emit_call,
+            Opcode.RETURN: self.emit_return,
+            Opcode.JUMP_EQUAL: self.emit_conditional_jump,
+            Opcode.JUMP_GREATER: self.emit_conditional_jump,
+            Opcode.JUMP_GREATER_EQUAL: self.emit_conditional_jump,
+            Opcode.JUMP: self.emit_jump,
+            Opcode.JUMP_ZERO: lambda instr, addr, ticks: [
+                "fl = alu_sum(ac, 0)[1]",
+                *self.emit_branch(instr, addr, ticks, "ac == 0"),
+            ],
+            Opcode.INCREMENT_JUMP_NONZERO: self.emit_count_jump,
+            Opcode.DECREMENT_JUMP_NONZERO: self.emit_count_jump,
+        }
+
+    def read(self, addr: str | int) -> str:
+        if isinstance(addr, int):
+            return f"memory[{addr}]" if self.data_path.is_plain_data(addr) else f"read({addr})"
+        return f"(read({addr}) if {addr} in special else memory[{addr}])"
+
+    def write(self, addr: str | int, value: str) -> list[str]:
+        if isinstance(addr, int):
+            if self.data_path.is_plain_data(addr):
+                return [f"memory[{addr}] = {value}", f"dirty[{addr >> PAGE_SHIFT}] = 1"]
+            return [f"write({addr}, {value})"]
+        return [
+            f"if {addr} in special:",
+            f"    write({addr}, {value})",
+            "else:",
+            f"    memory[{addr}] = {value}",
+            f"    dirty[{addr} >> {PAGE_SHIFT}] = 1",
+        ]
+
+    def address(self, arg: Address) -> tuple[list[str], str | int]:
+        match arg.tag:
+            case AddressType.EXACT:
+                return [], "ar"
+            case AddressType.ABSOLUTE:
+                return [f"ar = {operand(arg)}"], operand(arg)
+            case AddressType.RELATIVE_SPR:
+                return [f"ar = ({operand(arg)} + sp) & M"], "ar"
+            case AddressType.RELATIVE_INDIRECT_SPR:
+                return [f"ar = ({operand(arg)} + sp) & M", f"ar = {self.read('ar')}"], "ar"
+        raise NotImplementedError(f"unsupported address type for block compilation, got {arg}")
+
+    def value(self, arg: Address) -> tuple[list[str], str]:
+        if arg.tag == AddressType.EXACT:
+            return [], str(operand(arg))
+        lines, addr = self.address(arg)
+        return lines, self.read(addr)
+
+    def emit_load(self, instr: Term) -> list[str]:
+        lines, value = self.value(instr.arg)
+        return [*lines, f"ac = {value}"]
+
+    def emit_store(self, instr: Term) -> list[str]:
+        lines, addr = self.address(instr.arg)
+        return [*lines, *self.write(addr, "ac")]
+
+    def emit_compare(self, instr: Term) -> list[str]:
+        lines, value = self.value(instr.arg)
+        return [*lines, f"fl = alu_sum(ac, ~{value} & M, 1)[1]"]
+
+    def emit_math(self, instr: Term) -> list[str]:
+        lines, value = self.value(instr.arg)
+        if instr.op in math_functions:
+            return [*lines, f"ac = {math_functions[instr.op]}(ac, {value})"]
+        return [*lines, f"ac = (ac {math_operators[instr.op]} {value}) & M"]
+
+    def emit_divmod(self, instr: Term) -> list[str]:
+        lines, value = self.value(instr.arg)
+        return [*lines, f"dr = {value}", "ar = sp", *self.write("ar", "divide(ac, dr)"), "ac = modulo(ac, dr)"]
+
+    def emit_add_to_memory(self, instr: Term) -> list[str]:
+        lines, addr = self.address(instr.arg)
+        sign = "+" if instr.op == Opcode.INCREMENT else "-"
+        return [*lines, f"dr = {self.read(addr)}", *self.write(addr, f"(dr {sign} 1) & M")]
+
+    def emit_call(self, instr: Term, addr: int, ticks: int) -> list[str]:
+        assert instr.arg.tag == AddressType.ABSOLUTE, f"unsupported addressing for call, got {instr}"
+        return ["sp = (sp - 1) & M", "ar = sp", *self.write("ar", str(addr + 1)), f"ip = {operand(instr.arg)}"]
+
+    # noinspection PyUnusedLocal
+    def emit_return(self, instr: Term, addr: int, ticks: int) -> list[str]:
+        return ["ar = sp", f"ip = {self.read('ar')}", "sp = (sp + 1) & M"]
+
+    def emit_conditional_jump(self, instr: Term, addr: int, ticks: int) -> list[str]:
+        return self.emit_branch(instr, addr, ticks, f"{instr.op.name.lower()}_taken[fl]")
+
+    def emit_count_jump(self, instr: Term, addr: int, ticks: int) -> list[str]:
+        operands = "dr, 0, 1" if instr.op == Opcode.INCREMENT_JUMP_NONZERO else "M, dr, 0"
+        return [
+            "ar = sp",
+            f"dr = {self.read('ar')}",
+            f"dr, fl = alu_sum({operands})",
+            *self.write("ar", "dr"),
+            *self.emit_branch(instr, addr, ticks, "dr != 0"),
+        ]
+
+    def emit_branch(self, instr: Term, addr: int, ticks: int, condition: str) -> list[str]:
+        assert instr.arg.tag == AddressType.RELATIVE_IPR, f"unsupported addressing for {instr.op.value}, got {instr}"
+        not_taken, taken = self.ticks_table[(instr.op, instr.arg.tag)]
+        return [
+            f"if {condition}:",
+            f"    ar = {addr}",
+            f"    ip = {(operand(instr.arg) + addr) & mask_32}",
+            f"    ticks = {ticks + taken}",
+            "else:",
+            f"    ip = {addr + 1}",
+            f"    ticks = {ticks + not_taken}",
+        ]
+
+    def emit_jump(self, instr: Term, addr: int, ticks: int) -> list[str]:
+        if instr.arg.tag == AddressType.ABSOLUTE:
+            return [f"ip = {operand(instr.arg)}"]
+        assert instr.arg.tag == AddressType.RELATIVE_IPR, f"unsupported addressing for jmp, got {instr}"
+        return [f"ar = {addr}", f"ip = {(operand(instr.arg) + addr) & mask_32}"]
+
+    def instruction_cost(self, instr: Term) -> int | None:
+        key = (instr.op, None if instr.arg is None else instr.arg.tag)
+        return self.ticks_table[key][0] if key in self.ticks_table else None
+
+    def emit_instruction(self, instr: Term) -> list[str] | None:
+        if instr.op not in self.emitters or self.instruction_cost(instr) is None:
+            return None
+        try:
+            return self.emitters[instr.op](instr)
+        except NotImplementedError:
+            return None
+
+    def emit_terminator(self, instr: Term, addr: int, ticks: int) -> list[str] | None:
+        if instr.op not in self.terminator_emitters or self.instruction_cost(instr) is None:
+            return None
+        lines = self.terminator_emitters[instr.op](instr, addr, ticks)
+        if instr.op in branch_conditions or instr.op in value_branch_probes:
+            return lines
+        return [*lines, f"ticks = {ticks + self.instruction_cost(instr)}"]
+
+    def body(self, block: Block) -> list[str]:
+        lines, ticks, addr = [], 0, block.entry
+        while len(block.addresses) < BLOCK_LIMIT and self.data_path.is_instruction(addr):
+            instr = self.data_path.instructions[addr]
+            code = self.emit_terminator(instr, addr, ticks) if instr.op in terminators else self.emit_instruction(instr)
+            if code is None:
+                break
+            if any("read(" in line for line in code):
+                lines.append(f"i = {len(block.addresses)}")
+            block.addresses.append(addr)
+            block.prefix_ticks.append(ticks)
+            lines.extend(code)
+            if instr.op in terminators:
+                block.halts = instr.op == Opcode.HALT
+                block.size = len(block.addresses) - block.halts
+                return lines
+            ticks += self.instruction_cost(instr)
+            addr += 1
+        block.size = len(block.addresses)
+        return [*lines, f"ip = {addr}", f"ticks = {ticks}"]
+
+    def compile(self, entry: int) -> Block | None:
+        block = Block(entry)
+        body = self.body(block)
+        if len(block.addresses) == 0:
+            return None
+        namespace = {
+            "memory": self.data_path.memory,
+            "dirty": self.data_path.dirty_pages,
+            "read": self.data_path.read_word,
+            "write": self.data_path.write_word,
+            "special": self.special,
+            "alu_sum": self.data_path.alu_sum,
+            "divide": fast_divide,
+            "modulo": fast_modulo,
+            "interrupted": functools.partial(self.control_unit.block_interrupted, block),
+            "M": mask_32,
+        }
+        for op, condition in branch_conditions.items():
+            namespace[f"{op.name.lower()}_taken"] = tuple(condition(fl) for fl in range(16))
+        defaults = ", ".join(f"{name}={name}" for name in namespace)
+        block.source = "\n".join(
+            [
+                f"def block(dp, {defaults}):",
+                "    ac, sp, fl, ar = dp.ac, dp.sp, dp.fl, dp.ar",
+                "    i = 0",
+                "    try:",
+                *(f"        {line}" for line in body),
+                "    except EOFError:",
+                "        dp.ac, dp.sp, dp.fl, dp.ar = ac, sp, fl, ar",
+                "        interrupted(i)",
+                "        raise",
+                "    dp.ac, dp.sp, dp.fl, dp.ar, dp.ip = ac, sp, fl, ar, ip",
+                "    return ticks",
+            ]
+        )
+        exec(compile(block.source, f"<block {entry:#x}>", "exec"), namespace)
+        block.function = namespace["block"]
+        return block
+
+
+class BlockControlUnit(FastControlUnit):
+    """Executes hot basic blocks as compiled Python functions.
+
+    A block starts at a jump target and ends after a branch, call, ret or halt.
+    Entries are interpreted by FastControlUnit until they are reached HOT_THRESHOLD
+    times, then compiled once. Code the compiler does not support and blocks that do not
+    fit the instruction or tick limit fall back to the interpreter.
+    """
+
+    def __init__(self, data_path: DataPath):
+        super().__init__(data_path)
+        self.compiler = BlockCompiler(self)
+        self.blocks: dict[int, Block | None] = {}
+        self.visits: collections.Counter[int] = collections.Counter()
+
+    def block_at(self, entry: int) -> Block | None:
+        if entry in self.blocks:
+            return self.blocks[entry]
+        self.visits[entry] += 1
+        if self.visits[entry] < HOT_THRESHOLD:
+            return None
+        self.blocks[entry] = self.compiler.compile(entry)
+        return self.blocks[entry]
+
+    def block_interrupted(self, block: Block, index: int):
+        self.data_path.ip = block.addresses[index]
+        self.instr_counter += index
+        self.ticks += block.prefix_ticks[index]
+        # nothing is changed before the input port read, so micro-signal replay counts the partial ticks
+        if self.replay_eof:
+            self.execute_instruction(self.data_path.signal_fetch_instr())
+
+    def run(self, limit: int, tick_limit: int | None = None):
+        data_path = self.data_path
+        tick_bound = math.inf if tick_limit is None else tick_limit
+        while self.instr_counter < limit and self.ticks < tick_bound:
+            block = self.block_at(data_path.ip)
+            if (
+                block is not None
+                and self.instr_counter + block.size + block.halts <= limit
+                and self.ticks + block.prefix_ticks[-1] < tick_bound
+            ):
+                self.ticks += block.function(data_path)
+                self.instr_counter += block.size
+                if block.halts:
+                    raise StopIteration()
+            else:
+                self.execute_next_instruction()
+                self.instr_counter += 1
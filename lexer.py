@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import functools
+import io
 import re
-import sys
+import typing
 
 import stdlib
 
@@ -15,14 +17,20 @@ MATH = "MATH"
 BOOL = "BOOL"
 DEFUNC = "DEFUNC"
 
+
+def keyword(name: str) -> str:
+    # a keyword is not a prefix of a longer identifier: `settle` is ID, not `set` and `tle`
+    return re.escape(name) + r"(?![A-Za-z_])"
+
+
 token_expressions = [
     (r"[ \n\t]+", None),
     (r"#[^\n]*", None),
     (r"\(", RESERVED),
     (r"\)", RESERVED),
-    (r"set", SPECIAL),
-    (r"if", SPECIAL),
-    (r"loop", SPECIAL),
+    (keyword("set"), SPECIAL),
+    (keyword("if"), SPECIAL),
+    (keyword("loop"), SPECIAL),
     (r"=", BOOL),
     (r">=", BOOL),
     (r">", BOOL),
@@ -31,43 +39,64 @@ token_expressions = [
     (r"-", MATH),
     (r"\*", MATH),
     (r"/", MATH),
-    (r"mod", MATH),
-    (r"defun", DEFUNC),
+    (keyword("mod"), MATH),
+    (keyword("defun"), DEFUNC),
     (r"\"(.*?)\"", STR),
-    (r"[A-Za-z_]*", ID),
 ]
 
 for func in stdlib.ALL_FUNCS:
-    token_expressions.append((func.name, FUNC))
+    token_expressions.append((keyword(func.name), FUNC))
+
+token_expressions.append((r"[A-Za-z_]+", ID))
 
 
 class TokenInfo:
-    def __init__(self, tag: str, string: str, pos: int):
+    def __init__(self, tag: str, string: str, pos: int, line: int = 1, col: int = 1):
         self.tag = tag
         self.string = string
         self.pos = pos
+        self.line = line
+        self.col = col
 
     def __repr__(self):
         return f"TokenInfo(string={self.string},tag={self.tag},pos={self.pos})"
 
 
-def lex(characters: str, token_exprs: list[tuple[str, str]]):
-    pos = 0
-    tokens = []
-    while pos < len(characters):
-        match = None
-        for token_expr in token_exprs:
-            pattern, tag = token_expr
-            regex = re.compile(pattern)
-            match = regex.match(characters, pos)
-            if match:
-                text = match.group(0)
-                if tag:
-                    tokens.append(TokenInfo(tag, text, pos))
-                break
-        if not match:
-            sys.stderr.write("Illegal character: %s\n" % characters[pos])
-            sys.exit(1)
-        else:
-            pos = match.end(0)
-    return tokens
+class LexError(SyntaxError):
+    def __init__(self, symbol: str, line: int, col: int, text: str):
+        super().__init__(f"Illegal character {symbol!r} at column {col}", (None, line, col, text))
+
+
+@functools.cache
+def master_pattern(token_exprs: tuple[tuple[str, str | None], ...]) -> tuple[re.Pattern, dict[str, str | None]]:
+    """One regex of all token expressions, alternatives are tried in order like separate patterns."""
+    groups = {f"t{index}": tag for index, (_, tag) in enumerate(token_exprs)}
+    regex = "|".join(f"(?P<t{index}>{pattern})" for index, (pattern, _) in enumerate(token_exprs))
+    return re.compile(regex), groups
+
+
+def lex(
+    characters: str | typing.Iterable[str], token_exprs: list[tuple[str, str | None]] = token_expressions
+) -> typing.Iterator[TokenInfo]:
+    """Tokens of a source string or of a text stream, produced lazily.
+
+    A stream is read line by line: no token except whitespace crosses a line end, so only
+    the current line is kept in memory.
+
+    >>> [(token.tag, token.string, token.line, token.col) for token in lex('(print\\n  "hi")')]
+    [('RESERVED', '(', 1, 1), ('FUNC', 'print', 1, 2), ('STR', '"hi"', 2, 3), ('RESERVED', ')', 2, 7)]
+    """
+    master, groups = master_pattern(tuple(token_exprs))
+    lines = io.StringIO(characters) if isinstance(characters, str) else characters
+    line_start = 0
+    for line_number, line in enumerate(lines, 1):
+        pos = 0
+        while pos < len(line):
+            match = master.match(line, pos)
+            if match is None or match.end() == pos:
+                raise LexError(line[pos], line_number, pos + 1, line)
+            tag = groups[match.lastgroup]
+            if tag:
+                yield TokenInfo(tag, match.group(), line_start + pos, line_number, pos + 1)
+            pos = match.end()
+        line_start += len(line)
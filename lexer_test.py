@@ -0,0 +1,38 @@
+import io
+import os
+
+import lexer
+import pytest
+from machine_test import examples
+
+
+@pytest.mark.parametrize("name", examples)
+def test_stream_matches_string(name):
+    with open(os.path.join("examples", name), encoding="utf-8") as file:
+        source = file.read()
+    with open(os.path.join("examples", name), encoding="utf-8") as file:
+        streamed = [(token.tag, token.string, token.pos) for token in lexer.lex(file)]
+    tokens = list(lexer.lex(source))
+    assert streamed == [(token.tag, token.string, token.pos) for token in tokens]
+    assert all(source[token.pos : token.pos + len(token.string)] == token.string for token in tokens)
+
+
+def test_keywords_are_not_prefixes():
+    tokens = lexer.lex('(settle ifx printi mod modx "s" -5 - >=)')
+    assert [(token.tag, token.string) for token in tokens][1:-1] == [
+        (lexer.ID, "settle"),
+        (lexer.ID, "ifx"),
+        (lexer.FUNC, "printi"),
+        (lexer.MATH, "mod"),
+        (lexer.ID, "modx"),
+        (lexer.STR, '"s"'),
+        (lexer.INT, "-5"),
+        (lexer.MATH, "-"),
+        (lexer.BOOL, ">="),
+    ]
+
+
+def test_illegal_character_position():
+    with pytest.raises(lexer.LexError) as error:
+        list(lexer.lex(io.StringIO('(print "a")\n  (set x !)')))
+    assert (error.value.lineno, error.value.offset) == (2, 10)
@@ -0,0 +1,495 @@
+from __future__ import annotations
+
+import array
+import typing
+
+import numpy as np
+from isa import Address, AddressType, Opcode, Term, Word
+from machine import (
+    DataPath,
+    FastControlUnit,
+    OutputPort,
+    ProgramImage,
+    branch_taken,
+    extend_bits,
+    instruction_ticks,
+    mask_32,
+    run_control_unit,
+)
+from stdlib import INPUT_PORT, OUTPUT_PORT
+
+RUNNING, HALTED, LIMIT, EJECTED = 0, 1, 2, 3
+
+Lanes = np.ndarray
+Handler = typing.Callable[[Lanes], None]
+
+
+def vector_sum(left: np.ndarray | int, right: np.ndarray | int, carry: int) -> tuple[np.ndarray, np.ndarray]:
+    """`machine.alu_sum` over lanes."""
+    total = left + right + carry
+    result, carry_out = total & mask_32, total >> 32
+    carry_31 = ((left & 0x7FFFFFFF) + (right & 0x7FFFFFFF) + carry) >> 31
+    return result, (result >> 31) * 8 + (result == 0) * 4 + (carry_31 != carry_out) * 2 + carry_out
+
+
+class LockstepEngine:
+    """Runs one program over many inputs, one instruction per step across all lanes.
+
+    Registers, counters and memory of every lane are NumPy arrays. Lanes are grouped by
+    ip on every step, so diverged lanes run as separate groups and join again when their
+    ip matches. Data memory of a lane is the low `low_size` words (program data and
+    variables) and the top `stack_size` words (stack). A lane which touches other memory,
+    finds its input empty or would fail an assertion is ejected: its state is moved into
+    a FastControlUnit which finishes the run exactly as `machine.simulation` does.
+    """
+
+    def __init__(
+        self,
+        code: list[Word] | ProgramImage,
+        inputs: list[str],
+        memory_size: int = 0x1FFF,
+        limit: int = 5_000,
+        low_size: int | None = None,
+        stack_size: int = 1 << 10,
+    ):
+        self.image = code if isinstance(code, ProgramImage) else ProgramImage(code)
+        self.memory_size = memory_size
+        self.limit = limit
+        self.low_size = self.default_low_size() if low_size is None else low_size
+        self.stack_base = max(memory_size - stack_size, self.low_size)
+        assert len(self.image) <= self.low_size <= memory_size, "low memory must hold the program"
+        self.tags = np.frombuffer(self.image.tags, np.uint8)
+        self.ticks_table = instruction_ticks()
+
+        count = len(inputs)
+        self.ac = np.zeros(count, np.int64)
+        self.ip = np.zeros(count, np.int64)
+        self.ar = np.zeros(count, np.int64)
+        self.sp = np.full(count, memory_size, np.int64)
+        self.fl = np.zeros(count, np.int64)
+        self.ticks = np.zeros(count, np.int64)
+        self.instr = np.zeros(count, np.int64)
+        self.status = np.full(count, RUNNING, np.int8)
+        self.memory = np.zeros((count, self.low_size + memory_size - self.stack_base), np.uint32)
+        self.memory[:, : len(self.image)] = np.frombuffer(self.image.data, np.uint32)
+
+        self.in_len = np.array([len(text) for text in inputs], np.int64)
+        self.in_pos = np.zeros(count, np.int64)
+        self.in_buf = np.zeros((count, max(1, int(self.in_len.max(initial=0)))), np.int64)
+        for lane, text in enumerate(inputs):
+            self.in_buf[lane, : len(text)] = [ord(symbol) for symbol in text]
+        self.out_len = np.zeros(count, np.int64)
+        self.out_buf = np.zeros((count, 64), np.uint32)
+        self.results: list[tuple[str, int, int] | None] = [None] * count
+
+        self.handlers: dict[int, Handler] = {}
+        self.handler_factories: dict[Opcode, typing.Callable[[Term, tuple[int, int]], Handler]] = {
+            Opcode.HALT: self.vector_halt,
+            Opcode.NOOP: self.vector_noop,
+            Opcode.LOAD: self.vector_load,
+            Opcode.STORE: self.vector_store,
+            Opcode.CALL: self.vector_call,
+            Opcode.RETURN: self.vector_return,
+            Opcode.PUSH: self.vector_push,
+            Opcode.POP: self.vector_pop,
+            Opcode.POPN: self.vector_popn,
+            Opcode.COMPARE: self.vector_compare,
+            Opcode.JUMP_EQUAL: self.vector_conditional_jump,
+            Opcode.JUMP_GREATER: self.vector_conditional_jump,
+            Opcode.JUMP_GREATER_EQUAL: self.vector_conditional_jump,
+            Opcode.JUMP: self.vector_jump,
+            Opcode.INCREMENT: self.vector_add_to_memory,
+            Opcode.DECREMENT: self.vector_add_to_memory,
+            Opcode.MODULO: self.vector_alu,
+            Opcode.ADD: self.vector_alu,
+            Opcode.SUBTRACT: self.vector_alu,
+            Opcode.MULTIPLY: self.vector_alu,
+            Opcode.DIVIDE: self.vector_alu,
+            Opcode.INVERSE: self.vector_inverse,
+            Opcode.JUMP_ZERO: self.vector_jump_zero,
+            Opcode.INCREMENT_JUMP_NONZERO: self.vector_count_jump,
+            Opcode.DECREMENT_JUMP_NONZERO: self.vector_count_jump,
+            Opcode.DIVMOD: self.vector_divmod,
+        }
+
+    def default_low_size(self) -> int:
+        # program words, statically addressed variables and room for the buffers after them
+        operands = [
+            extend_bits(instr.arg.val, 20) & mask_32
+            for instr in (self.image.instructions[addr] for addr in range(len(self.image)))
+            if instr is not None
+            and instr.arg is not None
+            and instr.arg.tag in (AddressType.EXACT, AddressType.ABSOLUTE)
+        ]
+        static = [operand for operand in operands if operand < INPUT_PORT]
+        return min(max([len(self.image), *static]) + 1 + (1 << 8), self.memory_size)
+
+    # memory access
+
+    def physical(self, addr: np.ndarray) -> np.ndarray:
+        return np.where(addr < self.low_size, addr, addr - self.stack_base + self.low_size)
+
+    def is_data(self, addr: np.ndarray) -> np.ndarray:
+        mapped = (addr < self.low_size) | ((addr >= self.stack_base) & (addr < self.memory_size))
+        mapped &= (addr != INPUT_PORT) & (addr != OUTPUT_PORT)
+        is_instruction = np.zeros(len(addr), bool)
+        in_program = addr < len(self.tags)
+        is_instruction[in_program] = self.tags[addr[in_program]] == 1
+        return mapped & ~is_instruction
+
+    def readable(self, lanes: Lanes, addr: np.ndarray) -> np.ndarray:
+        has_input = (self.in_pos[lanes] < self.in_len[lanes]) & (INPUT_PORT < self.memory_size)
+        return self.is_data(addr) | ((addr == INPUT_PORT) & has_input)
+
+    def writable(self, addr: np.ndarray, values: np.ndarray) -> np.ndarray:
+        is_symbol = (values <= 0x10FFFF) & (OUTPUT_PORT < self.memory_size)
+        return self.is_data(addr) | ((addr == OUTPUT_PORT) & is_symbol)
+
+    def keep(self, lanes: Lanes, ok: np.ndarray, *arrays: np.ndarray) -> tuple[np.ndarray, ...]:
+        """Ejects lanes which are not ok, returns the rest with the matching parts of `arrays`."""
+        if ok.all():
+            return lanes, *arrays
+        self.eject(lanes[~ok])
+        return lanes[ok], *(array[ok] for array in arrays)
+
+    def read(self, lanes: Lanes, addr: np.ndarray) -> np.ndarray:
+        self.ar[lanes] = addr
+        values = np.zeros(len(lanes), np.int64)
+        from_port = addr == INPUT_PORT
+        if from_port.any():
+            port_lanes = lanes[from_port]
+            values[from_port] = self.in_buf[port_lanes, self.in_pos[port_lanes]]
+            self.in_pos[port_lanes] += 1
+        from_memory = ~from_port
+        values[from_memory] = self.memory[lanes[from_memory], self.physical(addr[from_memory])]
+        return values
+
+    def write(self, lanes: Lanes, addr: np.ndarray, values: np.ndarray):
+        self.ar[lanes] = addr
+        to_port = addr == OUTPUT_PORT
+        if to_port.any():
+            port_lanes = lanes[to_port]
+            if self.out_len[port_lanes].max() >= self.out_buf.shape[1]:
+                self.out_buf = np.concatenate([self.out_buf, np.zeros_like(self.out_buf)], axis=1)
+            self.out_buf[port_lanes, self.out_len[port_lanes]] = values[to_port]
+            self.out_len[port_lanes] += 1
+        to_memory = ~to_port
+        self.memory[lanes[to_memory], self.physical(addr[to_memory])] = values[to_memory]
+
+    # operands
+
+    def resolve(self, arg: Address) -> typing.Callable[[Lanes], tuple[Lanes, np.ndarray]]:
+        operand = extend_bits(arg.val, 20) & mask_32
+
+        def resolve_indirect(lanes: Lanes) -> tuple[Lanes, np.ndarray]:
+            pointer = (operand + self.sp[lanes]) & mask_32
+            lanes, pointer = self.keep(lanes, self.is_data(pointer), pointer)
+            return lanes, self.read(lanes, pointer)
+
+        resolvers = {
+            AddressType.EXACT: lambda lanes: (lanes, self.ar[lanes].copy()),
+            AddressType.ABSOLUTE: lambda lanes: (lanes, np.full(len(lanes), operand, np.int64)),
+            AddressType.RELATIVE_SPR: lambda lanes: (lanes, (operand + self.sp[lanes]) & mask_32),
+            AddressType.RELATIVE_INDIRECT_SPR: resolve_indirect,
+        }
+        if arg.tag not in resolvers:
+            raise NotImplementedError(f"unsupported address type for address decoding, got {arg}")
+        return resolvers[arg.tag]
+
+    def loader(self, arg: Address) -> typing.Callable[[Lanes], tuple[Lanes, np.ndarray]]:
+        operand = extend_bits(arg.val, 20) & mask_32
+        if arg.tag == AddressType.EXACT:
+            return lambda lanes: (lanes, np.full(len(lanes), operand, np.int64))
+        resolve = self.resolve(arg)
+
+        def load(lanes: Lanes) -> tuple[Lanes, np.ndarray]:
+            lanes, addr = resolve(lanes)
+            lanes, addr = self.keep(lanes, self.readable(lanes, addr), addr)
+            return lanes, self.read(lanes, addr)
+
+        return load
+
+    def retire(self, lanes: Lanes, cost: int | np.ndarray):
+        self.ticks[lanes] += cost
+        self.instr[lanes] += 1
+
+    def branch(self, lanes: Lanes, taken: np.ndarray, offset: int, ticks: tuple[int, int]):
+        taken_lanes, ip = lanes[taken], self.ip[lanes]
+        self.ar[taken_lanes] = ip[taken]
+        self.ip[lanes] = np.where(taken, (offset + ip) & mask_32, ip + 1)
+        self.retire(lanes, np.where(taken, ticks[1], ticks[0]))
+
+    # instructions
+
+    def vector_halt(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        def handler(lanes: Lanes):
+            self.status[lanes] = HALTED
+
+        return handler
+
+    def vector_noop(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        def handler(lanes: Lanes):
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_load(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        load = self.loader(instr.arg)
+
+        def handler(lanes: Lanes):
+            lanes, values = load(lanes)
+            self.ac[lanes] = values
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_store(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        resolve = self.resolve(instr.arg)
+
+        def handler(lanes: Lanes):
+            lanes, addr = resolve(lanes)
+            lanes, addr = self.keep(lanes, self.writable(addr, self.ac[lanes]), addr)
+            self.write(lanes, addr, self.ac[lanes])
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def push(self, lanes: Lanes, values: np.ndarray) -> tuple[Lanes, np.ndarray]:
+        addr = (self.sp[lanes] - 1) & mask_32
+        lanes, addr, values = self.keep(lanes, self.is_data(addr), addr, values)
+        self.sp[lanes] = addr
+        self.write(lanes, addr, values)
+        return lanes, values
+
+    def pop(self, lanes: Lanes) -> tuple[Lanes, np.ndarray]:
+        addr = self.sp[lanes]
+        lanes, addr = self.keep(lanes, self.is_data(addr), addr)
+        values = self.read(lanes, addr)
+        self.sp[lanes] = (addr + 1) & mask_32
+        return lanes, values
+
+    def vector_call(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        target = extend_bits(instr.arg.val, 20) & mask_32
+
+        def handler(lanes: Lanes):
+            lanes, _ = self.push(lanes, self.ip[lanes] + 1)
+            self.ip[lanes] = target
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_return(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        def handler(lanes: Lanes):
+            lanes, values = self.pop(lanes)
+            self.ip[lanes] = values
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_push(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        def handler(lanes: Lanes):
+            lanes, _ = self.push(lanes, self.ac[lanes])
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_pop(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        def handler(lanes: Lanes):
+            lanes, values = self.pop(lanes)
+            self.ac[lanes] = values
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_popn(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        def handler(lanes: Lanes):
+            self.sp[lanes] = (self.sp[lanes] + 1) & mask_32
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_compare(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        load = self.loader(instr.arg)
+
+        def handler(lanes: Lanes):
+            lanes, values = load(lanes)
+            _, self.fl[lanes] = vector_sum(self.ac[lanes], ~values & mask_32, 1)
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_conditional_jump(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        offset = extend_bits(instr.arg.val, 20) & mask_32
+        taken_by_flags = np.array([branch_taken(instr.op, fl) for fl in range(16)])
+
+        def handler(lanes: Lanes):
+            self.branch(lanes, taken_by_flags[self.fl[lanes]], offset, ticks)
+
+        return handler
+
+    def vector_jump_zero(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        offset = extend_bits(instr.arg.val, 20) & mask_32
+
+        def handler(lanes: Lanes):
+            _, self.fl[lanes] = vector_sum(self.ac[lanes], 0, 0)
+            self.branch(lanes, self.ac[lanes] == 0, offset, ticks)
+
+        return handler
+
+    def vector_count_jump(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        offset = extend_bits(instr.arg.val, 20) & mask_32
+        left, carry = (0, 1) if instr.op == Opcode.INCREMENT_JUMP_NONZERO else (mask_32, 0)
+
+        def handler(lanes: Lanes):
+            addr = self.sp[lanes]
+            lanes, addr = self.keep(lanes, self.is_data(addr), addr)
+            counter, self.fl[lanes] = vector_sum(left, self.read(lanes, addr), carry)
+            self.write(lanes, addr, counter)
+            self.branch(lanes, counter != 0, offset, ticks)
+
+        return handler
+
+    def vector_jump(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        operand = extend_bits(instr.arg.val, 20) & mask_32
+        absolute = instr.arg.tag == AddressType.ABSOLUTE
+
+        def handler(lanes: Lanes):
+            if absolute:
+                self.ip[lanes] = operand
+            else:
+                self.ar[lanes] = self.ip[lanes]
+                self.ip[lanes] = (operand + self.ip[lanes]) & mask_32
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_add_to_memory(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        resolve, delta = self.resolve(instr.arg), 1 if instr.op == Opcode.INCREMENT else -1
+
+        def handler(lanes: Lanes):
+            lanes, addr = resolve(lanes)
+            lanes, addr = self.keep(lanes, self.is_data(addr), addr)
+            self.write(lanes, addr, (self.read(lanes, addr) + delta) & mask_32)
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_alu(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        load, op = self.loader(instr.arg), instr.op
+
+        def handler(lanes: Lanes):
+            lanes, values = load(lanes)
+            left = self.ac[lanes]
+            if op in (Opcode.DIVIDE, Opcode.MODULO):
+                # negative dividend or non-positive divisor fail an assertion in the scalar engine
+                valid = (left < 1 << 31) & (values > 0) & (values < 1 << 31)
+                lanes, left, values = self.keep(lanes, valid, left, values)
+                self.ac[lanes] = left // values if op == Opcode.DIVIDE else left % values
+            elif op == Opcode.MULTIPLY:
+                self.ac[lanes] = ((left.astype(np.uint64) * values.astype(np.uint64)) & mask_32).astype(np.int64)
+            else:
+                self.ac[lanes] = (left + values if op == Opcode.ADD else left - values) & mask_32
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_divmod(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        load = self.loader(instr.arg)
+
+        def handler(lanes: Lanes):
+            lanes, values = load(lanes)
+            left, addr = self.ac[lanes], self.sp[lanes]
+            valid = (left < 1 << 31) & (values > 0) & (values < 1 << 31) & self.is_data(addr)
+            lanes, left, values, addr = self.keep(lanes, valid, left, values, addr)
+            self.write(lanes, addr, left // values)
+            self.ac[lanes] = left % values
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    def vector_inverse(self, instr: Term, ticks: tuple[int, int]) -> Handler:
+        def handler(lanes: Lanes):
+            self.ac[lanes] = -self.ac[lanes] & mask_32
+            self.ip[lanes] += 1
+            self.retire(lanes, ticks[0])
+
+        return handler
+
+    # execution
+
+    def decode(self, ip: int) -> Handler:
+        instr = self.image.instructions[ip]
+        key = (instr.op, None if instr.arg is None else instr.arg.tag)
+        if key not in self.ticks_table or instr.op not in self.handler_factories:
+            raise NotImplementedError(f"Unknown instruction, got {instr}")
+        return self.handler_factories[instr.op](instr, self.ticks_table[key])
+
+    def eject(self, lanes: Lanes):
+        """Finishes the runs of lanes in FastControlUnit, starting from their current state."""
+        for lane in lanes.tolist():
+            remaining = self.in_buf[lane, self.in_pos[lane] : self.in_len[lane]].tolist()
+            data_path = DataPath(self.memory_size, self.image, [chr(symbol) for symbol in remaining])
+            data_path.memory[: self.low_size] = array.array("I", self.memory[lane, : self.low_size].tobytes())
+            data_path.memory[self.stack_base :] = array.array("I", self.memory[lane, self.low_size :].tobytes())
+            data_path.dirty_pages[:] = b"\x01" * len(data_path.dirty_pages)
+            data_path.ac, data_path.ip, data_path.ar = int(self.ac[lane]), int(self.ip[lane]), int(self.ar[lane])
+            data_path.sp, data_path.fl = int(self.sp[lane]), int(self.fl[lane])
+            data_path.output_port = OutputPort()
+            data_path.output_port.buffer.extend(self.output(lane))
+            control_unit = FastControlUnit(data_path)
+            control_unit.ticks, control_unit.instr_counter = int(self.ticks[lane]), int(self.instr[lane])
+            run_control_unit(control_unit, self.limit)
+            self.results[lane] = (data_path.output_port.getvalue(), control_unit.instr_counter, control_unit.ticks)
+        self.status[lanes] = EJECTED
+
+    def output(self, lane: int) -> str:
+        return "".join(map(chr, self.out_buf[lane, : self.out_len[lane]].tolist()))
+
+    def step(self, active: Lanes):
+        ips = self.ip[active]
+        if ips.min() == ips.max():
+            groups = [(int(ips[0]), active)]
+        else:
+            order = np.argsort(ips, kind="stable")
+            starts = np.flatnonzero(np.diff(ips[order], prepend=-1))
+            groups = [
+                (int(ips[order[start]]), lanes) for start, lanes in zip(starts, np.split(active[order], starts[1:]))
+            ]
+        for ip, lanes in groups:
+            if not (0 <= ip < len(self.tags) and self.tags[ip] == 1):
+                # the scalar engine fails on fetch the same way simulation does
+                self.eject(lanes)
+                continue
+            handler = self.handlers.get(ip)
+            if handler is None:
+                handler = self.handlers[ip] = self.decode(ip)
+            handler(lanes)
+
+    def run(self) -> list[tuple[str, int, int]]:
+        """(output, instructions, ticks) of every lane, the same as `machine.simulation` returns."""
+        active = np.flatnonzero(self.status == RUNNING)
+        while len(active) > 0:
+            self.status[active[self.instr[active] >= self.limit]] = LIMIT
+            active = active[self.status[active] == RUNNING]
+            if len(active) > 0:
+                self.step(active)
+                active = active[self.status[active] == RUNNING]
+        for lane in np.flatnonzero(self.status != EJECTED).tolist():
+            self.results[lane] = (self.output(lane), int(self.instr[lane]), int(self.ticks[lane]))
+        return self.results
+
+
+def simulate_many(
+    code: list[Word] | ProgramImage, inputs: list[str], memory_size: int = 0x1FFF, limit: int = 5_000
+) -> list[tuple[str, int, int]]:
+    return LockstepEngine(code, inputs, memory_size, limit).run()
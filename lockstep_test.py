@@ -0,0 +1,28 @@
+import machine
+import pytest
+from machine_test import examples, load_example
+
+lockstep = pytest.importorskip("lockstep")
+
+
+@pytest.mark.parametrize("name", examples)
+def test_lockstep_matches_simulation(name):
+    code, input_text = load_example(name)
+    inputs = [input_text, "", input_text[: len(input_text) // 2], "lockstep\n", input_text * 2]
+    results = lockstep.simulate_many(code, inputs)
+    assert results == [machine.simulation(code, list(text), mode="fast") for text in inputs]
+
+
+def test_lockstep_diverging_lanes():
+    code, _ = load_example("hello_user_name")
+    inputs = [f"{'x' * size}\n" for size in range(40)] + ["no newline", "\n\n", "ы😀\n"]
+    results = lockstep.simulate_many(code, inputs, limit=2_000)
+    assert results == [machine.simulation(code, list(text), limit=2_000) for text in inputs]
+
+
+def test_lockstep_ejects_lanes_out_of_mapped_memory():
+    code, input_text = load_example("cat")
+    inputs = [input_text, "abc"]
+    engine = lockstep.LockstepEngine(code, inputs, low_size=len(code), stack_size=1)
+    assert engine.run() == [machine.simulation(code, list(text)) for text in inputs]
+    assert (engine.status == lockstep.EJECTED).all()
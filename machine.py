@@ -1,27 +1,191 @@
 from __future__ import annotations
 
 import argparse
-import copy
+import array
+import asyncio
+import contextlib
+import functools
+import hashlib
+import io
 import logging
+import math
+import mmap
+import pathlib
+import struct
+import sys
+import tempfile
+import time
 import typing
 from enum import Enum
 
-from isa import AddressType, Opcode, Term, Word, WordType, addr_ops, deserialize, value_ops
+from isa import (
+    Address,
+    AddressType,
+    Opcode,
+    Term,
+    Word,
+    WordType,
+    addr_ops,
+    binary_sections,
+    binary_word,
+    decode_instruction,
+    deserialize,
+    is_binary,
+    serialize_words_binary,
+    value_ops,
+)
 from stdlib import INPUT_PORT, OUTPUT_PORT
+from tracing import (
+    SIGNAL_ALU,
+    SIGNAL_READ_MEMORY,
+    SIGNAL_WRITE_MEMORY,
+    TRACE_OFF,
+    FileSink,
+    LogSink,
+    Tracer,
+    trace_levels,
+)
+
+
+def read_code(src: typing.TextIO | typing.BinaryIO, cache: bool = True) -> list[Word] | ProgramImage:
+    """Words of a JSON executable or the image of a binary one, mapped from the file.
+
+    Images of JSON executables opened in binary mode are cached next to them, see `cached_image`.
+    """
+    if isinstance(src, io.TextIOBase):
+        return deserialize(src.read())
+    try:
+        buffer = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # not a regular file (or an empty one)
+        buffer = src.read()
+    if is_binary(buffer):
+        return ProgramImage.from_binary(buffer)
+    if cache and isinstance(getattr(src, "name", None), str):
+        return cached_image(src.name, buffer)
+    return deserialize(bytes(buffer).decode("utf-8"))
+
+
+CACHE_DIR = "__acl3cache__"
+CACHE_MAGIC = b"ACLC"
+# magic, digest of the JSON executable, digest of the binary image after the header
+cache_header = struct.Struct("<4s32s32s")
+
+
+def cache_path(path: str) -> pathlib.Path:
+    source = pathlib.Path(path).resolve()
+    return source.parent / CACHE_DIR / f"{source.name}.bin"
+
+
+def load_cached_image(path: str, digest: bytes) -> ProgramImage | None:
+    try:
+        data = cache_path(path).read_bytes()
+        magic, source_digest, image_digest = cache_header.unpack_from(data)
+        image = memoryview(data)[cache_header.size :]
+        if magic != CACHE_MAGIC or source_digest != digest or hashlib.sha256(image).digest() != image_digest:
+            return None
+        return ProgramImage.from_binary(image)
+    except (OSError, AssertionError, struct.error):
+        # missing, stale or corrupt cache is rebuilt
+        return None
+
+
+def store_cached_image(path: str, digest: bytes, words: list[Word]):
+    image = serialize_words_binary(words)
+    target, temporary = cache_path(path), None
+    try:
+        target.parent.mkdir(exist_ok=True)
+        # concurrent runs of one executable never see a partly written file
+        with tempfile.NamedTemporaryFile("wb", dir=target.parent, delete=False) as file:
+            temporary = pathlib.Path(file.name)
+            file.write(cache_header.pack(CACHE_MAGIC, digest, hashlib.sha256(image).digest()) + image)
+        temporary.replace(target)
+    except OSError:
+        logging.debug(f"can't write image cache {target}")
+        if temporary is not None:
+            with contextlib.suppress(OSError):
+                temporary.unlink(missing_ok=True)
+
+
+def cached_image(path: str, buffer) -> ProgramImage:
+    """Image of a JSON executable from `__acl3cache__` next to it, like `__pycache__` for Python modules.
+
+    The cache is keyed by the content hash of the executable, so it is rebuilt once the executable changes.
+    """
+    digest = hashlib.sha256(buffer).digest()
+    image = load_cached_image(path, digest)
+    if image is None:
+        words = deserialize(bytes(buffer).decode("utf-8"))
+        image = ProgramImage(words)
+        store_cached_image(path, digest, words)
+    return image
+
+
+class InputPort:
+    """Input device, reads characters lazily from a text stream in chunks.
+
+    An empty read raises EOFError; the next read asks the stream again, so a pipe
+    that receives more data later can be resumed.
+    """
+
+    def __init__(self, stream: typing.TextIO | None = None, chunk_size: int = 1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.consumed = 0
+
+    @classmethod
+    def from_tokens(cls, tokens: list[str]) -> InputPort:
+        return cls(io.StringIO("".join(tokens)))
+
+    def read(self) -> str:
+        if self.pos == len(self.buffer):
+            self.buffer = self.stream.read(self.chunk_size) if self.stream is not None else ""
+            self.pos = 0
+            if len(self.buffer) == 0:
+                raise EOFError()
+        symbol = self.buffer[self.pos]
+        self.pos += 1
+        self.consumed += 1
+        return symbol
+
+    def feed(self, text: str):
+        """Appends characters after the ones already read from the stream."""
+        self.buffer = self.buffer[self.pos :] + text
+        self.pos = 0
+
+
+class OutputPort:
+    """Output device, collects characters or passes them to a sink.
+
+    With a sink, characters are written on every newline or once `flush_size` of them
+    are buffered, so memory does not grow with output length.
+    """
+
+    def __init__(self, sink: typing.TextIO | None = None, flush_size: int = 1 << 12):
+        self.sink = sink
+        self.flush_size = flush_size
+        self.buffer: list[str] = []
+        self.written = 0
 
+    def write(self, symbol: str):
+        self.buffer.append(symbol)
+        self.written += 1
+        if self.sink is not None and (symbol == "\n" or len(self.buffer) >= self.flush_size):
+            self.flush()
 
-def read_code(src: typing.TextIO) -> list[Word]:
-    text = src.read()
-    return deserialize(text)
+    def flush(self):
+        if self.sink is not None:
+            self.sink.write("".join(self.buffer))
+            self.buffer.clear()
 
+    def getvalue(self) -> str:
+        return "".join(self.buffer)
 
-def read_input(in_file: typing.TextIO) -> list[str]:
-    if in_file is None:
-        return []
-    tokens = []
-    for char in in_file.read():
-        tokens.append(char)
-    return tokens
+
+def read_input(in_file: typing.TextIO | None) -> InputPort:
+    return InputPort(in_file)
 
 
 class Reg(tuple[str], Enum):
@@ -52,13 +216,20 @@ def extend_bits(val: int, count: int) -> int:
 
 mask_32 = (1 << 32) - 1
 
+# memory is tracked for snapshots in pages of 1 << PAGE_SHIFT words
+PAGE_SHIFT = 8
+
 n_flag = 0x8
 z_flag = 0x4
 v_flag = 0x2
 c_flag = 0x1
 
 
-def alu_sum(left: int, right: int, carry: int = 0) -> (int, int):
+def alu_sum_bit_serial(left: int, right: int, carry: int = 0) -> (int, int):
+    """Reference ripple-carry adder, one full adder per bit.
+
+    Kept as the model of the hardware adder for checking `alu_sum` against it.
+    """
     result = 0
     for i in range(32):
         bit_res = ((left >> i) & 0x1) + ((right >> i) & 0x1) + ((carry >> i) & 0x1)
@@ -76,47 +247,161 @@ def alu_sum(left: int, right: int, carry: int = 0) -> (int, int):
     return result & mask_32, flags
 
 
-class DataPath:
-    def __init__(self, memory_size: int, memory: list[Word], input_tokens: list[str]):
-        assert memory_size >= len(memory), "data_memory_size must be greater than data_memory size"
-        for word in memory:
-            if word.tag == WordType.BINARY:
+mask_31 = (1 << 31) - 1
+
+
+def alu_sum(left: int, right: int, carry: int = 0) -> (int, int):
+    """Word-level adder, same result and NZVC flags as `alu_sum_bit_serial`.
+
+    Carry must be 0 or 1. Overflow is carry into bit 31 xor carry out of bit 31.
+    """
+    left &= mask_32
+    right &= mask_32
+    total = left + right + carry
+    result = total & mask_32
+    carry_out = total >> 32
+    carry_31 = ((left & mask_31) + (right & mask_31) + carry) >> 31
+    flags = 0
+    if result >> 31:
+        flags |= n_flag
+    if result == 0:
+        flags |= z_flag
+    if carry_31 != carry_out:
+        flags |= v_flag
+    if carry_out:
+        flags |= c_flag
+    return result, flags
+
+
+class ProgramImage:
+    """Loaded program split into a read-only instruction table and initial data.
+
+    `tags` is a bitmap over program words (1 for an instruction). Instruction words
+    read as zero in `data`. The image is never modified, so machines may share it.
+    """
+
+    def __init__(self, code: list[Word]):
+        instructions: list[Term | None] = []
+        tags = bytearray(len(code))
+        data = array.array("I", bytes(4 * len(code)))
+        for addr, word in enumerate(code):
+            if word.tag == WordType.INSTRUCTION:
+                instructions.append(word.instr)
+                tags[addr] = 1
+            else:
                 assert 0 <= word.val < (1 << 32), "all binary words in memory must be uint32"
+                instructions.append(None)
+                data[addr] = word.val
+        self.instructions: typing.Sequence[Term | None] = tuple(instructions)
+        self.tags = bytes(tags)
+        self.data = data
+
+    @classmethod
+    def from_binary(cls, buffer) -> ProgramImage:
+        """Image of a binary executable; records are copied as a whole, instructions are decoded on first fetch."""
+        records, _ = binary_sections(buffer)
+        words = array.array("I")
+        words.frombytes(records)
+        if sys.byteorder == "big":
+            words.byteswap()
+        image = cls.__new__(cls)
+        image.instructions = InstructionTable(words[1::2])
+        # the last byte of a record is the opcode of an instruction and zero for data
+        image.tags = bytes(records[binary_word.size - 1 :: binary_word.size]).translate(instruction_tags)
+        image.data = words[0::2]
+        return image
+
+    def __len__(self):
+        return len(self.tags)
+
+
+instruction_tags = bytes([0] + [1] * 255)
+
+
+class InstructionTable:
+    """Instruction words of a binary executable, decoded on first access."""
+
+    def __init__(self, fields: array.array):
+        self.fields = fields
+        self.decoded: dict[int, Term | None] = {}
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __getitem__(self, addr: int) -> Term | None:
+        instr = self.decoded.get(addr)
+        if instr is None and self.fields[addr] != 0:
+            instr = self.decoded[addr] = decode_instruction(self.fields[addr])
+        return instr
+
+
+class DataPath:
+    def __init__(
+        self,
+        memory_size: int,
+        memory: list[Word] | ProgramImage,
+        input_port: list[str] | InputPort,
+        alu_sum_impl: typing.Callable[[int, int, int], tuple[int, int]] = alu_sum,
+    ):
+        image = memory if isinstance(memory, ProgramImage) else ProgramImage(memory)
+        assert memory_size >= len(image), "data_memory_size must be greater than data_memory size"
         self.memory_size = memory_size
-        self.memory = copy.deepcopy(memory)
-        for _ in range(memory_size - len(memory)):
-            self.memory.append(Word(WordType.BINARY, val=0))
-        self.input_tokens = input_tokens
-        self.output_tokens = []
+        self.image = image
+        self.instructions = image.instructions
+        self.tags = image.tags
+        self.memory = image.data + array.array("I", bytes(4 * (memory_size - len(image))))
+        # a flag per page written since memory was last reset to the image
+        self.dirty_pages = bytearray(-(-memory_size >> PAGE_SHIFT))
+        self.input_port = input_port if isinstance(input_port, InputPort) else InputPort.from_tokens(input_port)
+        self.output_port = OutputPort()
         # registers
         self.ir = None
         self.ac, self.ip = 0, 0
         self.ar, self.dr, self.sp = 0, 0, memory_size
         self.fl = 0
+        self.alu_sum = alu_sum_impl
+        self.tracer: Tracer | None = None
+        self.signal_tracer: Tracer | None = None
+
+    def is_instruction(self, addr: int) -> bool:
+        return addr < len(self.tags) and self.tags[addr] == 1
 
     def signal_read_memory(self):
         assert self.ar < self.memory_size, f"ar ({self.ar}) out of data_memory_size ({self.memory_size})"
         if self.ar == INPUT_PORT:
-            if len(self.input_tokens) == 0:
-                raise EOFError()
-            symbol = self.input_tokens.pop(0)
-            logging.debug(f"input: {symbol!r} <- {''.join(self.input_tokens)!r}")
-            self.dr = ord(symbol)
+            self.dr = ord(self.input_port.read())
+            if self.tracer is not None:
+                self.tracer.input()
         else:
-            word = self.memory[self.ar]
-            assert word.tag == WordType.BINARY, f"unknown word tag to read {word.tag}"
-            self.dr = word.val
+            assert not self.is_instruction(self.ar), f"Cant read instruction word as data, ar={self.ar}"
+            self.dr = self.memory[self.ar]
+        if self.signal_tracer is not None:
+            self.signal_tracer.signal(SIGNAL_READ_MEMORY)
 
     def signal_write_memory(self):
         if self.ar == OUTPUT_PORT:
             assert 0 <= self.dr <= 0x10FFFF, f"dr contains unknown symbol, got {self.dr}"
-            symbol = chr(self.dr)
-            logging.debug(f"output: {''.join(self.output_tokens)!r} <- {symbol!r}")
-            self.output_tokens.append(symbol)
+            self.output_port.write(chr(self.dr))
+            if self.tracer is not None:
+                self.tracer.output()
         else:
-            word = self.memory[self.ar]
-            assert word.tag == WordType.BINARY, f"Cant write in read-only memory {word.tag}"
-            word.val = self.dr
+            assert not self.is_instruction(self.ar), f"Cant write in read-only memory, ar={self.ar}"
+            self.memory[self.ar] = self.dr
+            self.dirty_pages[self.ar >> PAGE_SHIFT] = 1
+        if self.signal_tracer is not None:
+            self.signal_tracer.signal(SIGNAL_WRITE_MEMORY)
+
+    def read_word(self, addr: int) -> int:
+        self.ar = addr
+        self.signal_read_memory()
+        return self.dr
+
+    def write_word(self, addr: int, value: int):
+        self.ar, self.dr = addr, value
+        self.signal_write_memory()
+
+    def is_plain_data(self, addr: int) -> bool:
+        return addr < self.memory_size and addr not in (INPUT_PORT, OUTPUT_PORT) and not self.is_instruction(addr)
 
     def negative(self) -> bool:
         return self.fl & n_flag != 0
@@ -135,7 +420,7 @@ class DataPath:
             return 0
         assert left in (Reg.AC, Reg.IP, Reg.IR), f"incorrect left register, got {left}"
         if left == Reg.IR:
-            return self.ir.instr.arg.val
+            return self.ir.arg.val
         return getattr(self, left.value[0])
 
     def right_alu_val(self, right: Reg | None) -> int:
@@ -151,7 +436,7 @@ class DataPath:
         left = extend_bits(left, 20) if opts & extend_20 != 0 else left
 
         if op == AluOp.SUM:
-            output, flags = alu_sum(left & mask_32, right & mask_32, 1 if opts & plus_1 != 0 else 0)
+            output, flags = self.alu_sum(left & mask_32, right & mask_32, 1 if opts & plus_1 != 0 else 0)
             if opts & set_flags != 0:
                 self.fl = flags
         elif op == AluOp.MUL:
@@ -188,11 +473,13 @@ class DataPath:
         right_val = extend_bits(self.right_alu_val(right), 32)
         output = self.alu(left_val, right_val, alu_op, opts)
         self.set_regs(output, set_regs)
+        if self.signal_tracer is not None:
+            self.signal_tracer.signal(SIGNAL_ALU)
 
     def signal_fetch_instr(self) -> Term:
-        self.ir = self.memory[self.ip]
-        assert self.ir.tag == WordType.INSTRUCTION, f"Cant fetch instruction, next is {self.ir.tag}"
-        return self.ir.instr
+        assert self.is_instruction(self.ip), f"Cant fetch instruction, next is data word at {self.ip}"
+        self.ir = self.instructions[self.ip]
+        return self.ir
 
     def __repr__(self):
         regs_repr = (
@@ -200,7 +487,7 @@ class DataPath:
             f"ar={hex(self.ar)} dr={hex(self.dr)} sp={hex(self.sp)} "
             f"fl={hex(self.fl)}"
         )
-        stack_repr = f"stack_top={'?' if self.sp >= len(self.memory) else hex(self.memory[self.sp].val)}"
+        stack_repr = f"stack_top={'?' if self.sp >= len(self.memory) else hex(self.memory[self.sp])}"
         return f"{regs_repr} {stack_repr}"
 
 
@@ -208,6 +495,8 @@ class ControlUnit:
     def __init__(self, data_path: DataPath):
         self.data_path = data_path
         self.ticks = 0
+        self.instr_counter = 0
+        self.tracer: Tracer | None = None
 
         self.control_instruction_executors: dict[Opcode, typing.Callable[[Term], None]] = {
             Opcode.HALT: self.execute_halt_control_instruction,
@@ -217,6 +506,9 @@ class ControlUnit:
             Opcode.JUMP_GREATER: self.execute_jump_greater_control_instruction,
             Opcode.JUMP_GREATER_EQUAL: self.execute_jump_greater_equal_control_instruction,
             Opcode.JUMP: self.execute_jump_control_instruction,
+            Opcode.JUMP_ZERO: self.execute_jump_zero_control_instruction,
+            Opcode.INCREMENT_JUMP_NONZERO: self.execute_increment_jump_nonzero_control_instruction,
+            Opcode.DECREMENT_JUMP_NONZERO: self.execute_decrement_jump_nonzero_control_instruction,
         }
 
         self.ordinary_instruction_executors: dict[Opcode, typing.Callable[[], None]] = {
@@ -235,6 +527,7 @@ class ControlUnit:
             Opcode.MULTIPLY: self.execute_multiply,
             Opcode.DIVIDE: self.execute_divide,
             Opcode.INVERSE: self.execute_inverse,
+            Opcode.DIVMOD: self.execute_divmod,
         }
 
     def tick(self):
@@ -268,9 +561,9 @@ class ControlUnit:
     def execute_return_control_instruction(self, instr: Term):
         self.execute_pop_into(Reg.IP)
 
-    def execute_jump_equal_control_instruction(self, instr: Term):
-        assert instr.arg.tag == AddressType.RELATIVE_IPR, f"unsupported addressing for jme, got {instr}"
-        if self.data_path.zero():
+    def execute_relative_branch(self, instr: Term, taken: bool):
+        assert instr.arg.tag == AddressType.RELATIVE_IPR, f"unsupported addressing for {instr.op.value}, got {instr}"
+        if taken:
             self.data_path.signal_alu(left=Reg.IP, set_regs=[Reg.AR])
             self.tick()
             self.data_path.signal_alu(left=Reg.IR, right=Reg.AR, set_regs=[Reg.IP], opts=extend_20)
@@ -279,27 +572,47 @@ class ControlUnit:
             self.data_path.signal_alu(left=Reg.IP, set_regs=[Reg.IP], opts=plus_1)
             self.tick()
 
+    def execute_jump_equal_control_instruction(self, instr: Term):
+        self.execute_relative_branch(instr, self.data_path.zero())
+
     def execute_jump_greater_control_instruction(self, instr: Term):
-        assert instr.arg.tag == AddressType.RELATIVE_IPR, f"unsupported addressing for jmg, got {instr}"
-        if self.data_path.negative() == self.data_path.overflow() and self.data_path.zero() is False:
-            self.data_path.signal_alu(left=Reg.IP, set_regs=[Reg.AR])
-            self.tick()
-            self.data_path.signal_alu(left=Reg.IR, right=Reg.AR, set_regs=[Reg.IP], opts=extend_20)
-            self.tick()
-        else:
-            self.data_path.signal_alu(left=Reg.IP, set_regs=[Reg.IP], opts=plus_1)
-            self.tick()
+        taken = self.data_path.negative() == self.data_path.overflow() and self.data_path.zero() is False
+        self.execute_relative_branch(instr, taken)
 
     def execute_jump_greater_equal_control_instruction(self, instr: Term):
-        assert instr.arg.tag == AddressType.RELATIVE_IPR, f"unsupported addressing for jmge, got {instr}"
-        if self.data_path.negative() == self.data_path.overflow() or self.data_path.zero() is True:
-            self.data_path.signal_alu(left=Reg.IP, set_regs=[Reg.AR])
-            self.tick()
-            self.data_path.signal_alu(left=Reg.IR, right=Reg.AR, set_regs=[Reg.IP], opts=extend_20)
-            self.tick()
-        else:
-            self.data_path.signal_alu(left=Reg.IP, set_regs=[Reg.IP], opts=plus_1)
-            self.tick()
+        taken = self.data_path.negative() == self.data_path.overflow() or self.data_path.zero() is True
+        self.execute_relative_branch(instr, taken)
+
+    def execute_jump_zero_control_instruction(self, instr: Term):
+        """ac + 0 with flags (1 tick), then the branch of jme: 3 ticks taken, 2 not taken.
+
+        Same as `cmp #0; jme` for the branch, one instruction fetch and one tick less; C is left clear.
+        """
+        self.data_path.signal_alu(left=Reg.AC, opts=set_flags)
+        self.tick()
+        self.execute_relative_branch(instr, self.data_path.zero())
+
+    def execute_increment_jump_nonzero_control_instruction(self, instr: Term):
+        self.execute_count_jump_nonzero(instr, plus_1)
+
+    def execute_decrement_jump_nonzero_control_instruction(self, instr: Term):
+        self.execute_count_jump_nonzero(instr, inv_left)
+
+    def execute_count_jump_nonzero(self, instr: Term, step: int):
+        """Counts the word at the stack top and branches while it is not zero: 6 ticks taken, 5 not taken.
+
+        ar <- sp, read, dr <- dr +/- 1 with flags, write (4 ticks as `inc *sp`), then the branch of jme
+        on a clear Z. `inc *sp; ld *sp; cmp #0` with a branch take 5 ticks more and clobber ac.
+        """
+        self.data_path.signal_alu(right=Reg.SP, set_regs=[Reg.AR])
+        self.tick()
+        self.data_path.signal_read_memory()
+        self.tick()
+        self.data_path.signal_alu(right=Reg.DR, set_regs=[Reg.DR], opts=step | set_flags)
+        self.tick()
+        self.data_path.signal_write_memory()
+        self.tick()
+        self.execute_relative_branch(instr, not self.data_path.zero())
 
     def execute_jump_control_instruction(self, instr: Term):
         assert instr.arg.tag in (
@@ -425,6 +738,23 @@ class ControlUnit:
         self.data_path.signal_alu(left=Reg.AC, set_regs=[Reg.AC], opts=inv_left | plus_1)
         self.tick()
 
+    def execute_divmod(self):
+        """ac <- ac mod x and the quotient into the stack top, 5 ticks after the operand fetch.
+
+        ar <- ac mod dr, dr <- ac div dr, ac <- ar, ar <- sp, write. With an immediate operand it is
+        6 ticks against 10 for `mod x` next to `ld *sp; div x; st *sp`.
+        """
+        self.data_path.signal_alu(left=Reg.AC, right=Reg.DR, alu_op=AluOp.MOD, set_regs=[Reg.AR])
+        self.tick()
+        self.data_path.signal_alu(left=Reg.AC, right=Reg.DR, alu_op=AluOp.DIV, set_regs=[Reg.DR])
+        self.tick()
+        self.data_path.signal_alu(right=Reg.AR, set_regs=[Reg.AC])
+        self.tick()
+        self.data_path.signal_alu(right=Reg.SP, set_regs=[Reg.AR])
+        self.tick()
+        self.data_path.signal_write_memory()
+        self.tick()
+
     def execute(self, instr: Term):
         opcode = instr.op
         if opcode not in self.ordinary_instruction_executors:
@@ -442,53 +772,778 @@ class ControlUnit:
         self.execute(instr)
         self.finalize()
 
-    def execute_next_instruction(self):
-        instruction = self.data_path.signal_fetch_instr()
-        logging.debug(self)
-        logging.debug(instruction.op.name)
+    def execute_instruction(self, instruction: Term):
         if not self.execute_control_instruction(instruction):
             self.execute_ordinary_instruction(instruction)
 
+    def execute_next_instruction(self):
+        instruction = self.data_path.signal_fetch_instr()
+        if self.tracer is not None:
+            self.tracer.instruction(instruction)
+        self.execute_instruction(instruction)
+
+    def run(self, limit: int, tick_limit: int | None = None):
+        if tick_limit is None:
+            while self.instr_counter < limit:
+                self.execute_next_instruction()
+                self.instr_counter += 1
+        else:
+            while self.instr_counter < limit and self.ticks < tick_limit:
+                self.execute_next_instruction()
+                self.instr_counter += 1
+
+    def run_to_input(self, limit: int, tick_limit: int | None = None) -> str:
+        """Runs until an instruction finds the input port empty and stops right before it.
+
+        Unlike `run`, the failed instruction is rolled back, so the machine is left between
+        two instructions and can be snapshotted or resumed once input is available.
+        Returns halt, eof or limit.
+        """
+        data_path = self.data_path
+        tick_bound = math.inf if tick_limit is None else tick_limit
+        try:
+            while self.instr_counter < limit and self.ticks < tick_bound:
+                # memory is not written before the input port is read, registers are enough to roll back
+                saved = (self.ticks, data_path.ip, data_path.ac, data_path.ar, data_path.dr, data_path.sp, data_path.fl)
+                try:
+                    self.execute_next_instruction()
+                except EOFError:
+                    self.ticks, data_path.ip, data_path.ac, data_path.ar, data_path.dr, data_path.sp, data_path.fl = (
+                        saved
+                    )
+                    raise
+                self.instr_counter += 1
+        except EOFError:
+            return "eof"
+        except StopIteration:
+            return "halt"
+        return "limit"
+
     def __repr__(self):
         state_repr = f"tick={self.ticks}"
         dp_repr = f"{self.data_path}"
         return f"{state_repr}\t{dp_repr}".expandtabs(10)
 
 
-def simulation(code: list[Word], input_tokens: list[str], memory_size: int = 0x1FFF, limit: int = 5_000):
-    data_path = DataPath(memory_size, code, input_tokens)
+class PredecodedControlUnit(ControlUnit):
+    """ControlUnit that decodes every instruction word once.
+
+    Handler for a word is built on the first fetch (executors, addressing mode and
+    sign-extended operand resolved) and cached by address, instruction words are read-only.
+    Executes the same micro-signals and ticks as ControlUnit.
+    """
+
+    def __init__(self, data_path: DataPath):
+        super().__init__(data_path)
+        self.decoded: dict[int, typing.Callable[[], None]] = {}
+
+    def address_decoder(self, addr: Address) -> typing.Callable[[], None] | None:
+        data_path = self.data_path
+        operand = extend_bits(addr.val, 20) & mask_32
+
+        def decode_absolute():
+            data_path.ar = operand
+            self.tick()
+
+        def decode_relative_spr():
+            data_path.ar = (operand + data_path.sp) & mask_32
+            self.tick()
+
+        def decode_relative_indirect_spr():
+            decode_relative_spr()
+            data_path.signal_read_memory()
+            self.tick()
+            data_path.ar = data_path.dr
+            self.tick()
+
+        decoders = {
+            AddressType.EXACT: None,
+            AddressType.ABSOLUTE: decode_absolute,
+            AddressType.RELATIVE_SPR: decode_relative_spr,
+            AddressType.RELATIVE_INDIRECT_SPR: decode_relative_indirect_spr,
+        }
+        if addr.tag not in decoders:
+            raise NotImplementedError(f"unsupported address type for address decoding, got {addr}")
+        return decoders[addr.tag]
+
+    def value_fetcher(self, addr: Address) -> typing.Callable[[], None]:
+        data_path = self.data_path
+        operand = extend_bits(addr.val, 20) & mask_32
+
+        def fetch_exact():
+            data_path.dr = operand
+            self.tick()
+
+        def fetch_memory():
+            data_path.signal_read_memory()
+            self.tick()
+
+        if addr.tag == AddressType.EXACT:
+            return fetch_exact
+        if addr.tag in (AddressType.ABSOLUTE, AddressType.RELATIVE_SPR, AddressType.RELATIVE_INDIRECT_SPR):
+            return fetch_memory
+        raise NotImplementedError(f"unsupported address type for value fetching, got {addr}")
+
+    def predecode(self, instr: Term) -> typing.Callable[[], None]:
+        if instr.op in self.control_instruction_executors:
+            return functools.partial(self.control_instruction_executors[instr.op], instr)
+        if instr.op not in self.ordinary_instruction_executors:
+            raise NotImplementedError(f"Unknown instruction, got {instr}")
+        steps = []
+        if instr.op in addr_ops or instr.op in value_ops:
+            steps.append(self.address_decoder(instr.arg))
+        if instr.op in value_ops:
+            steps.append(self.value_fetcher(instr.arg))
+        steps.append(self.ordinary_instruction_executors[instr.op])
+        steps.append(self.finalize)
+        steps = tuple(step for step in steps if step is not None)
+
+        def handler():
+            for step in steps:
+                step()
+
+        return handler
+
+    def execute_next_instruction(self):
+        instruction = self.data_path.signal_fetch_instr()
+        if self.tracer is not None:
+            self.tracer.instruction(instruction)
+        handler = self.decoded.get(self.data_path.ip)
+        if handler is None:
+            handler = self.decoded[self.data_path.ip] = self.predecode(instruction)
+        handler()
+
+
+branch_conditions: dict[Opcode, typing.Callable[[int], bool]] = {
+    Opcode.JUMP_EQUAL: lambda fl: fl & z_flag != 0,
+    Opcode.JUMP_GREATER: lambda fl: (fl & n_flag != 0) == (fl & v_flag != 0) and fl & z_flag == 0,
+    Opcode.JUMP_GREATER_EQUAL: lambda fl: (fl & n_flag != 0) == (fl & v_flag != 0) or fl & z_flag != 0,
+}
+
+
+# branches on the value in ac or at the stack top rather than on flags: values which (don't take, take) them
+value_branch_probes: dict[Opcode, tuple[int, int]] = {
+    Opcode.JUMP_ZERO: (1, 0),
+    Opcode.INCREMENT_JUMP_NONZERO: (mask_32, 1),
+    Opcode.DECREMENT_JUMP_NONZERO: (1, 2),
+}
+
+
+def branch_taken(op: Opcode, fl: int) -> bool:
+    return op in branch_conditions and branch_conditions[op](fl)
+
+
+def probe_ticks(instr: Term, fl: int, value: int = 1) -> int:
+    code = [Word(WordType.INSTRUCTION, instr=instr)] + [Word(WordType.BINARY, val=value) for _ in range(15)]
+    data_path = DataPath(len(code), code, [])
+    data_path.ac, data_path.ar, data_path.sp, data_path.fl = value, 1, 8, fl
     control_unit = ControlUnit(data_path)
-    instruction_proceed = 0
+    with contextlib.suppress(StopIteration):
+        control_unit.execute_instruction(data_path.signal_fetch_instr())
+    return control_unit.ticks
+
+
+def probe_outcomes(instr: Term) -> dict[bool, int]:
+    """Ticks of the instruction by whether it branches."""
+    if instr.op in value_branch_probes:
+        return {
+            taken: probe_ticks(instr, 0, value) for taken, value in zip((False, True), value_branch_probes[instr.op])
+        }
+    return {branch_taken(instr.op, fl): probe_ticks(instr, fl) for fl in (0, z_flag, n_flag)}
+
+
+@functools.cache
+def instruction_ticks() -> dict[tuple[Opcode, AddressType | None], tuple[int, int]]:
+    """Ticks of every supported opcode/addressing mode pair as (not taken, taken).
+
+    Measured by running each pair through ControlUnit in a scratch machine, so the
+    table always follows the micro-signal executors. Pairs ControlUnit rejects are absent.
+    """
+    table = {}
+    for op in Opcode:
+        modes = list(AddressType) if op in addr_ops or op in value_ops else [None]
+        for mode in modes:
+            instr = Term(op, None if mode is None else Address(mode, 1))
+            try:
+                ticks = probe_outcomes(instr)
+            except (AssertionError, NotImplementedError):
+                continue
+            table[(op, mode)] = (ticks.get(False, ticks.get(True)), ticks.get(True, ticks.get(False)))
+    return table
+
+
+class FastControlUnit(ControlUnit):
+    """Instruction-level engine: every instruction is one direct state update.
+
+    Handlers are built per address on first fetch and return their tick cost from
+    `instruction_ticks`. Only state visible to programs is kept exact (dr and ir are
+    not maintained), which is enough for identical output, instruction and tick counts.
+    """
+
+    def __init__(self, data_path: DataPath):
+        super().__init__(data_path)
+        self.ticks_table = instruction_ticks()
+        self.handlers: dict[int, typing.Callable[[], int]] = {}
+        self.replay_eof = True
+        self.handler_factories: dict[Opcode, typing.Callable[[Term, tuple[int, int]], typing.Callable[[], int]]] = {
+            Opcode.HALT: self.fast_halt,
+            Opcode.NOOP: self.fast_noop,
+            Opcode.LOAD: self.fast_load,
+            Opcode.STORE: self.fast_store,
+            Opcode.CALL: self.fast_call,
+            Opcode.RETURN: self.fast_return,
+            Opcode.PUSH: self.fast_push,
+            Opcode.POP: self.fast_pop,
+            Opcode.POPN: self.fast_popn,
+            Opcode.COMPARE: self.fast_compare,
+            Opcode.JUMP_EQUAL: self.fast_conditional_jump,
+            Opcode.JUMP_GREATER: self.fast_conditional_jump,
+            Opcode.JUMP_GREATER_EQUAL: self.fast_conditional_jump,
+            Opcode.JUMP: self.fast_jump,
+            Opcode.INCREMENT: self.fast_inc,
+            Opcode.DECREMENT: self.fast_dec,
+            Opcode.MODULO: self.fast_alu,
+            Opcode.ADD: self.fast_alu,
+            Opcode.SUBTRACT: self.fast_alu,
+            Opcode.MULTIPLY: self.fast_alu,
+            Opcode.DIVIDE: self.fast_alu,
+            Opcode.INVERSE: self.fast_inverse,
+            Opcode.JUMP_ZERO: self.fast_jump_zero,
+            Opcode.INCREMENT_JUMP_NONZERO: self.fast_count_jump,
+            Opcode.DECREMENT_JUMP_NONZERO: self.fast_count_jump,
+            Opcode.DIVMOD: self.fast_divmod,
+        }
+
+    def address_resolver(self, arg: Address) -> typing.Callable[[], int]:
+        data_path = self.data_path
+        operand = extend_bits(arg.val, 20) & mask_32
+        resolvers = {
+            AddressType.EXACT: lambda: data_path.ar,
+            AddressType.ABSOLUTE: lambda: operand,
+            AddressType.RELATIVE_SPR: lambda: (operand + data_path.sp) & mask_32,
+            AddressType.RELATIVE_INDIRECT_SPR: lambda: data_path.read_word((operand + data_path.sp) & mask_32),
+        }
+        if arg.tag not in resolvers:
+            raise NotImplementedError(f"unsupported address type for address decoding, got {arg}")
+        return resolvers[arg.tag]
+
+    def value_loader(self, arg: Address) -> typing.Callable[[], int]:
+        data_path = self.data_path
+        memory = data_path.memory
+        operand = extend_bits(arg.val, 20) & mask_32
+        if arg.tag == AddressType.EXACT:
+            return lambda: operand
+        if arg.tag == AddressType.ABSOLUTE and data_path.is_plain_data(operand):
+
+            def load_static() -> int:
+                data_path.ar = operand
+                return memory[operand]
+
+            return load_static
+        resolve = self.address_resolver(arg)
+        return lambda: data_path.read_word(resolve())
+
+    def value_storer(self, arg: Address) -> typing.Callable[[int], None]:
+        data_path = self.data_path
+        memory, dirty_pages = data_path.memory, data_path.dirty_pages
+        operand = extend_bits(arg.val, 20) & mask_32
+        if arg.tag == AddressType.ABSOLUTE and data_path.is_plain_data(operand):
+            page = operand >> PAGE_SHIFT
+
+            def store_static(value: int):
+                data_path.ar = operand
+                memory[operand] = value
+                dirty_pages[page] = 1
+
+            return store_static
+        resolve = self.address_resolver(arg)
+        return lambda value: data_path.write_word(resolve(), value)
+
+    # noinspection PyUnusedLocal
+    def fast_halt(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        def handler() -> int:
+            raise StopIteration()
+
+        return handler
+
+    def fast_noop(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost = self.data_path, ticks[0]
+
+        def handler() -> int:
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    def fast_load(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost, load = self.data_path, ticks[0], self.value_loader(instr.arg)
+
+        def handler() -> int:
+            data_path.ac = load()
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    def fast_store(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost, store = self.data_path, ticks[0], self.value_storer(instr.arg)
+
+        def handler() -> int:
+            store(data_path.ac)
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    def fast_call(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost = self.data_path, ticks[0]
+        target = extend_bits(instr.arg.val, 20) & mask_32
+
+        def handler() -> int:
+            data_path.sp = (data_path.sp - 1) & mask_32
+            data_path.write_word(data_path.sp, data_path.ip + 1)
+            data_path.ip = target
+            return cost
+
+        return handler
+
+    # noinspection PyUnusedLocal
+    def fast_return(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost = self.data_path, ticks[0]
+
+        def handler() -> int:
+            data_path.ip = data_path.read_word(data_path.sp)
+            data_path.sp = (data_path.sp + 1) & mask_32
+            return cost
+
+        return handler
+
+    # noinspection PyUnusedLocal
+    def fast_push(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost = self.data_path, ticks[0]
+
+        def handler() -> int:
+            data_path.sp = (data_path.sp - 1) & mask_32
+            data_path.write_word(data_path.sp, data_path.ac)
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    # noinspection PyUnusedLocal
+    def fast_pop(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost = self.data_path, ticks[0]
+
+        def handler() -> int:
+            data_path.ac = data_path.read_word(data_path.sp)
+            data_path.sp = (data_path.sp + 1) & mask_32
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    # noinspection PyUnusedLocal
+    def fast_popn(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost = self.data_path, ticks[0]
+
+        def handler() -> int:
+            data_path.sp = (data_path.sp + 1) & mask_32
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    def fast_compare(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost, load = self.data_path, ticks[0], self.value_loader(instr.arg)
+
+        def handler() -> int:
+            _, data_path.fl = data_path.alu_sum(data_path.ac, ~load() & mask_32, 1)
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    def fast_conditional_jump(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, (not_taken_cost, taken_cost) = self.data_path, ticks
+        offset = extend_bits(instr.arg.val, 20) & mask_32
+        taken_by_flags = tuple(branch_taken(instr.op, fl) for fl in range(16))
+
+        def handler() -> int:
+            if taken_by_flags[data_path.fl]:
+                data_path.ar = data_path.ip
+                data_path.ip = (offset + data_path.ip) & mask_32
+                return taken_cost
+            data_path.ip += 1
+            return not_taken_cost
+
+        return handler
+
+    def fast_jump_zero(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, (not_taken_cost, taken_cost) = self.data_path, ticks
+        offset = extend_bits(instr.arg.val, 20) & mask_32
+
+        def handler() -> int:
+            _, data_path.fl = data_path.alu_sum(data_path.ac, 0)
+            if data_path.ac == 0:
+                data_path.ar = data_path.ip
+                data_path.ip = (offset + data_path.ip) & mask_32
+                return taken_cost
+            data_path.ip += 1
+            return not_taken_cost
+
+        return handler
+
+    def fast_count_jump(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, (not_taken_cost, taken_cost) = self.data_path, ticks
+        offset = extend_bits(instr.arg.val, 20) & mask_32
+        # the same adder inputs as inc and dec: dr + 1 and ~0 + dr
+        left, carry = (0, 1) if instr.op == Opcode.INCREMENT_JUMP_NONZERO else (mask_32, 0)
+
+        def handler() -> int:
+            counter, data_path.fl = data_path.alu_sum(left, data_path.read_word(data_path.sp), carry)
+            data_path.write_word(data_path.sp, counter)
+            if counter != 0:
+                data_path.ar = data_path.ip
+                data_path.ip = (offset + data_path.ip) & mask_32
+                return taken_cost
+            data_path.ip += 1
+            return not_taken_cost
+
+        return handler
+
+    def fast_jump(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost = self.data_path, ticks[0]
+        operand = extend_bits(instr.arg.val, 20) & mask_32
+
+        def jump_absolute() -> int:
+            data_path.ip = operand
+            return cost
+
+        def jump_relative() -> int:
+            data_path.ar = data_path.ip
+            data_path.ip = (operand + data_path.ip) & mask_32
+            return cost
+
+        return jump_absolute if instr.arg.tag == AddressType.ABSOLUTE else jump_relative
+
+    def fast_inc(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        return self.fast_add_to_memory(instr.arg, 1, ticks[0])
+
+    def fast_dec(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        return self.fast_add_to_memory(instr.arg, -1, ticks[0])
+
+    def fast_add_to_memory(self, arg: Address, delta: int, cost: int) -> typing.Callable[[], int]:
+        data_path = self.data_path
+        resolve = self.address_resolver(arg)
+
+        def handler() -> int:
+            addr = resolve()
+            data_path.write_word(addr, (data_path.read_word(addr) + delta) & mask_32)
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    def fast_alu(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost, load = self.data_path, ticks[0], self.value_loader(instr.arg)
+        op = fast_alu_ops[instr.op]
+
+        def handler() -> int:
+            data_path.ac = op(data_path.ac, load())
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    def fast_divmod(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost, load = self.data_path, ticks[0], self.value_loader(instr.arg)
+
+        def handler() -> int:
+            divisor = load()
+            remainder = fast_modulo(data_path.ac, divisor)
+            data_path.write_word(data_path.sp, fast_divide(data_path.ac, divisor))
+            data_path.ac = remainder
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    # noinspection PyUnusedLocal
+    def fast_inverse(self, instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+        data_path, cost = self.data_path, ticks[0]
+
+        def handler() -> int:
+            data_path.ac = -data_path.ac & mask_32
+            data_path.ip += 1
+            return cost
+
+        return handler
+
+    def decode(self, instr: Term) -> typing.Callable[[], int]:
+        key = (instr.op, None if instr.arg is None else instr.arg.tag)
+        if key not in self.ticks_table or instr.op not in self.handler_factories:
+            raise NotImplementedError(f"Unknown instruction, got {instr}")
+        return self.handler_factories[instr.op](instr, self.ticks_table[key])
+
+    def handler_at(self, ip: int) -> typing.Callable[[], int]:
+        handler = self.handlers.get(ip)
+        if handler is None:
+            handler = self.handlers[ip] = self.decode(self.data_path.signal_fetch_instr())
+        return handler
+
+    def run_to_input(self, limit: int, tick_limit: int | None = None) -> str:
+        # handlers change nothing before the input port read, it is enough to skip the replay
+        self.replay_eof = False
+        try:
+            return run_control_unit(self, limit, tick_limit)
+        finally:
+            self.replay_eof = True
+
+    def execute_next_instruction(self):
+        ip = self.data_path.ip
+        handler = self.handlers.get(ip)
+        if handler is None:
+            handler = self.handler_at(ip)
+        if self.tracer is not None:
+            self.tracer.instruction(self.data_path.instructions[ip])
+        try:
+            self.ticks += handler()
+        except EOFError:
+            # nothing is changed before the input port read, so micro-signal replay counts the partial ticks
+            if self.replay_eof:
+                self.execute_instruction(self.data_path.signal_fetch_instr())
+            raise
+
+
+def fast_divide(left: int, right: int) -> int:
+    left, right = extend_bits(left, 32), extend_bits(right, 32)
+    assert left >= 0, f"div can performed only with non-negatives, got left={left}"
+    assert right > 0, f"div can performed only with positive argument, got right={right}"
+    return left // right
 
+
+def fast_modulo(left: int, right: int) -> int:
+    left, right = extend_bits(left, 32), extend_bits(right, 32)
+    assert left >= 0, f"mod can performed only with non-negatives, got left={left}"
+    assert right > 0, f"mod can performed only with positive argument, got right={right}"
+    return left % right
+
+
+fast_alu_ops: dict[Opcode, typing.Callable[[int, int], int]] = {
+    Opcode.ADD: lambda left, right: (left + right) & mask_32,
+    Opcode.SUBTRACT: lambda left, right: (left - right) & mask_32,
+    Opcode.MULTIPLY: lambda left, right: (left * right) & mask_32,
+    Opcode.DIVIDE: fast_divide,
+    Opcode.MODULO: fast_modulo,
+}
+
+
+control_units: dict[str, type[ControlUnit]] = {
+    "micro": ControlUnit,
+    "predecoded": PredecodedControlUnit,
+    "fast": FastControlUnit,
+}
+
+simulation_modes: list[str] = [*control_units, "block"]
+
+
+def control_unit_class(mode: str) -> type[ControlUnit]:
+    assert mode in simulation_modes, f"unknown simulation mode, got {mode}"
+    if mode == "block":
+        # jit builds on this module, so it is imported on demand
+        import jit
+
+        return jit.BlockControlUnit
+    return control_units[mode]
+
+
+def run_control_unit(control_unit: ControlUnit, limit: int, tick_limit: int | None = None) -> str:
+    """Runs the program until it stops, returns the reason: halt, eof or limit."""
     try:
-        while instruction_proceed < limit:
-            control_unit.execute_next_instruction()
-            instruction_proceed += 1
+        control_unit.run(limit, tick_limit)
     except EOFError:
-        logging.warning("Input buffer is empty")
+        return "eof"
     except StopIteration:
-        pass
+        return "halt"
+    return "limit"
+
+
+def simulation(
+    code: list[Word] | ProgramImage,
+    input_tokens: list[str] | InputPort,
+    memory_size: int = 0x1FFF,
+    limit: int = 5_000,
+    mode: str = "micro",
+    output_sink: typing.TextIO | None = None,
+    tracer: Tracer | None = None,
+    tick_limit: int | None = None,
+):
+    data_path = DataPath(memory_size, code, input_tokens)
+    data_path.output_port = OutputPort(output_sink)
+    control_unit = control_unit_class(mode)(data_path)
+    if tracer is not None:
+        assert mode != "block", "block mode runs compiled code and can't be traced"
+        tracer.attach(control_unit)
 
+    if run_control_unit(control_unit, limit, tick_limit) == "eof":
+        logging.warning("Input buffer is empty")
+
+    instruction_proceed = control_unit.instr_counter
     if instruction_proceed >= limit:
         logging.warning(f"Limit {limit} exceeded")
+    if tick_limit is not None and control_unit.ticks >= tick_limit:
+        logging.warning(f"Tick limit {tick_limit} exceeded")
+
+    data_path.output_port.flush()
+    return data_path.output_port.getvalue(), instruction_proceed, control_unit.ticks
+
+
+class RunStatus:
+    """Result of `Machine.run`.
+
+    `reason` is halt, input (the input port is empty), instr_limit, tick_limit or deadline.
+    Every reason except halt leaves the machine between two instructions, ready to resume.
+    """
+
+    def __init__(self, reason: str, instr: int, ticks: int):
+        self.reason = reason
+        self.instr = instr
+        self.ticks = ticks
+
+    @property
+    def finished(self) -> bool:
+        return self.reason == "halt"
+
+    def __repr__(self):
+        return f"RunStatus(reason={self.reason!r}, instr={self.instr}, ticks={self.ticks})"
+
+
+class Machine:
+    """Resumable simulation of one program.
+
+    Every `run` executes up to the given budget and returns a RunStatus. An empty input
+    port pauses the machine instead of stopping it: feed the input port and run again.
+    """
+
+    def __init__(
+        self,
+        code: list[Word] | ProgramImage,
+        input_port: list[str] | InputPort | None = None,
+        memory_size: int = 0x1FFF,
+        mode: str = "fast",
+        output_sink: typing.TextIO | None = None,
+    ):
+        self.data_path = DataPath(memory_size, code, [] if input_port is None else input_port)
+        self.data_path.output_port = OutputPort(output_sink)
+        self.control_unit = control_unit_class(mode)(self.data_path)
+        self.halted = False
+
+    @property
+    def input_port(self) -> InputPort:
+        return self.data_path.input_port
 
-    return "".join(data_path.output_tokens), instruction_proceed, control_unit.ticks
+    @property
+    def output_port(self) -> OutputPort:
+        return self.data_path.output_port
 
+    def status(self, reason: str) -> RunStatus:
+        return RunStatus(reason, self.control_unit.instr_counter, self.control_unit.ticks)
 
-def main(src: typing.TextIO, in_file: typing.TextIO):
-    logging.getLogger().setLevel(logging.DEBUG)
+    def run(
+        self,
+        max_instr: int | None = None,
+        max_ticks: int | None = None,
+        deadline: float | None = None,
+        check_every: int = 1 << 12,
+    ) -> RunStatus:
+        """Runs at most `max_instr` instructions and `max_ticks` ticks more, until `deadline`
+        (time.monotonic() value, checked every `check_every` instructions)."""
+        control_unit = self.control_unit
+        instr_bound = math.inf if max_instr is None else control_unit.instr_counter + max_instr
+        tick_bound = None if max_ticks is None else control_unit.ticks + max_ticks
+        reason = None
+        while not self.halted and reason is None:
+            limit = instr_bound if deadline is None else min(instr_bound, control_unit.instr_counter + check_every)
+            stop = control_unit.run_to_input(limit, tick_bound)
+            self.halted = stop == "halt"
+            reason = self.pause_reason(stop, instr_bound, tick_bound, deadline)
+        self.output_port.flush()
+        return self.status("halt" if self.halted else reason)
+
+    def pause_reason(self, stop: str, instr_bound: float, tick_bound: int | None, deadline: float | None) -> str | None:
+        if stop == "eof":
+            return "input"
+        if self.control_unit.instr_counter >= instr_bound:
+            return "instr_limit"
+        if tick_bound is not None and self.control_unit.ticks >= tick_bound:
+            return "tick_limit"
+        if deadline is not None and time.monotonic() >= deadline:
+            return "deadline"
+        return None
+
+    async def run_async(
+        self,
+        read_input: typing.Callable[[], typing.Awaitable[str]] | None = None,
+        max_instr: int | None = None,
+        max_ticks: int | None = None,
+        yield_every: int = 1 << 12,
+    ) -> RunStatus:
+        """Runs in slices of `yield_every` instructions and yields to the event loop between them.
+
+        When the input port is empty, `read_input` is awaited for more characters; an empty
+        string (or no `read_input`) returns the input status.
+        """
+        instr_bound = math.inf if max_instr is None else self.control_unit.instr_counter + max_instr
+        tick_bound = None if max_ticks is None else self.control_unit.ticks + max_ticks
+        while True:
+            budget = min(yield_every, instr_bound - self.control_unit.instr_counter)
+            ticks_budget = None if tick_bound is None else tick_bound - self.control_unit.ticks
+            status = self.run(max_instr=budget, max_ticks=ticks_budget)
+            if status.reason == "instr_limit" and status.instr < instr_bound:
+                await asyncio.sleep(0)
+                continue
+            if status.reason == "input" and read_input is not None:
+                text = await read_input()
+                if text != "":
+                    self.input_port.feed(text)
+                    continue
+            return status
+
+
+def main(
+    src: typing.TextIO,
+    in_file: typing.TextIO,
+    mode: str = "micro",
+    limit: int = 5_000,
+    trace: str | None = None,
+    trace_file: typing.BinaryIO | None = None,
+):
+    if trace is None:
+        trace = "off" if mode == "block" else "instr"
+    level = trace_levels[trace]
+    if trace_file is not None:
+        logging.getLogger().setLevel(logging.INFO)
+        tracer = Tracer(level, FileSink(trace_file))
+    elif level != TRACE_OFF:
+        logging.getLogger().setLevel(logging.DEBUG)
+        tracer = Tracer(level, LogSink())
+    else:
+        logging.getLogger().setLevel(logging.INFO)
+        tracer = None
 
     code = read_code(src)
-    input_tokens = read_input(in_file)
-    output, instr, ticks = simulation(code, input_tokens)
+    input_port = read_input(in_file)
+    _, instr, ticks = simulation(code, input_port, limit=limit, mode=mode, output_sink=sys.stdout, tracer=tracer)
 
     logging.info(f"instr: {instr} ticks: {ticks}")
-    print(output)
+    print()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Execute lisp executable file.")
-    parser.add_argument("src", type=argparse.FileType("r"), metavar="executable_file", help="executable file")
+    parser.add_argument(
+        "src", type=argparse.FileType("rb"), metavar="executable_file", help="executable file (binary or JSON)"
+    )
     parser.add_argument(
         "--input",
         "-i",
@@ -497,5 +1552,35 @@ if __name__ == "__main__":
         metavar="input_file",
         help="file with input data for executable (default: empty file)",
     )
+    parser.add_argument(
+        "--mode",
+        "-m",
+        dest="mode",
+        choices=simulation_modes,
+        default="micro",
+        help="simulation engine (default: micro)",
+    )
+    parser.add_argument(
+        "--limit",
+        "-l",
+        dest="limit",
+        type=int,
+        default=5_000,
+        help="maximum amount of executed instructions (default: 5000)",
+    )
+    parser.add_argument(
+        "--trace",
+        "-t",
+        dest="trace",
+        choices=trace_levels,
+        help="execution trace level (default: instr, off for block mode)",
+    )
+    parser.add_argument(
+        "--trace-file",
+        dest="trace_file",
+        type=argparse.FileType("wb"),
+        metavar="trace_file",
+        help="write binary trace records to file instead of the journal, decode them with tracing.py",
+    )
     namespace = parser.parse_args()
-    main(namespace.src, namespace.in_file)
+    main(namespace.src, namespace.in_file, namespace.mode, namespace.limit, namespace.trace, namespace.trace_file)
@@ -0,0 +1,283 @@
+import asyncio
+import io
+import itertools
+import os
+import pathlib
+import random
+
+import isa
+import machine
+import pytest
+import tracing
+import translator
+
+edge_values = [
+    0,
+    1,
+    2,
+    0x7FFFF,
+    0x80000,
+    0xFFFFF,
+    0x7FFFFFFE,
+    0x7FFFFFFF,
+    0x80000000,
+    0x80000001,
+    0xFFFFFFFE,
+    0xFFFFFFFF,
+]
+
+opts_combinations = [
+    sum(opts)
+    for opts in itertools.product(
+        (0, machine.inv_left), (0, machine.inv_right), (0, machine.plus_1), (0, machine.extend_20)
+    )
+]
+
+
+def alu_sum_outputs(left: int, right: int, opts: int) -> list[tuple[int, int]]:
+    outputs = []
+    for impl in (machine.alu_sum, machine.alu_sum_bit_serial):
+        data_path = machine.DataPath(0, [], [], alu_sum_impl=impl)
+        left_val, right_val = machine.extend_bits(left, 32), machine.extend_bits(right, 32)
+        output = data_path.alu(left_val, right_val, machine.AluOp.SUM, opts | machine.set_flags)
+        outputs.append((output, data_path.fl))
+    return outputs
+
+
+@pytest.mark.parametrize("opts", opts_combinations)
+def test_alu_sum_edge_values(opts):
+    for left, right in itertools.product(edge_values, repeat=2):
+        word, bit_serial = alu_sum_outputs(left, right, opts)
+        assert word == bit_serial, f"left={hex(left)} right={hex(right)} opts={hex(opts)}"
+
+
+@pytest.mark.parametrize("opts", opts_combinations)
+def test_alu_sum_random_values(opts):
+    rnd = random.Random(opts)
+    for _ in range(500):
+        left, right = rnd.getrandbits(32), rnd.getrandbits(32)
+        word, bit_serial = alu_sum_outputs(left, right, opts)
+        assert word == bit_serial, f"left={hex(left)} right={hex(right)} opts={hex(opts)}"
+
+
+examples = ["cat", "fun", "hello", "hello_user_name", "math", "prob2", "recur"]
+
+
+def load_example(name: str) -> tuple[list[machine.Word], str]:
+    with open(os.path.join("examples", name), encoding="utf-8") as file:
+        code = isa.deserialize(isa.serialize(translator.translate(file.read())))
+    try:
+        with open(os.path.join("examples", "input", name), encoding="utf-8") as file:
+            input_text = file.read()
+    except FileNotFoundError:
+        input_text = ""
+    return code, input_text
+
+
+@pytest.mark.parametrize("mode", ["predecoded", "fast", "block"])
+@pytest.mark.parametrize("name", examples)
+def test_simulation_modes_match_micro(name, mode):
+    code, input_text = load_example(name)
+    expected = machine.simulation(code, list(input_text))
+    assert machine.simulation(code, list(input_text), mode=mode) == expected
+
+
+@pytest.mark.parametrize("mode", ["predecoded", "fast", "block"])
+def test_simulation_modes_match_micro_on_long_input(mode):
+    code, _ = load_example("cat")
+    input_text = "".join(chr(ord("a") + i % 26) for i in range(300))
+    expected = machine.simulation(code, list(input_text))
+    assert machine.simulation(code, list(input_text), mode=mode) == expected
+
+
+@pytest.mark.parametrize("mode", ["predecoded", "fast", "block"])
+def test_fused_instructions_hit_stdlib_limits(mode):
+    source = f'(set s (readline)) (printi (print s)) (printi -1204) (printi (print "{"x" * 200}"))'
+    code = isa.deserialize(isa.serialize(translator.translate(source)))
+    input_text = "a" * 150 + "\n"
+    expected = machine.simulation(code, list(input_text))
+    assert expected[0] == "a" * 128 + "128-1204" + "x" * 128 + "128"
+    assert machine.simulation(code, list(input_text), mode=mode) == expected
+
+
+@pytest.mark.parametrize("mode", ["predecoded", "fast", "block"])
+def test_count_jumps_match_micro(mode):
+    exact, relative = isa.AddressType.EXACT, isa.AddressType.RELATIVE_IPR
+    terms = [
+        (isa.Opcode.LOAD, exact, -3),
+        (isa.Opcode.PUSH, None, 0),
+        (isa.Opcode.LOAD, exact, ord("a")),
+        (isa.Opcode.STORE, isa.AddressType.ABSOLUTE, machine.OUTPUT_PORT),
+        (isa.Opcode.INCREMENT_JUMP_NONZERO, relative, -1),
+        (isa.Opcode.LOAD, exact, 2),
+        (isa.Opcode.STORE, isa.AddressType.RELATIVE_SPR, 0),
+        (isa.Opcode.DECREMENT_JUMP_NONZERO, relative, 0),
+        (isa.Opcode.HALT, None, 0),
+    ]
+    code = [
+        isa.Word(isa.WordType.INSTRUCTION, isa.Term(op, None if tag is None else isa.Address(tag, val)))
+        for op, tag, val in terms
+    ]
+    expected = machine.simulation(code, [])
+    assert expected == ("aaa", 13, 49)
+    assert machine.simulation(code, [], mode=mode) == expected
+
+
+def test_fused_instruction_ticks():
+    ticks = machine.instruction_ticks()
+    assert ticks[(isa.Opcode.JUMP_ZERO, isa.AddressType.RELATIVE_IPR)] == (2, 3)
+    assert ticks[(isa.Opcode.INCREMENT_JUMP_NONZERO, isa.AddressType.RELATIVE_IPR)] == (5, 6)
+    assert ticks[(isa.Opcode.DECREMENT_JUMP_NONZERO, isa.AddressType.RELATIVE_IPR)] == (5, 6)
+    assert ticks[(isa.Opcode.DIVMOD, isa.AddressType.EXACT)] == (6, 6)
+    assert (isa.Opcode.JUMP_ZERO, isa.AddressType.ABSOLUTE) not in ticks
+
+
+def test_simulation_streams_ports():
+    code, _ = load_example("cat")
+    input_text = "stream\n" * 50
+    sink = io.StringIO()
+    port = machine.InputPort(io.StringIO(input_text), chunk_size=5)
+    output, instr, ticks = machine.simulation(code, port, limit=100_000, mode="fast", output_sink=sink)
+    assert (sink.getvalue(), instr, ticks) == machine.simulation(code, list(input_text), limit=100_000)
+    assert output == ""
+
+
+def test_trace_file_matches_ring_buffer_tail():
+    code, input_text = load_example("hello_user_name")
+    trace_file = io.BytesIO()
+    expected = machine.simulation(code, list(input_text))
+    tracer = tracing.Tracer(tracing.TRACE_MICRO, tracing.FileSink(trace_file))
+    assert machine.simulation(code, list(input_text), tracer=tracer) == expected
+    trace_file.seek(0)
+    records = list(tracing.read_records(trace_file))
+
+    ring = tracing.RingBuffer(capacity=100)
+    machine.simulation(code, list(input_text), tracer=tracing.Tracer(tracing.TRACE_MICRO, ring))
+    assert ring.count == len(records)
+    assert list(ring.records()) == records[-100:]
+
+    kinds = [fields[0] & ~tracing.STACK_UNKNOWN for fields in records]
+    assert kinds.count(tracing.INSTRUCTION) == expected[1] + 1
+    assert (
+        "".join(chr(fields[8]) for fields in records if fields[0] & ~tracing.STACK_UNKNOWN == tracing.OUTPUT)
+        == expected[0]
+    )
+
+
+@pytest.mark.parametrize("mode", ["predecoded", "fast"])
+def test_instruction_trace_matches_micro(mode):
+    code, input_text = load_example("cat")
+    traces = []
+    for trace_mode in ("micro", mode):
+        ring = tracing.RingBuffer()
+        machine.simulation(code, list(input_text), mode=trace_mode, tracer=tracing.Tracer(tracing.TRACE_INSTR, ring))
+        # fast mode does not keep dr and counts ticks per instruction, so only fetches are compared
+        traces.append(
+            [
+                fields[:8] + fields[9:]
+                for fields in ring.records()
+                if fields[0] & ~tracing.STACK_UNKNOWN == tracing.INSTRUCTION
+            ]
+        )
+    assert traces[0] == traces[1]
+
+
+@pytest.mark.parametrize("mode", ["micro", "predecoded", "fast", "block"])
+def test_machine_resumes_on_budget_and_input(mode):
+    code, _ = load_example("hello_user_name")
+    expected = machine.simulation(code, list("Alice\n"))
+    program = machine.Machine(code, mode=mode)
+    budgets = itertools.cycle([{"max_instr": 3}, {"max_ticks": 8}])
+    statuses = []
+    for symbol in "Alice\n":
+        while (status := program.run(**next(budgets))).reason != "input":
+            statuses.append(status.reason)
+        program.input_port.feed(symbol)
+    while not (status := program.run(**next(budgets))).finished:
+        statuses.append(status.reason)
+    assert {"instr_limit", "tick_limit"} <= set(statuses)
+    assert (program.output_port.getvalue(), status.instr, status.ticks) == expected
+
+
+def test_machine_deadline():
+    code, _ = load_example("prob2")
+    status = machine.Machine(code).run(deadline=0, check_every=10)
+    assert (status.reason, status.instr) == ("deadline", 10)
+
+
+@pytest.mark.parametrize("mode", ["micro", "block"])
+def test_machine_run_async_waits_for_input(mode):
+    code, _ = load_example("hello_user_name")
+    expected = machine.simulation(code, list("Bob\n"))
+
+    async def session():
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        program = machine.Machine(code, mode=mode)
+        task = asyncio.create_task(program.run_async(queue.get, yield_every=5))
+        for text in ["B", "ob", "\n", ""]:
+            await asyncio.sleep(0)
+            await queue.put(text)
+        return await task, program.output_port.getvalue()
+
+    status, output = asyncio.run(session())
+    assert (output, status.instr, status.ticks) == expected
+
+
+@pytest.mark.parametrize("name", examples)
+def test_binary_executable(name, tmp_path):
+    with open(os.path.join("examples", name), encoding="utf-8") as file:
+        code = translator.translate(file.read())
+    words, input_text = load_example(name)
+    binary = isa.serialize_binary(code)
+    decoded = isa.deserialize_binary(binary)
+    assert [(word.val, word.instr and (word.instr.op, str(word.instr.arg))) for word in decoded] == [
+        (word.val, word.instr and (word.instr.op, str(word.instr.arg))) for word in words
+    ]
+    assert isa.read_debug_info(binary)["blocks"][0] == [0, 1, "#"]
+
+    (tmp_path / "code.bin").write_bytes(isa.serialize_binary(code, debug=False))
+    with open(tmp_path / "code.bin", "rb") as file:
+        image = machine.read_code(file)
+    assert isinstance(image, machine.ProgramImage)
+    for mode in ["micro", "block"]:
+        expected = machine.simulation(words, list(input_text), mode=mode)
+        assert machine.simulation(image, list(input_text), mode=mode) == expected
+
+
+def test_json_executable_cache(tmp_path, monkeypatch):
+    with open(os.path.join("examples", "hello_user_name"), encoding="utf-8") as file:
+        code = translator.translate(file.read())
+    words, input_text = load_example("hello_user_name")
+    expected = machine.simulation(words, list(input_text), mode="fast")
+    executable = tmp_path / "code.json"
+    executable.write_text(isa.serialize(code), encoding="utf-8")
+    cache = tmp_path / machine.CACHE_DIR / "code.json.bin"
+
+    def load() -> machine.ProgramImage:
+        with open(executable, "rb") as file:
+            return machine.read_code(file)
+
+    assert machine.simulation(load(), list(input_text), mode="fast") == expected
+    assert cache.exists()
+
+    with monkeypatch.context() as patched:
+        patched.setattr(machine, "deserialize", None)
+        assert machine.simulation(load(), list(input_text), mode="fast") == expected
+
+    cache.write_bytes(cache.read_bytes()[:-4] + b"\xff" * 4)
+    assert machine.simulation(load(), list(input_text), mode="fast") == expected
+    executable.write_text(isa.serialize(translator.translate('(print "changed")')), encoding="utf-8")
+    assert machine.simulation(load(), [], mode="fast")[0] == "changed"
+
+
+def test_failed_cache_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    executable = tmp_path / "code.json"
+    executable.write_text(isa.serialize(translator.translate('(print "x")')), encoding="utf-8")
+
+    def replace(self, target):
+        raise PermissionError
+
+    monkeypatch.setattr(pathlib.Path, "replace", replace)
+    with open(executable, "rb") as file:
+        assert machine.simulation(machine.read_code(file), [], mode="fast")[0] == "x"
+    assert list((tmp_path / machine.CACHE_DIR).iterdir()) == []
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import typing
+
+from isa import Address, AddressType, Opcode, Term
+
+Rule = typing.Callable[[list[Term]], list[Term] | None]
+
+
+def same_operand(left: str | int | Address | None, right: str | int | Address | None) -> bool:
+    if isinstance(left, Address) and isinstance(right, Address):
+        return left.tag == right.tag and left.val == right.val
+    return type(left) is type(right) and left == right
+
+
+def is_top(arg: str | int | Address | None) -> bool:
+    return isinstance(arg, Address) and arg.tag == AddressType.RELATIVE_SPR and arg.val == 0
+
+
+def is_memory(arg: str | int | Address | None) -> bool:
+    """Variable or stack cell: reading it back gives the stored value."""
+    return isinstance(arg, str) or (isinstance(arg, Address) and arg.tag == AddressType.RELATIVE_SPR)
+
+
+pure_addresses = (AddressType.EXACT, AddressType.RELATIVE_SPR)
+
+
+def is_pure(arg: str | int | Address | None) -> bool:
+    """Operand which is read without side effects, unlike ports behind absolute and indirect addresses."""
+    return isinstance(arg, str | int) or (isinstance(arg, Address) and arg.tag in pure_addresses)
+
+
+def store_reload(window: list[Term]) -> list[Term] | None:
+    store, load = window
+    if store.op == Opcode.STORE and load.op == Opcode.LOAD and is_memory(store.arg):
+        return [store] if same_operand(store.arg, load.arg) else None
+    return None
+
+
+def push_reload(window: list[Term]) -> list[Term] | None:
+    push, load = window
+    return [push] if push.op == Opcode.PUSH and load.op == Opcode.LOAD and is_top(load.arg) else None
+
+
+def store_pop(window: list[Term]) -> list[Term] | None:
+    store, pop = window
+    return [Term(Opcode.POPN)] if store.op == Opcode.STORE and is_top(store.arg) and pop.op == Opcode.POP else None
+
+
+def push_pop(window: list[Term]) -> list[Term] | None:
+    push, pop = window
+    return [] if push.op == Opcode.PUSH and pop.op in (Opcode.POP, Opcode.POPN) else None
+
+
+def pop_push(window: list[Term]) -> list[Term] | None:
+    pop, push = window
+    if pop.op == Opcode.POPN and push.op == Opcode.PUSH:
+        return [Term(Opcode.STORE, Address(AddressType.RELATIVE_SPR, 0))]
+    return None
+
+
+def dead_load(window: list[Term]) -> list[Term] | None:
+    first, second = window
+    return [second] if first.op == Opcode.LOAD and is_pure(first.arg) and second.op == Opcode.LOAD else None
+
+
+def commutative_operand(window: list[Term]) -> list[Term] | None:
+    """`push, ld a, add *sp, popn` is `add a`, the stack is one cell lower in between."""
+    push, load, operation, pop = window
+    if push.op != Opcode.PUSH or load.op != Opcode.LOAD or pop.op != Opcode.POPN:
+        return None
+    if operation.op not in (Opcode.ADD, Opcode.MULTIPLY) or not is_top(operation.arg) or not is_pure(load.arg):
+        return None
+    arg = load.arg
+    if isinstance(arg, Address) and arg.tag == AddressType.RELATIVE_SPR:
+        if arg.val == 0:
+            return None
+        arg = Address(AddressType.RELATIVE_SPR, arg.val - 1)
+    return [Term(operation.op, arg, load.desc)]
+
+
+rules: dict[str, tuple[int, Rule]] = {
+    "store_reload": (2, store_reload),
+    "push_reload": (2, push_reload),
+    "store_pop": (2, store_pop),
+    "push_pop": (2, push_pop),
+    "pop_push": (2, pop_push),
+    "dead_load": (2, dead_load),
+    "commutative_operand": (4, commutative_operand),
+}
+
+JUMP_TO_NEXT = "jump_to_next"
+all_rules = [*rules, JUMP_TO_NEXT]
+
+
+def is_relative_jump(term: Term) -> bool:
+    return isinstance(term.arg, Address) and term.arg.tag == AddressType.RELATIVE_IPR
+
+
+def jump_targets(code: list[Term]) -> dict[Term, Term | None]:
+    """Target of every relative jump, None is the end of the code."""
+    targets = {}
+    for index, term in enumerate(code):
+        if is_relative_jump(term):
+            target = index + term.arg.val
+            assert 0 <= target <= len(code), f"jump out of code, got {term} at {index}"
+            targets[term] = code[target] if target < len(code) else None
+    return targets
+
+
+def rewrite_at(
+    code: list[Term], index: int, targets: dict[Term, Term | None], labels: set[Term], enabled: typing.Collection[str]
+) -> tuple[str, int, list[Term]] | None:
+    term = code[index]
+    if term.op == Opcode.JUMP and term in targets:
+        following = code[index + 1] if index + 1 < len(code) else None
+        return (JUMP_TO_NEXT, 1, []) if JUMP_TO_NEXT in enabled and targets[term] is following else None
+    for name in enabled:
+        if name not in rules:
+            continue
+        size, rule = rules[name]
+        window = code[index : index + size]
+        # a jump into the middle of the window would skip part of the replacement
+        if len(window) < size or any(term in labels for term in window[1:]):
+            continue
+        replacement = rule(window)
+        if replacement is not None:
+            return name, size, replacement
+    return None
+
+
+def optimize_pass(
+    code: list[Term], targets: dict[Term, Term | None], enabled: typing.Collection[str], stats: dict[str, int]
+) -> list[Term]:
+    labels = {target for target in targets.values() if target is not None}
+    result: list[Term] = []
+    moved: dict[Term, Term | None] = {}
+    index = 0
+    while index < len(code):
+        term = code[index]
+        rewrite = rewrite_at(code, index, targets, labels, enabled)
+        if rewrite is None:
+            result.append(term)
+            index += 1
+            continue
+        name, size, replacement = rewrite
+        stats[name] = stats.get(name, 0) + size - len(replacement)
+        if name == JUMP_TO_NEXT:
+            del targets[term]
+        if term in labels and (not replacement or replacement[0] is not term):
+            following = code[index + size] if index + size < len(code) else None
+            moved[term] = replacement[0] if replacement else following
+        result.extend(replacement)
+        index += size
+    for jump, target in targets.items():
+        while target in moved:
+            target = moved[target]
+        targets[jump] = target
+    return result
+
+
+def optimize(
+    code: list[Term], enabled: typing.Collection[str] = all_rules, stats: dict[str, int] | None = None
+) -> list[Term]:
+    """Rewrites instruction patterns of generated code until none of `enabled` rules applies.
+
+    Relative jumps are tracked by target instruction and their offsets are recomputed at the end.
+    `stats` collects instructions removed by every rule.
+
+    >>> code = [Term(Opcode.PUSH), Term(Opcode.LOAD, "x"), Term(Opcode.ADD, Address(AddressType.RELATIVE_SPR, 0)),
+    ...         Term(Opcode.STORE, Address(AddressType.RELATIVE_SPR, 0)), Term(Opcode.POP), Term(Opcode.HALT)]
+    >>> [str(term) for term in optimize(code)]
+    ['add x', 'halt']
+    """
+    stats = {} if stats is None else stats
+    targets = jump_targets(code)
+    while True:
+        size = len(code)
+        code = optimize_pass(code, targets, enabled, stats)
+        if len(code) == size:
+            break
+    position = {term: index for index, term in enumerate(code)}
+    for jump, target in targets.items():
+        offset = (len(code) if target is None else position[target]) - position[jump]
+        jump.arg = Address(AddressType.RELATIVE_IPR, offset)
+    return code
@@ -0,0 +1,52 @@
+import bench
+import isa
+import machine
+import peephole
+import pytest
+import translator
+from isa import Address, AddressType, Opcode, Term
+
+
+def top() -> Address:
+    return Address(AddressType.RELATIVE_SPR, 0)
+
+
+def test_jumps_are_retargeted():
+    skip = Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 6))
+    back = Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, -6))
+    code = [
+        Term(Opcode.LOAD, "x"),
+        skip,
+        Term(Opcode.PUSH),
+        Term(Opcode.LOAD, "y"),
+        Term(Opcode.ADD, top()),
+        Term(Opcode.STORE, top()),
+        Term(Opcode.POP),
+        back,
+        Term(Opcode.HALT),
+    ]
+    optimized = peephole.optimize(code)
+    assert [str(term) for term in optimized] == ["ld x", "jme *ip+0x2", "add y", "jmp *ip-0x2", "halt"]
+
+
+def test_jump_into_pattern_keeps_it():
+    into = Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, 2))
+    code = [into, Term(Opcode.STORE, top()), Term(Opcode.POP), Term(Opcode.HALT)]
+    assert [str(term) for term in peephole.optimize(code)] == ["jmp *ip+0x2", "st *sp", "pop", "halt"]
+
+    to_next = Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, 1))
+    stats = {}
+    assert [str(term) for term in peephole.optimize([to_next, Term(Opcode.HALT)], stats=stats)] == ["halt"]
+    assert stats == {"jump_to_next": 1}
+
+
+@pytest.mark.parametrize("case", bench.example_cases() + bench.synthetic_cases(1), ids=lambda case: case.name)
+def test_optimized_program_is_equivalent(case):
+    results = []
+    for opt_level in (0, 1):
+        code = isa.deserialize(isa.serialize(translator.translate(case.source, opt_level)))
+        results.append(machine.simulation(code, list(case.input_text), case.memory_size, case.limit, mode="fast"))
+    (output, instr, ticks), (optimized_output, optimized_instr, optimized_ticks) = results
+    assert optimized_output == output
+    assert optimized_instr <= instr or instr == case.limit
+    assert optimized_ticks <= ticks
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import argparse
+import bisect
+import collections
+import typing
+
+from isa import AddressType, Code, Opcode, Term, deserialize, serialize
+from machine import DataPath, FastControlUnit, extend_bits, mask_32, read_input, run_control_unit
+from translator import translate
+
+Path = tuple[str, ...]
+
+
+def function_table(code: Code) -> list[tuple[int, str]]:
+    """Start address and name of every instruction block: `#`, used functions and `start`."""
+    return [(block[0], block[2]) for block in code.text]
+
+
+class ProfilingControlUnit(FastControlUnit):
+    """FastControlUnit which keeps a shadow call stack.
+
+    Only call, ret and jumps between functions are wrapped, they close the current
+    segment of instructions and ticks and attribute it to the current stack path.
+    """
+
+    def __init__(self, data_path: DataPath, functions: list[tuple[int, str]]):
+        super().__init__(data_path)
+        self.starts = [start for start, _ in functions]
+        self.names = [name for _, name in functions]
+        self.paths: list[Path] = [(self.function_at(data_path.ip),)]
+        self.calls: collections.Counter[str] = collections.Counter({self.paths[0][0]: 1})
+        self.instr_by_path: collections.Counter[Path] = collections.Counter()
+        self.ticks_by_path: collections.Counter[Path] = collections.Counter()
+        self.segment_instr, self.segment_ticks = 0, 0
+        for op, boundary in ((Opcode.CALL, self.enter), (Opcode.RETURN, self.leave), (Opcode.JUMP, self.transfer)):
+            self.handler_factories[op] = self.profiled(self.handler_factories[op], boundary)
+
+    def function_at(self, addr: int) -> str:
+        return self.names[max(0, bisect.bisect_right(self.starts, addr) - 1)]
+
+    def profiled(
+        self,
+        factory: typing.Callable[[Term, tuple[int, int]], typing.Callable[[], int]],
+        boundary: typing.Callable[[int], None],
+    ) -> typing.Callable[[Term, tuple[int, int]], typing.Callable[[], int]]:
+        def profiled_factory(instr: Term, ticks: tuple[int, int]) -> typing.Callable[[], int]:
+            # handlers are decoded on fetch, so ip is the address of the instruction
+            addr, handler = self.data_path.ip, factory(instr, ticks)
+            if instr.op == Opcode.JUMP:
+                operand = extend_bits(instr.arg.val, 20)
+                target = (operand if instr.arg.tag == AddressType.ABSOLUTE else operand + addr) & mask_32
+                if self.function_at(target) == self.function_at(addr):
+                    return handler
+
+            def profiled_handler() -> int:
+                cost = handler()
+                boundary(cost)
+                return cost
+
+            return profiled_handler
+
+        return profiled_factory
+
+    def close_segment(self, instr_counter: int, ticks: int):
+        path = self.paths[-1]
+        self.instr_by_path[path] += instr_counter - self.segment_instr
+        self.ticks_by_path[path] += ticks - self.segment_ticks
+        self.segment_instr, self.segment_ticks = instr_counter, ticks
+
+    def enter(self, cost: int):
+        # the boundary instruction is not counted yet and belongs to the segment it closes
+        self.close_segment(self.instr_counter + 1, self.ticks + cost)
+        name = self.function_at(self.data_path.ip)
+        self.paths.append((*self.paths[-1], name))
+        self.calls[name] += 1
+
+    def leave(self, cost: int):
+        self.close_segment(self.instr_counter + 1, self.ticks + cost)
+        if len(self.paths) > 1:
+            self.paths.pop()
+
+    def transfer(self, cost: int):
+        self.close_segment(self.instr_counter + 1, self.ticks + cost)
+        name = self.function_at(self.data_path.ip)
+        self.paths[-1] = (*self.paths[-1][:-1], name)
+        self.calls[name] += 1
+
+    def run(self, limit: int, tick_limit: int | None = None):
+        try:
+            super().run(limit, tick_limit)
+        finally:
+            self.close_segment(self.instr_counter, self.ticks)
+
+    def functions(self) -> dict[str, tuple[int, int, int, int, int]]:
+        """Name to (calls, instructions, self instructions, ticks, self ticks)."""
+        stats: dict[str, list[int]] = collections.defaultdict(lambda: [0, 0, 0, 0])
+        for path, instr in self.instr_by_path.items():
+            ticks = self.ticks_by_path[path]
+            # recursive frames are counted once in the inclusive cost
+            for name in set(path):
+                stats[name][0] += instr
+                stats[name][2] += ticks
+            stats[path[-1]][1] += instr
+            stats[path[-1]][3] += ticks
+        return {name: (self.calls[name], *values) for name, values in stats.items()}
+
+    def summary(self) -> str:
+        lines = [f"{'function':<24}{'calls':>8}{'instr':>12}{'self instr':>12}{'ticks':>12}{'self ticks':>12}"]
+        rows = sorted(self.functions().items(), key=lambda item: (-item[1][4], item[0]))
+        for name, (calls, instr, self_instr, ticks, self_ticks) in rows:
+            lines.append(f"{name:<24}{calls:>8}{instr:>12}{self_instr:>12}{ticks:>12}{self_ticks:>12}")
+        return "\n".join(lines)
+
+    def folded(self, weight: str = "ticks") -> str:
+        """Stacks in the folded format of flame graph tools: `start;f;g 42`."""
+        by_path = self.ticks_by_path if weight == "ticks" else self.instr_by_path
+        return "".join(f"{';'.join(path)} {value}\n" for path, value in sorted(by_path.items()) if value > 0)
+
+
+def profile(code: Code, input_tokens, memory_size: int = 0x1FFF, limit: int = 5_000) -> ProfilingControlUnit:
+    data_path = DataPath(memory_size, deserialize(serialize(code)), input_tokens)
+    control_unit = ProfilingControlUnit(data_path, function_table(code))
+    run_control_unit(control_unit, limit)
+    data_path.output_port.flush()
+    return control_unit
+
+
+def main(
+    src: typing.TextIO,
+    in_file: typing.TextIO | None,
+    limit: int = 5_000,
+    folded_file: typing.TextIO | None = None,
+    weight: str = "ticks",
+):
+    control_unit = profile(translate(src.read()), read_input(in_file), limit=limit)
+    print(control_unit.summary())
+    if folded_file is not None:
+        folded_file.write(control_unit.folded(weight))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile lisp program by functions.")
+    parser.add_argument(
+        "src", type=argparse.FileType(encoding="utf-8"), metavar="source_file", help="file with source code"
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        dest="in_file",
+        type=argparse.FileType(encoding="utf-8"),
+        metavar="input_file",
+        help="file with input data for executable (default: empty file)",
+    )
+    parser.add_argument(
+        "--limit", "-l", dest="limit", type=int, default=5_000, help="maximum amount of executed instructions"
+    )
+    parser.add_argument(
+        "--folded",
+        "-f",
+        dest="folded_file",
+        type=argparse.FileType("w", encoding="utf-8"),
+        metavar="folded_file",
+        help="file for folded stacks, input for flamegraph.pl or speedscope",
+    )
+    parser.add_argument(
+        "--weight", dest="weight", choices=["ticks", "instr"], default="ticks", help="folded stacks weight"
+    )
+    namespace = parser.parse_args()
+    main(namespace.src, namespace.in_file, namespace.limit, namespace.folded_file, namespace.weight)
@@ -0,0 +1,35 @@
+import os
+
+import machine
+import profiler
+import pytest
+import translator
+from machine_test import examples, load_example
+
+
+@pytest.mark.parametrize("name", examples)
+def test_profile_attributes_every_instruction(name):
+    with open(os.path.join("examples", name), encoding="utf-8") as file:
+        code = translator.translate(file.read())
+    words, input_text = load_example(name)
+    control_unit = profiler.profile(code, list(input_text))
+    expected = machine.simulation(words, list(input_text))
+    assert (control_unit.data_path.output_port.getvalue(), control_unit.instr_counter, control_unit.ticks) == expected
+
+    functions = control_unit.functions()
+    assert sum(stats[2] for stats in functions.values()) == control_unit.instr_counter
+    assert sum(stats[4] for stats in functions.values()) == control_unit.ticks
+    assert functions["start"][1] == control_unit.instr_counter - 1
+    for weight, total in (("ticks", control_unit.ticks), ("instr", control_unit.instr_counter)):
+        lines = control_unit.folded(weight).splitlines()
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == total
+
+
+def test_profile_recursion():
+    with open(os.path.join("examples", "prob2"), encoding="utf-8") as file:
+        code = translator.translate(file.read(), inline_limit=0)
+    functions = profiler.profile(code, [], limit=100_000).functions()
+    calls, instr, self_instr, _, _ = functions["fibonacci_sum_even"]
+    assert calls == 32
+    assert instr == self_instr
+    assert functions["euler_problem"][1] == functions["euler_problem"][2] + instr
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import collections
+import math
+import time
+import typing
+
+from isa import Word
+from machine import DataPath, InputPort, OutputPort, ProgramImage, control_unit_class
+from snapshot import changed_pages, load_pages, registers, set_registers
+
+READY = "ready"
+WAITING = "waiting"
+HALTED = "halted"
+OUT_OF_QUOTA = "out_of_quota"
+
+
+class Instance:
+    """One user of the shared program.
+
+    Between time slices only registers, counters and the memory pages that differ from
+    the program image are kept, a few kilobytes for a typical program.
+    """
+
+    def __init__(
+        self, name: str, input_port: InputPort, output_port: OutputPort, priority: int, tick_quota: int | None
+    ):
+        assert priority > 0, f"priority must be positive, got {priority}"
+        self.name = name
+        self.input_port = input_port
+        self.output_port = output_port
+        self.priority = priority
+        self.tick_quota = tick_quota
+        self.status = READY
+        self.registers: tuple[int, int, int, int, int, int] | None = None
+        self.pages: dict[int, bytes] = {}
+        self.instr_counter = 0
+        self.ticks = 0
+
+    def memory_usage(self) -> int:
+        return sum(len(page) for page in self.pages.values())
+
+    def __repr__(self):
+        return f"Instance({self.name!r}, status={self.status}, instr={self.instr_counter}, ticks={self.ticks})"
+
+
+class Scheduler:
+    """Runs many instances of one program on a single data path and control unit.
+
+    Ready instances take turns in round robin, every turn lasts `slice_ticks` ticks
+    multiplied by the instance priority. An instance which finds its input port empty
+    waits until `feed`, one which spends its tick quota is stopped. Instances share the
+    program image and the decoded (or compiled) code of the control unit.
+    """
+
+    def __init__(
+        self, code: list[Word] | ProgramImage, memory_size: int = 0x1FFF, mode: str = "fast", slice_ticks: int = 2_000
+    ):
+        self.image = code if isinstance(code, ProgramImage) else ProgramImage(code)
+        self.data_path = DataPath(memory_size, self.image, [])
+        self.control_unit = control_unit_class(mode)(self.data_path)
+        self.initial_registers = registers(self.data_path)
+        self.slice_ticks = slice_ticks
+        self.instances: dict[str, Instance] = {}
+        self.ready: collections.deque[Instance] = collections.deque()
+        self.current: Instance | None = None
+        self.instr_counter = 0
+        self.ticks = 0
+        self.slices = 0
+        self.switches = 0
+        self.busy_time = 0.0
+
+    def spawn(
+        self,
+        name: str | None = None,
+        input_text: str = "",
+        priority: int = 1,
+        tick_quota: int | None = None,
+        output_sink: typing.TextIO | None = None,
+    ) -> Instance:
+        name = str(len(self.instances)) if name is None else name
+        assert name not in self.instances, f"instance {name} already exists"
+        input_port = InputPort(None)
+        input_port.feed(input_text)
+        instance = Instance(name, input_port, OutputPort(output_sink), priority, tick_quota)
+        self.instances[name] = instance
+        self.ready.append(instance)
+        return instance
+
+    def feed(self, name: str, text: str):
+        instance = self.instances[name]
+        instance.input_port.feed(text)
+        if instance.status == WAITING:
+            instance.status = READY
+            self.ready.append(instance)
+
+    def park(self):
+        """Saves the state of the instance which is loaded in the data path."""
+        if self.current is not None and self.current.status != HALTED:
+            self.current.pages = changed_pages(self.data_path)
+            self.current.registers = registers(self.data_path)
+
+    def switch_to(self, instance: Instance):
+        if self.current is instance:
+            return
+        data_path, control_unit = self.data_path, self.control_unit
+        self.park()
+        load_pages(data_path, instance.pages)
+        set_registers(data_path, self.initial_registers if instance.registers is None else instance.registers)
+        data_path.input_port, data_path.output_port = instance.input_port, instance.output_port
+        control_unit.instr_counter, control_unit.ticks = instance.instr_counter, instance.ticks
+        self.current = instance
+        self.switches += 1
+
+    def step(self) -> Instance | None:
+        """Runs one time slice of the next ready instance, None when nobody is ready."""
+        if not self.ready:
+            return None
+        instance = self.ready.popleft()
+        self.switch_to(instance)
+        control_unit = self.control_unit
+        tick_bound = instance.ticks + self.slice_ticks * instance.priority
+        if instance.tick_quota is not None:
+            tick_bound = min(tick_bound, instance.tick_quota)
+
+        started = time.perf_counter()
+        stop = control_unit.run_to_input(math.inf, tick_bound)
+        self.busy_time += time.perf_counter() - started
+        self.slices += 1
+        self.instr_counter += control_unit.instr_counter - instance.instr_counter
+        self.ticks += control_unit.ticks - instance.ticks
+        instance.instr_counter, instance.ticks = control_unit.instr_counter, control_unit.ticks
+
+        if stop == "halt":
+            instance.status, instance.pages = HALTED, {}
+        elif stop == "eof":
+            instance.status = WAITING
+        elif instance.tick_quota is not None and instance.ticks >= instance.tick_quota:
+            instance.status = OUT_OF_QUOTA
+        else:
+            self.ready.append(instance)
+        instance.output_port.flush()
+        return instance
+
+    def run(self, max_slices: float = math.inf) -> int:
+        """Runs time slices until every instance halts, waits or spends its quota."""
+        slices = 0
+        while slices < max_slices and self.step() is not None:
+            slices += 1
+        self.park()
+        return slices
+
+    def stats(self) -> dict[str, float]:
+        statuses = collections.Counter(instance.status for instance in self.instances.values())
+        busy_time = self.busy_time or math.inf
+        return {
+            **{status: statuses[status] for status in (READY, WAITING, HALTED, OUT_OF_QUOTA)},
+            "instr": self.instr_counter,
+            "ticks": self.ticks,
+            "slices": self.slices,
+            "switches": self.switches,
+            "busy_time": self.busy_time,
+            "instr_per_second": self.instr_counter / busy_time,
+            "ticks_per_second": self.ticks / busy_time,
+        }
@@ -0,0 +1,44 @@
+import machine
+import pytest
+import scheduler
+from machine_test import load_example
+
+
+@pytest.mark.parametrize("mode", ["micro", "fast", "block"])
+def test_instances_match_simulation(mode):
+    code, _ = load_example("hello_user_name")
+    names = [f"user{i}\n" for i in range(40)]
+    pool = scheduler.Scheduler(code, mode=mode, slice_ticks=50)
+    for i, name in enumerate(names):
+        # half of the instances get their input later
+        pool.spawn(input_text=name if i % 2 == 0 else "")
+    pool.run()
+    assert pool.stats()[scheduler.WAITING] == len(names) // 2
+    for i, name in enumerate(names):
+        if i % 2 == 1:
+            pool.feed(str(i), name)
+    pool.run()
+
+    for i, name in enumerate(names):
+        instance = pool.instances[str(i)]
+        assert instance.status == scheduler.HALTED
+        expected = machine.simulation(code, list(name))
+        assert (instance.output_port.getvalue(), instance.instr_counter, instance.ticks) == expected
+    stats = pool.stats()
+    assert stats[scheduler.HALTED] == len(names)
+    assert stats["ticks"] == sum(instance.ticks for instance in pool.instances.values())
+
+
+def test_priorities_and_quotas():
+    code, _ = load_example("prob2")
+    pool = scheduler.Scheduler(code, slice_ticks=100)
+    low, high = pool.spawn("low"), pool.spawn("high", priority=3)
+    limited = pool.spawn("limited", tick_quota=250)
+    pool.run(max_slices=3)
+    assert high.ticks >= 3 * 100 > low.ticks >= 100
+    assert 0 < low.memory_usage() <= 4096
+
+    pool.run()
+    assert (low.status, high.status) == (scheduler.HALTED, scheduler.HALTED)
+    assert limited.status == scheduler.OUT_OF_QUOTA
+    assert 250 <= limited.ticks < 250 + 20
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import array
+import io
+import struct
+
+from machine import PAGE_SHIFT, ControlUnit, DataPath, InputPort, OutputPort, control_unit_class
+
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_BYTES = PAGE_SIZE * 4
+
+# memory_size, program_size, ac, ip, ar, dr, sp, fl, ticks, instr_counter, input_consumed,
+# output_written, pending_input length, output length, amount of pages
+header = struct.Struct("<IIIIIIIIQQQQIII")
+page_index = struct.Struct("<I")
+
+
+class Snapshot:
+    """Machine state between two instructions.
+
+    Memory is kept as the pages which differ from the program image, input as the
+    amount of consumed characters and the ones already read from the stream but not
+    yet consumed, output as the characters not yet flushed to the sink.
+    """
+
+    def __init__(
+        self,
+        memory_size: int,
+        program_size: int,
+        registers: tuple[int, int, int, int, int, int],
+        ticks: int,
+        instr_counter: int,
+        input_consumed: int,
+        pending_input: str,
+        output_written: int,
+        output: str,
+        pages: dict[int, bytes],
+    ):
+        self.memory_size = memory_size
+        self.program_size = program_size
+        self.registers = registers
+        self.ticks = ticks
+        self.instr_counter = instr_counter
+        self.input_consumed = input_consumed
+        self.pending_input = pending_input
+        self.output_written = output_written
+        self.output = output
+        self.pages = pages
+
+    def to_bytes(self) -> bytes:
+        pending_input, output = self.pending_input.encode(), self.output.encode()
+        chunks = [
+            header.pack(
+                self.memory_size,
+                self.program_size,
+                *self.registers,
+                self.ticks,
+                self.instr_counter,
+                self.input_consumed,
+                self.output_written,
+                len(pending_input),
+                len(output),
+                len(self.pages),
+            ),
+            pending_input,
+            output,
+        ]
+        for index, page in sorted(self.pages.items()):
+            chunks.extend([page_index.pack(index), page])
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Snapshot:
+        fields = header.unpack_from(data)
+        memory_size, program_size, registers = fields[0], fields[1], fields[2:8]
+        ticks, instr_counter, input_consumed, output_written, input_len, output_len, page_count = fields[8:]
+        pos = header.size
+        pending_input = data[pos : pos + input_len].decode()
+        pos += input_len
+        output = data[pos : pos + output_len].decode()
+        pos += output_len
+        pages = {}
+        for _ in range(page_count):
+            (index,) = page_index.unpack_from(data, pos)
+            pos += page_index.size
+            pages[index] = data[pos : pos + PAGE_BYTES]
+            pos += PAGE_BYTES
+        assert pos == len(data), f"snapshot has {len(data) - pos} trailing bytes"
+        return cls(
+            memory_size,
+            program_size,
+            registers,
+            ticks,
+            instr_counter,
+            input_consumed,
+            pending_input,
+            output_written,
+            output,
+            pages,
+        )
+
+
+def page_range(data_path: DataPath, index: int) -> tuple[int, int]:
+    start = index * PAGE_SIZE
+    return start, min(start + PAGE_SIZE, data_path.memory_size)
+
+
+def initial_words(data_path: DataPath, start: int, end: int) -> array.array:
+    words = data_path.image.data[start:end]
+    return words + array.array("I", bytes(4 * (end - start - len(words))))
+
+
+def dirty_pages(data_path: DataPath) -> list[int]:
+    dirty, pages = data_path.dirty_pages, []
+    index = dirty.find(1)
+    while index != -1:
+        pages.append(index)
+        index = dirty.find(1, index + 1)
+    return pages
+
+
+def changed_pages(data_path: DataPath) -> dict[int, bytes]:
+    """Memory pages which differ from the program image. Only the pages written since
+    the last reset are compared, the last page is completed with zeros."""
+    pages = {}
+    for index in dirty_pages(data_path):
+        start, end = page_range(data_path, index)
+        words = data_path.memory[start:end]
+        if words != initial_words(data_path, start, end):
+            pages[index] = words.tobytes() + bytes(4 * (start + PAGE_SIZE - end))
+    return pages
+
+
+def load_pages(data_path: DataPath, pages: dict[int, bytes]):
+    """Resets memory to the program image with `pages` on top. Only the pages written
+    since the last reset and `pages` are rewritten, in place, so code compiled against
+    the memory array stays valid."""
+    memory, dirty = data_path.memory, data_path.dirty_pages
+    for index in {*dirty_pages(data_path), *pages}:
+        start, end = page_range(data_path, index)
+        if index in pages:
+            memory[start:end] = array.array("I", pages[index][: 4 * (end - start)])
+        else:
+            memory[start:end] = initial_words(data_path, start, end)
+        dirty[index] = index in pages
+
+
+def registers(data_path: DataPath) -> tuple[int, int, int, int, int, int]:
+    return data_path.ac, data_path.ip, data_path.ar, data_path.dr, data_path.sp, data_path.fl
+
+
+def set_registers(data_path: DataPath, values: tuple[int, int, int, int, int, int]):
+    data_path.ac, data_path.ip, data_path.ar, data_path.dr, data_path.sp, data_path.fl = values
+    data_path.ir = None
+
+
+def take(control_unit: ControlUnit) -> Snapshot:
+    data_path = control_unit.data_path
+    input_port, output_port = data_path.input_port, data_path.output_port
+    return Snapshot(
+        data_path.memory_size,
+        len(data_path.image),
+        registers(data_path),
+        control_unit.ticks,
+        control_unit.instr_counter,
+        input_port.consumed,
+        input_port.buffer[input_port.pos :],
+        output_port.written,
+        output_port.getvalue(),
+        changed_pages(data_path),
+    )
+
+
+def restore(control_unit: ControlUnit, snapshot: Snapshot, input_port: InputPort | None = None):
+    """Puts the snapshot state into the machine of the same program.
+
+    Without `input_port` the machine gets the input characters which were pending
+    when the snapshot was taken. Only the pages written since the last restore and
+    the snapshot pages are rewritten.
+    """
+    data_path = control_unit.data_path
+    assert data_path.memory_size == snapshot.memory_size, "snapshot is taken with another memory size"
+    assert len(data_path.image) == snapshot.program_size, "snapshot is taken from another program"
+    load_pages(data_path, snapshot.pages)
+    set_registers(data_path, snapshot.registers)
+    control_unit.ticks, control_unit.instr_counter = snapshot.ticks, snapshot.instr_counter
+
+    if input_port is None:
+        input_port = InputPort(io.StringIO(snapshot.pending_input))
+        input_port.consumed = snapshot.input_consumed
+    data_path.input_port = input_port
+    data_path.output_port = OutputPort(data_path.output_port.sink, data_path.output_port.flush_size)
+    data_path.output_port.buffer.extend(snapshot.output)
+    data_path.output_port.written = snapshot.output_written
+
+
+def fork(control_unit: ControlUnit, input_port: InputPort | None = None, mode: str | None = None) -> ControlUnit:
+    """New machine in the same state, which shares the program image with the original.
+
+    Memory is copied in one piece instead of page by page. Pending input is copied
+    unless `input_port` is given; the fork collects its output without a sink.
+    """
+    data_path = control_unit.data_path
+    if input_port is None:
+        pending = data_path.input_port
+        input_port = InputPort(io.StringIO(pending.buffer[pending.pos :]))
+        input_port.consumed = pending.consumed
+    forked_path = DataPath(data_path.memory_size, data_path.image, input_port, data_path.alu_sum)
+    forked_path.memory[:] = data_path.memory
+    forked_path.dirty_pages[:] = data_path.dirty_pages
+    set_registers(forked_path, registers(data_path))
+    forked_path.output_port.buffer.extend(data_path.output_port.buffer)
+    forked_path.output_port.written = data_path.output_port.written
+
+    forked = (type(control_unit) if mode is None else control_unit_class(mode))(forked_path)
+    forked.ticks, forked.instr_counter = control_unit.ticks, control_unit.instr_counter
+    return forked
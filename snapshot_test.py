@@ -0,0 +1,79 @@
+import io
+
+import jit
+import machine
+import pytest
+import snapshot
+from machine_test import load_example
+
+names = ["Alice\n", "Bob\n", "Mallory\n"]
+
+
+def run_prefix(name: str) -> machine.FastControlUnit:
+    code, _ = load_example(name)
+    control_unit = machine.FastControlUnit(machine.DataPath(0x1FFF, code, []))
+    assert control_unit.run_to_input(5_000) == "eof"
+    return control_unit
+
+
+def finish(control_unit: machine.ControlUnit) -> tuple[str, int, int]:
+    machine.run_control_unit(control_unit, 5_000)
+    return control_unit.data_path.output_port.getvalue(), control_unit.instr_counter, control_unit.ticks
+
+
+@pytest.mark.parametrize("mode", ["micro", "predecoded", "fast", "block"])
+def test_fork_from_first_input(mode):
+    code, _ = load_example("hello_user_name")
+    prefix = run_prefix("hello_user_name")
+    for name in names:
+        forked = snapshot.fork(prefix, machine.InputPort.from_tokens(list(name)), mode)
+        assert finish(forked) == machine.simulation(code, list(name))
+
+
+@pytest.mark.parametrize("mode", ["micro", "fast", "block"])
+def test_restore_from_bytes(mode):
+    code, _ = load_example("hello_user_name")
+    prefix = run_prefix("hello_user_name")
+    prefix.data_path.input_port = machine.InputPort(io.StringIO(names[0]))
+    # pending input and output are kept in the snapshot
+    prefix.run_to_input(prefix.instr_counter + 3)
+    saved = snapshot.Snapshot.from_bytes(snapshot.take(prefix).to_bytes())
+    assert len(saved.pages) < prefix.data_path.memory_size // snapshot.PAGE_SIZE
+
+    control_unit = machine.control_unit_class(mode)(machine.DataPath(0x1FFF, code, []))
+    memory = control_unit.data_path.memory
+    for _ in range(2):
+        # second pass restores over a finished run of the same machine
+        snapshot.restore(control_unit, saved)
+        assert control_unit.data_path.memory is memory
+        assert finish(control_unit) == machine.simulation(code, list(names[0]))
+
+
+@pytest.mark.parametrize("mode", ["micro", "fast", "block"])
+def test_only_written_pages_are_taken_and_restored(mode):
+    code, _ = load_example("prob2")
+    control_unit = machine.control_unit_class(mode)(machine.DataPath(0x1FFF, code, []))
+    data_path = control_unit.data_path
+    initial, start = data_path.memory.tobytes(), snapshot.take(control_unit)
+    finish(control_unit)
+    final, saved = data_path.memory.tobytes(), snapshot.take(control_unit)
+    memory = bytearray(initial)
+    for index, page in saved.pages.items():
+        begin = index * snapshot.PAGE_BYTES
+        assert page[: len(final) - begin] != initial[begin : begin + snapshot.PAGE_BYTES]
+        memory[begin : begin + snapshot.PAGE_BYTES] = page
+    assert memory[: len(final)] == final
+
+    # later runs write through the handlers and blocks cached in the earlier ones
+    for _ in range(jit.HOT_THRESHOLD):
+        snapshot.restore(control_unit, start)
+        assert data_path.memory.tobytes() == initial
+        finish(control_unit)
+        assert snapshot.changed_pages(data_path) == saved.pages
+
+    untouched = 0x1000
+    assert data_path.dirty_pages[untouched >> machine.PAGE_SHIFT] == 0
+    # a page which nobody wrote is not rewritten
+    data_path.memory[untouched] = 7
+    snapshot.restore(control_unit, saved)
+    assert data_path.memory[untouched] == 7
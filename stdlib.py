@@ -23,19 +23,15 @@ PRINT_FUNC = FuncInfo(
     1,
     [
         Term(Opcode.PUSH),
-        Term(Opcode.LOAD, Address(AddressType.EXACT, 0)),
+        Term(Opcode.LOAD, Address(AddressType.EXACT, -PRINT_LIMIT)),
         Term(Opcode.PUSH),
         Term(Opcode.LOAD, Address(AddressType.RELATIVE_INDIRECT_SPR, 1)),
-        Term(Opcode.COMPARE, Address(AddressType.EXACT, 0)),
-        Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 8)),
+        Term(Opcode.JUMP_ZERO, Address(AddressType.RELATIVE_IPR, 4)),
         Term(Opcode.STORE, Address(AddressType.ABSOLUTE, OUTPUT_PORT)),
         Term(Opcode.INCREMENT, Address(AddressType.RELATIVE_SPR, 1)),
-        Term(Opcode.INCREMENT, Address(AddressType.RELATIVE_SPR, 0)),
-        Term(Opcode.LOAD, Address(AddressType.RELATIVE_SPR, 0)),
-        Term(Opcode.COMPARE, Address(AddressType.EXACT, PRINT_LIMIT)),
-        Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 2)),
-        Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, -9)),
+        Term(Opcode.INCREMENT_JUMP_NONZERO, Address(AddressType.RELATIVE_IPR, -4)),
         Term(Opcode.POP),
+        Term(Opcode.ADD, Address(AddressType.EXACT, PRINT_LIMIT)),
         Term(Opcode.POPN),
         Term(Opcode.RETURN),
     ],
@@ -63,16 +59,13 @@ PRINT_INTEGER_FUNC = FuncInfo(
         Term(Opcode.LOAD, Address(AddressType.RELATIVE_SPR, 0)),
         Term(Opcode.INVERSE),
         Term(Opcode.PUSH),
-        Term(Opcode.MODULO, Address(AddressType.EXACT, 10)),
+        Term(Opcode.DIVMOD, Address(AddressType.EXACT, 10)),
         Term(Opcode.ADD, Address(AddressType.EXACT, ord("0"))),
         Term(Opcode.DECREMENT, Address(AddressType.RELATIVE_SPR, 3)),
         Term(Opcode.STORE, Address(AddressType.RELATIVE_INDIRECT_SPR, 3)),
         Term(Opcode.LOAD, Address(AddressType.RELATIVE_SPR, 0)),
-        Term(Opcode.DIVIDE, Address(AddressType.EXACT, 10)),
-        Term(Opcode.COMPARE, Address(AddressType.EXACT, 0)),
-        Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 3)),
-        Term(Opcode.STORE, Address(AddressType.RELATIVE_SPR, 0)),
-        Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, -9)),
+        Term(Opcode.JUMP_ZERO, Address(AddressType.RELATIVE_IPR, 2)),
+        Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, -6)),
         Term(Opcode.POP),
         Term(Opcode.LOAD, Address(AddressType.RELATIVE_SPR, 2)),
         Term(Opcode.CALL, PRINT_FUNC.name),
@@ -127,22 +120,18 @@ READLINE_FUNC = FuncInfo(
     [
         Term(Opcode.PUSH),
         Term(Opcode.PUSH),
-        Term(Opcode.LOAD, Address(AddressType.EXACT, 0)),
+        Term(Opcode.LOAD, Address(AddressType.EXACT, -READ_LIMIT)),
         Term(Opcode.PUSH),
         Term(Opcode.LOAD, Address(AddressType.ABSOLUTE, INPUT_PORT)),
         Term(Opcode.COMPARE, Address(AddressType.EXACT, ord("\n"))),
-        Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 8)),
+        Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 4)),
         Term(Opcode.STORE, Address(AddressType.RELATIVE_INDIRECT_SPR, 1)),
         Term(Opcode.INCREMENT, Address(AddressType.RELATIVE_SPR, 1)),
-        Term(Opcode.INCREMENT, Address(AddressType.RELATIVE_SPR, 0)),
-        Term(Opcode.LOAD, Address(AddressType.RELATIVE_SPR, 0)),
-        Term(Opcode.COMPARE, Address(AddressType.EXACT, READ_LIMIT)),
-        Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 2)),
-        Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, -9)),
+        Term(Opcode.INCREMENT_JUMP_NONZERO, Address(AddressType.RELATIVE_IPR, -5)),
         Term(Opcode.LOAD, Address(AddressType.EXACT, ord("\0"))),
         Term(Opcode.STORE, Address(AddressType.RELATIVE_INDIRECT_SPR, 1)),
-        Term(Opcode.POP),
-        Term(Opcode.POP),
+        Term(Opcode.POPN),
+        Term(Opcode.POPN),
         Term(Opcode.POP),
         Term(Opcode.RETURN),
     ],
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import struct
+import sys
+import typing
+
+from isa import Opcode, Term
+
+TRACE_OFF = 0
+TRACE_INSTR = 1
+TRACE_MICRO = 2
+
+trace_levels: dict[str, int] = {"off": TRACE_OFF, "instr": TRACE_INSTR, "micro": TRACE_MICRO}
+
+INSTRUCTION = 0
+INPUT = 1
+OUTPUT = 2
+SIGNAL = 3
+STACK_UNKNOWN = 0x80
+
+SIGNAL_ALU = 0
+SIGNAL_READ_MEMORY = 1
+SIGNAL_WRITE_MEMORY = 2
+
+signal_names = ["alu", "read_memory", "write_memory"]
+
+opcodes: list[Opcode] = list(Opcode)
+opcode_index: dict[Opcode, int] = {op: i for i, op in enumerate(opcodes)}
+
+# kind, opcode, fl, signal, tick, ip, ac, ar, dr, sp, stack_top
+record = struct.Struct("<BBBBQIIIIII")
+
+
+class RingBuffer:
+    """Keeps the last `capacity` trace records in one preallocated buffer."""
+
+    def __init__(self, capacity: int = 1 << 16):
+        assert capacity > 0, f"ring buffer capacity must be positive, got {capacity}"
+        self.capacity = capacity
+        self.data = bytearray(capacity * record.size)
+        self.count = 0
+
+    def append(self, *fields: int):
+        record.pack_into(self.data, (self.count % self.capacity) * record.size, *fields)
+        self.count += 1
+
+    def records(self) -> typing.Iterator[tuple[int, ...]]:
+        for i in range(max(0, self.count - self.capacity), self.count):
+            yield record.unpack_from(self.data, (i % self.capacity) * record.size)
+
+
+class FileSink:
+    """Appends trace records to a binary file."""
+
+    def __init__(self, file: typing.BinaryIO):
+        self.file = file
+
+    def append(self, *fields: int):
+        self.file.write(record.pack(*fields))
+
+
+class LogSink:
+    """Renders every record into the text journal as soon as it is traced."""
+
+    def __init__(self, logger: logging.Logger | None = None):
+        self.logger = logging.getLogger() if logger is None else logger
+
+    def append(self, *fields: int):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        for func, msg in render(fields):
+            # attributed to the machine function which produced the event, so the journal keeps its format
+            self.logger.handle(
+                self.logger.makeRecord(self.logger.name, logging.DEBUG, "machine.py", 0, msg, None, None, func)
+            )
+
+
+def read_records(file: typing.BinaryIO, chunk_records: int = 4096) -> typing.Iterator[tuple[int, ...]]:
+    while True:
+        chunk = file.read(record.size * chunk_records)
+        if len(chunk) == 0:
+            return
+        assert len(chunk) % record.size == 0, "trace file is truncated"
+        yield from record.iter_unpack(chunk)
+
+
+class Tracer:
+    """Packs machine state into fixed-size binary records.
+
+    Per-instruction level traces every fetched instruction and port transfer, per-micro-signal
+    level also traces every ALU pass and memory access. Nothing is formatted while tracing,
+    `render` and `decode` turn records into the text journal later.
+    """
+
+    def __init__(self, level: int, sink: RingBuffer | FileSink | LogSink):
+        self.level = level
+        self.sink = sink
+        self.control_unit = None
+
+    def attach(self, control_unit):
+        self.control_unit = control_unit
+        if self.level >= TRACE_INSTR:
+            control_unit.tracer = self
+            control_unit.data_path.tracer = self
+        if self.level >= TRACE_MICRO:
+            control_unit.data_path.signal_tracer = self
+
+    def state(self, kind: int, opcode: int = 0, signal: int = 0):
+        control_unit = self.control_unit
+        data_path = control_unit.data_path
+        stack_known = data_path.sp < data_path.memory_size
+        self.sink.append(
+            kind if stack_known else kind | STACK_UNKNOWN,
+            opcode,
+            data_path.fl,
+            signal,
+            control_unit.ticks,
+            data_path.ip,
+            data_path.ac,
+            data_path.ar,
+            data_path.dr,
+            data_path.sp,
+            data_path.memory[data_path.sp] if stack_known else 0,
+        )
+
+    def instruction(self, instr: Term):
+        self.state(INSTRUCTION, opcode=opcode_index[instr.op])
+
+    def input(self):
+        self.state(INPUT)
+
+    def output(self):
+        self.state(OUTPUT)
+
+    def signal(self, signal: int):
+        self.state(SIGNAL, signal=signal)
+
+
+def render_state(fields: tuple[int, ...]) -> str:
+    kind, _, fl, _, tick, ip, ac, ar, dr, sp, stack_top = fields
+    stack_repr = "?" if kind & STACK_UNKNOWN else hex(stack_top)
+    regs_repr = f"ac={hex(ac)} ip={hex(ip)} ar={hex(ar)} dr={hex(dr)} sp={hex(sp)} fl={hex(fl)}"
+    return f"tick={tick}\t{regs_repr} stack_top={stack_repr}".expandtabs(10)
+
+
+def render(fields: tuple[int, ...]) -> list[tuple[str, str]]:
+    """Journal lines of one record as (machine function, message) pairs."""
+    kind, opcode, signal, dr = fields[0] & ~STACK_UNKNOWN, fields[1], fields[3], fields[8]
+    if kind == INSTRUCTION:
+        func = "execute_next_instruction"
+        return [(func, render_state(fields)), (func, opcodes[opcode].name)]
+    if kind == INPUT:
+        return [("signal_read_memory", f"input: {chr(dr)!r}")]
+    if kind == OUTPUT:
+        return [("signal_write_memory", f"output: {chr(dr)!r}")]
+    if kind == SIGNAL:
+        return [(f"signal_{signal_names[signal]}", f"{signal_names[signal]}: {render_state(fields)}")]
+    raise NotImplementedError(f"unknown trace record kind, got {kind}")
+
+
+def decode(records: typing.Iterable[tuple[int, ...]]) -> typing.Iterator[str]:
+    for fields in records:
+        for _, msg in render(fields):
+            yield msg
+
+
+def main(trace_file: typing.BinaryIO, dst: typing.TextIO):
+    for line in decode(read_records(trace_file)):
+        dst.write(line + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode binary trace of the machine into text journal.")
+    parser.add_argument("trace_file", type=argparse.FileType("rb"), help="binary trace file")
+    namespace = parser.parse_args()
+    main(namespace.trace_file, sys.stdout)
@@ -2,16 +2,22 @@ from __future__ import annotations
 
 import argparse
 import collections
+import contextlib
 import copy
+import functools
+import io
+import sys
 import typing
 from enum import Enum
 
+import inliner
 import lexer
+import peephole
 import stdlib
-from isa import Address, AddressType, Code, Opcode, Term, serialize
+from isa import Address, AddressType, Code, Opcode, Term, serialize, serialize_binary
 
 
-def extract_tokens(src) -> list[lexer.TokenInfo]:
+def extract_tokens(src: str | typing.Iterable[str]) -> typing.Iterator[lexer.TokenInfo]:
     return lexer.lex(src, lexer.token_expressions)
 
 
@@ -22,55 +28,114 @@ class ASTNode:
         self.token = token
         self.parent = parent
         self.children = [] if children is None else children
+        # nesting depth of the subtree, counted for the root and top-level nodes only
+        self.height = 0
 
 
-def build_ast(tokens: list[lexer.TokenInfo]) -> ASTNode:
+def top_level_nodes(tokens: typing.Iterable[lexer.TokenInfo]) -> typing.Iterator[ASTNode]:
+    """Top-level expressions, each one as soon as it is closed, so the whole tree is never kept."""
     root = ASTNode()
-    node = root
+    node, depth, height = root, 0, 0
     for token in tokens:
         if token.string == "(":
             child = ASTNode(token, node)
             node.children.append(child)
-            node = child
+            node, depth = child, depth + 1
+            height = max(height, depth)
         elif token.string == ")":
             assert node.parent, "Wrong parenthesis count"
-            node = node.parent
+            node, depth = node.parent, depth - 1
         else:
             if token.tag == lexer.STR:
                 token.string = token.string[1:-1]
             node.children.append(ASTNode(token, node))
+        if node is root:
+            top = root.children.pop()
+            top.height, height = height, 0
+            yield top
     assert node == root, "Wrong parenthesis count"
+
+
+def build_ast(tokens: typing.Iterable[lexer.TokenInfo]) -> ASTNode:
+    root = ASTNode()
+    for node in top_level_nodes(tokens):
+        node.parent = root
+        root.children.append(node)
+        root.height = max(root.height, node.height)
     return root
 
 
 predefined_funcs: dict[str, stdlib.FuncInfo] = {func.name: func for func in stdlib.ALL_FUNCS}
 
+# functions of at most this many instructions besides `ret` are inlined at -O
+INLINE_LIMIT = 8
+
 
 class FuncContext:
-    def __init__(self):
-        self.args_table: dict[str, int] = {}
+    """Stack offsets of function arguments.
+
+    Offsets are kept relative to the stack depth at function entry, so a push or pop only
+    moves `depth`. Offset -1 means the argument is in the accumulator.
+    """
+
+    def __init__(self, ret_base: int = 0):
+        self.base_offsets: dict[str, int] = {}
+        self.args_by_base: dict[int, str] = {}
+        self.depth = 0
+        self.ret_base = ret_base
+
+    def define_arg(self, name: str, offset: int):
+        self.base_offsets[name] = offset
+        self.args_by_base[offset] = name
+
+    def has_arg(self, name: str) -> bool:
+        return name in self.base_offsets
+
+    def arg_offset(self, name: str) -> int:
+        return self.base_offsets[name] + self.depth
+
+    def has_arg_at(self, offset: int) -> bool:
+        return offset - self.depth in self.args_by_base
+
+    def ret_offset(self) -> int:
+        return self.ret_base + self.depth
 
     def has_in_acr(self) -> bool:
-        return -1 in self.args_table.values()
+        return self.has_arg_at(-1)
 
     def get_in_acr(self) -> str:
-        return list(self.args_table.keys())[list(self.args_table.values()).index(-1)]
+        return self.args_by_base[-1 - self.depth]
 
     def on_push(self):
-        self.args_table = {k: v + 1 for k, v in self.args_table.items()}
+        self.depth += 1
 
     def on_pop(self):
-        self.args_table = {k: v - 1 for k, v in self.args_table.items()}
+        self.depth -= 1
 
 
 class ProgramContext:
-    def __init__(self):
+    def __init__(
+        self,
+        opt_level: int = 1,
+        peephole_rules: typing.Collection[str] | None = None,
+        inline_limit: int | None = None,
+        inline_sites: list[inliner.Site] | None = None,
+    ):
+        self.opt_level = opt_level
+        if peephole_rules is None:
+            peephole_rules = peephole.all_rules if opt_level > 0 else []
+        self.peephole_rules = peephole_rules
+        if inline_limit is None:
+            inline_limit = INLINE_LIMIT if opt_level > 0 else 0
+        self.inline_limit = inline_limit
+        self.inline_sites = inline_sites
         self.defined_funcs: dict[str, stdlib.FuncInfo] = copy.deepcopy(predefined_funcs)
-        self.function_table: list[str] = []
+        # tables map a name or a value to its index, in the order of first use
+        self.function_table: dict[str, int] = {}
 
-        self.str_const_table: list[str] = []
-        self.int_const_table: list[int] = []
-        self.var_table: list[str] = []
+        self.str_const_table: dict[str, int] = {}
+        self.int_const_table: dict[int, int] = {}
+        self.var_table: dict[str, int] = {}
         self.anon_var_table: dict[str, tuple[int, int]] = collections.OrderedDict()
         self.anon_var_pointer = 0
         self.anon_var_counter = 0
@@ -80,7 +145,7 @@ class ProgramContext:
     def require_func(self, func: str):
         assert func in self.defined_funcs, f"Unknown func {func}"
         if func not in self.function_table:
-            self.function_table.append(func)
+            self.function_table[func] = len(self.function_table)
 
     def define_func(self, name: str, argc: int):
         assert name not in self.defined_funcs, f"Function {name} already defined"
@@ -100,15 +165,15 @@ class ProgramContext:
 
     def require_int_const(self, const: int):
         assert const < (1 << 63), f"Value must be less than {1 << 63}, got {const}"
-        assert const > (-(1 << 63) - 1), f"Value must be greater than {- (1 << 63) - 1}, got {const}"
+        assert const > (-(1 << 63) - 1), f"Value must be greater than {-(1 << 63) - 1}, got {const}"
         if const not in self.int_const_table:
-            self.int_const_table.append(const)
+            self.int_const_table[const] = len(self.int_const_table)
 
     def require_str_const(self, const: str):
         assert const[0] != '"', f"Value must be trimmed, got {const}"
         assert const[-1] != '"', f"Value must be trimmed, got {const}"
         if const not in self.str_const_table:
-            self.str_const_table.append(const)
+            self.str_const_table[const] = len(self.str_const_table)
 
     def require_anon_variable(self, size: int) -> str:
         assert size > 0, f"negative size buffer?, got {size}"
@@ -120,7 +185,7 @@ class ProgramContext:
 
     def require_variable(self, name: str):
         if name not in self.var_table:
-            self.var_table.append(name)
+            self.var_table[name] = len(self.var_table)
 
     def set_func_context(self, fc: FuncContext | None):
         self.func_context = fc
@@ -154,6 +219,18 @@ class Statement:
         self.name = name
         self.args = [] if args is None else args
         self.val = val
+        self.tail = False
+
+
+def fits_operand(int_val: int) -> bool:
+    return (1 << 19) > int_val > (-(1 << 19) - 1)
+
+
+def int_statement(int_val: int, context: ProgramContext) -> Statement:
+    if fits_operand(int_val):
+        return Statement(Tag.VALUE, val=int_val)
+    context.require_int_const(int_val)
+    return Statement(Tag.INT_CONST, val=int_val)
 
 
 def const_statement(node: ASTNode, context: ProgramContext) -> Statement:
@@ -161,11 +238,7 @@ def const_statement(node: ASTNode, context: ProgramContext) -> Statement:
     assert token.tag in (lexer.INT, lexer.STR), f"Unknown const type {token.tag}"
     match token.tag:
         case lexer.INT:
-            int_val = int(node.token.string)
-            if (1 << 19) > int_val > (-(1 << 19) - 1):
-                return Statement(Tag.VALUE, val=int_val)
-            context.require_int_const(int_val)
-            return Statement(Tag.INT_CONST, val=int_val)
+            return int_statement(int(node.token.string), context)
         case lexer.STR:
             str_val = node.token.string.encode("raw_unicode_escape").decode("unicode_escape")
             context.require_str_const(str_val)
@@ -294,8 +367,98 @@ def extract_statements(root: ASTNode, context: ProgramContext) -> list[Statement
     return statements
 
 
-def translate_invoke_statement_argument(arg: Statement, context: ProgramContext) -> list[Term]:
-    arg_code = []
+word_mask = (1 << 32) - 1
+
+
+def signed_word(val: int) -> int:
+    val &= word_mask
+    return val - (1 << 32) if val >> 31 else val
+
+
+def word_statement(word: int, context: ProgramContext) -> Statement:
+    """Loads a machine word, a long one is kept unsigned like the memory holds it."""
+    int_val = signed_word(word)
+    return int_statement(int_val if fits_operand(int_val) else word & word_mask, context)
+
+
+# operands are machine words as registers hold them: unsigned 32 bits, the ALU sees them signed
+folded_math: dict[str, typing.Callable[[int, int], int]] = {
+    "+": lambda left, right: left + right,
+    "-": lambda left, right: left - right,
+    "*": lambda left, right: left * right,
+    "/": lambda left, right: signed_word(left) // signed_word(right),
+    "mod": lambda left, right: signed_word(left) % signed_word(right),
+}
+
+
+def faults(name: str, left: int, right: int) -> bool:
+    # the machine stops on division of a negative or by a non-positive, so it is left to run time
+    return name in ("/", "mod") and (signed_word(left) < 0 or signed_word(right) <= 0)
+
+
+folded_bool: dict[str, typing.Callable[[int, int], bool]] = {
+    "=": lambda left, right: left == right,
+    ">": lambda left, right: signed_word(left) > signed_word(right),
+    ">=": lambda left, right: signed_word(left) >= signed_word(right),
+}
+
+
+def is_known(statement: Statement) -> bool:
+    return statement.tag in (Tag.VALUE, Tag.INT_CONST)
+
+
+def fold_math_statement(statement: Statement, context: ProgramContext) -> Statement:
+    """Math on known operands is computed with wraparound, `+` and `*` also merge the known ones of unknown."""
+    args, fold = statement.args, folded_math[statement.name]
+    known = [arg for arg in args if is_known(arg)]
+    if statement.name in ("+", "*") and 1 < len(known) < len(args):
+        merged = word_statement(functools.reduce(fold, (arg.val & word_mask for arg in known)), context)
+        statement.args = [*(arg for arg in args if not is_known(arg)), merged]
+        return statement
+    if len(known) < len(args):
+        return statement
+    # arguments are computed from the last one, which ends up on the right of every operation
+    result = args[-1].val & word_mask
+    for arg in args[-2::-1]:
+        if faults(statement.name, arg.val, result):
+            return statement
+        result = fold(arg.val & word_mask, result) & word_mask
+    return word_statement(result, context)
+
+
+def fold_bool_statement(statement: Statement, context: ProgramContext) -> Statement:
+    left, right = statement.args
+    if not is_known(left) or not is_known(right):
+        return statement
+    return word_statement(int(folded_bool[statement.name](left.val & word_mask, right.val & word_mask)), context)
+
+
+# noinspection PyUnusedLocal
+def fold_if_statement(statement: Statement, context: ProgramContext) -> Statement:
+    cond, opt1, opt2 = statement.args
+    if not is_known(cond):
+        return statement
+    return opt1 if cond.val & word_mask != 0 else opt2
+
+
+statement_folders: dict[str, typing.Callable[[Statement, ProgramContext], Statement]] = {
+    **dict.fromkeys(folded_math, fold_math_statement),
+    **dict.fromkeys(folded_bool, fold_bool_statement),
+    "if": fold_if_statement,
+}
+
+
+def fold_statement(statement: Statement, context: ProgramContext) -> Statement:
+    """Computes expressions known at translation time and keeps the taken option of `if` with a known condition."""
+    if statement.tag != Tag.INVOKE:
+        return statement
+    statement.args = [fold_statement(arg, context) for arg in statement.args]
+    if statement.name in statement_folders:
+        return statement_folders[statement.name](statement, context)
+    return statement
+
+
+def translate_invoke_statement_argument(arg: Statement, context: ProgramContext, code: list[Term]):
     fc = context.get_func_context()
     assert arg.tag in (
         Tag.VALUE,
@@ -307,43 +470,39 @@ def translate_invoke_statement_argument(arg: Statement, context: ProgramContext)
     match arg.tag:
         case Tag.VALUE:
             if fc and fc.has_in_acr():
-                arg_code.append(Term(Opcode.PUSH))
+                code.append(Term(Opcode.PUSH))
                 fc.on_push()
-            arg_code.append(Term(Opcode.LOAD, Address(AddressType.EXACT, arg.val)))
+            code.append(Term(Opcode.LOAD, Address(AddressType.EXACT, arg.val)))
         case Tag.INT_CONST | Tag.STR_CONST:
             if fc and fc.has_in_acr():
-                arg_code.append(Term(Opcode.PUSH))
+                code.append(Term(Opcode.PUSH))
                 fc.on_push()
             arg = arg.val if arg.tag == Tag.INT_CONST else arg.name
-            arg_code.append(Term(Opcode.LOAD, arg))
+            code.append(Term(Opcode.LOAD, arg))
         case Tag.INVOKE:
-            arg_code.extend(translate_invoke_statement(arg, context))
+            translate_invoke_statement(arg, context, code)
         case Tag.REFERENCE:
             if fc and fc.has_in_acr() and fc.get_in_acr() == arg.name:
                 pass
-            elif fc and arg.name in fc.args_table:
+            elif fc and fc.has_arg(arg.name):
                 if fc.has_in_acr():
-                    arg_code.append(Term(Opcode.PUSH))
+                    code.append(Term(Opcode.PUSH))
                     fc.on_push()
                 desc = repr(arg.name) + " argument"
-                arg_code.append(Term(Opcode.LOAD, Address(AddressType.RELATIVE_SPR, fc.args_table[arg.name]), desc))
+                code.append(Term(Opcode.LOAD, Address(AddressType.RELATIVE_SPR, fc.arg_offset(arg.name)), desc))
             else:
-                arg_code.append(Term(Opcode.LOAD, arg.name))
-    return arg_code
+                code.append(Term(Opcode.LOAD, arg.name))
 
 
-def translate_read_statement(read: Statement, context: ProgramContext) -> list[Term]:
-    code = []
+def translate_read_statement(read: Statement, context: ProgramContext, code: list[Term]):
     if context.func_context_has_in_acr():
         code.append(Term(Opcode.PUSH))
         context.func_context_on_push()
     read.anon_var_name = context.require_anon_variable(stdlib.READ_LIMIT + 1)
     code.extend([Term(Opcode.LOAD, read.anon_var_name), Term(Opcode.CALL, read.name)])
-    return code
 
 
-def translate_printi_statement(printi: Statement, context: ProgramContext) -> list[Term]:
-    code = []
+def translate_printi_statement(printi: Statement, context: ProgramContext, code: list[Term]):
     if context.func_context_has_in_acr():
         code.append(Term(Opcode.PUSH))
         context.func_context_on_push()
@@ -351,155 +510,319 @@ def translate_printi_statement(printi: Statement, context: ProgramContext) -> li
     printi.anon_var_name = context.require_anon_variable(21)
     code.extend([Term(Opcode.LOAD, printi.anon_var_name), Term(Opcode.PUSH)])
     context.func_context_on_push()
-    code.extend(translate_invoke_statement_argument(printi.args[0], context))
+    translate_invoke_statement_argument(printi.args[0], context, code)
     code.extend([Term(Opcode.CALL, printi.name), Term(Opcode.POPN)])
     context.func_context_on_pop()
-    return code
 
 
-def translate_set_statement(set_st: Statement, context: ProgramContext) -> list[Term]:
+def translate_set_statement(set_st: Statement, context: ProgramContext, code: list[Term]):
     variable, value = set_st.args[0], set_st.args[1]
     assert variable.tag == Tag.REFERENCE, f"unexpected variable statement type, got {variable}"
     context.require_variable(variable.name)
-    code = translate_invoke_statement_argument(value, context)
+    translate_invoke_statement_argument(value, context, code)
     code.append(Term(Opcode.STORE, variable.name))
-    return code
 
 
 math_opcode = {"mod": Opcode.MODULO, "+": Opcode.ADD, "-": Opcode.SUBTRACT, "*": Opcode.MULTIPLY, "/": Opcode.DIVIDE}
 
 
-def translate_math_statement(statement: Statement, context: ProgramContext) -> list[Term]:
-    code = []
+def direct_operands(args: list[Statement], context: ProgramContext) -> list[bool]:
+    """Arguments an instruction can read in place: values, constants, variables and function arguments.
+
+    A variable right of a computed argument is loaded as before, as it is read after that
+    argument now and the argument may change it.
+    """
+    fc = context.get_func_context()
+    direct, computed_on_left = [], False
+    for arg in args:
+        if arg.tag == Tag.REFERENCE and fc and fc.has_arg(arg.name):
+            direct.append(not (fc.has_in_acr() and fc.get_in_acr() == arg.name))
+        else:
+            direct.append(arg.tag != Tag.INVOKE and not (arg.tag == Tag.REFERENCE and computed_on_left))
+        computed_on_left = computed_on_left or arg.tag == Tag.INVOKE
+    return direct
+
+
+def direct_term(opcode: Opcode, arg: Statement, context: ProgramContext) -> Term:
+    fc = context.get_func_context()
+    match arg.tag:
+        case Tag.VALUE:
+            return Term(opcode, Address(AddressType.EXACT, arg.val))
+        case Tag.INT_CONST:
+            return Term(opcode, arg.val)
+        case Tag.REFERENCE if fc and fc.has_arg(arg.name):
+            return Term(opcode, Address(AddressType.RELATIVE_SPR, fc.arg_offset(arg.name)), f"{arg.name!r} argument")
+    return Term(opcode, arg.name)
+
+
+def translate_operation_on_stack(opcode: Opcode, left: Statement, context: ProgramContext, code: list[Term]):
+    """Applies `opcode` to `left` and the accumulator, which is pushed meanwhile."""
+    code.append(Term(Opcode.PUSH))
+    context.func_context_on_push()
+    translate_invoke_statement_argument(left, context, code)
+    code.extend([Term(opcode, Address(AddressType.RELATIVE_SPR, 0)), Term(Opcode.POPN)])
+    context.func_context_on_pop()
+
+
+def translate_direct_math_statement(statement: Statement, context: ProgramContext, code: list[Term]):
+    """Math in the accumulator: `ld a, add b, add c`, only computed arguments go through the stack."""
+    opcode, args = math_opcode[statement.name], statement.args
+    direct = direct_operands(args, context)
+    if statement.name not in ("+", "*"):
+        left, right = args
+        if direct[1]:
+            translate_invoke_statement_argument(left, context, code)
+            code.append(direct_term(opcode, right, context))
+        else:
+            translate_invoke_statement_argument(right, context, code)
+            translate_operation_on_stack(opcode, left, context, code)
+        return
+    # computed arguments are evaluated right to left as before, the rest are applied in place
+    computed = [arg for arg, is_direct in zip(args, direct) if not is_direct]
+    in_place = [arg for arg, is_direct in zip(args, direct) if is_direct]
+    first, *others = computed[::-1] or in_place[:1]
+    translate_invoke_statement_argument(first, context, code)
+    for arg in others:
+        translate_operation_on_stack(opcode, arg, context, code)
+    for arg in in_place if computed else in_place[1:]:
+        code.append(direct_term(opcode, arg, context))
+
+
+def translate_stack_math_statement(statement: Statement, context: ProgramContext, code: list[Term]):
     opcode = math_opcode[statement.name]
     last_arg = statement.args[-1]
-    code.extend(translate_invoke_statement_argument(last_arg, context))
+    translate_invoke_statement_argument(last_arg, context, code)
     code.append(Term(Opcode.PUSH))
     context.func_context_on_push()
     for arg in statement.args[-2::-1]:
-        code.extend(translate_invoke_statement_argument(arg, context))
+        translate_invoke_statement_argument(arg, context, code)
         code.append(Term(opcode, Address(AddressType.RELATIVE_SPR, 0)))
         code.append(Term(Opcode.STORE, Address(AddressType.RELATIVE_SPR, 0)))
     code.append(Term(Opcode.POP))
     context.func_context_on_pop()
-    return code
+
+
+def translate_math_statement(statement: Statement, context: ProgramContext, code: list[Term]):
+    if context.opt_level > 0:
+        translate_direct_math_statement(statement, context, code)
+    else:
+        translate_stack_math_statement(statement, context, code)
 
 
 bool_opcode = {"=": Opcode.JUMP_EQUAL, ">": Opcode.JUMP_GREATER, ">=": Opcode.JUMP_GREATER_EQUAL}
 
 
-def translate_bool_statement(statement: Statement, context: ProgramContext) -> list[Term]:
-    code = []
-    opcode = bool_opcode[statement.name]
-    code.extend(translate_invoke_statement_argument(statement.args[1], context))
+def translate_compare(statement: Statement, context: ProgramContext, code: list[Term]):
+    left, right = statement.args
+    direct = direct_operands(statement.args, context) if context.opt_level > 0 else [False, False]
+    if statement.name == "=" and direct[0] and not direct[1]:
+        # equality is symmetric and the left argument is read after the right one either way
+        left, right, direct = right, left, direct[::-1]
+    if direct[1]:
+        translate_invoke_statement_argument(left, context, code)
+        code.append(direct_term(Opcode.COMPARE, right, context))
+        return
+    translate_invoke_statement_argument(right, context, code)
     code.append(Term(Opcode.PUSH))
     context.func_context_on_push()
-    code.extend(translate_invoke_statement_argument(statement.args[0], context))
+    translate_invoke_statement_argument(left, context, code)
+    code.extend([Term(Opcode.COMPARE, Address(AddressType.RELATIVE_SPR, 0)), Term(Opcode.POPN)])
+    context.func_context_on_pop()
+
+
+def translate_bool_statement(statement: Statement, context: ProgramContext, code: list[Term]):
+    translate_compare(statement, context, code)
     code.extend(
         [
-            Term(Opcode.COMPARE, Address(AddressType.RELATIVE_SPR, 0)),
-            Term(Opcode.POPN),
-            Term(opcode, Address(AddressType.RELATIVE_IPR, 3)),
+            Term(bool_opcode[statement.name], Address(AddressType.RELATIVE_IPR, 3)),
             Term(Opcode.LOAD, Address(AddressType.EXACT, 0)),
             Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, 2)),
             Term(Opcode.LOAD, Address(AddressType.EXACT, 1)),
         ]
     )
-    context.func_context_on_pop()
-    return code
-
-
-def translate_if_statement(statement: Statement, context: ProgramContext) -> list[Term]:
-    code = []
-    cond_code = translate_invoke_statement_argument(statement.args[0], context)
-    opt1_code = translate_invoke_statement_argument(statement.args[1], context)
-    opt2_code = translate_invoke_statement_argument(statement.args[2], context)
-    opt1_code.append(Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, len(opt2_code) + 1)))
-    cond_code.extend(
-        [
-            Term(Opcode.COMPARE, Address(AddressType.EXACT, 0)),
-            Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, len(opt1_code) + 1)),
-        ]
-    )
-    code.extend(cond_code)
-    code.extend(opt1_code)
-    code.extend(opt2_code)
-    return code
 
 
-def translate_defun_statement(defun: Statement, context: ProgramContext) -> list[Term]:
+def translate_options(branch: Term, first: Statement, second: Statement, context: ProgramContext, code: list[Term]):
+    """`branch` skips the `first` option, which skips the `second` one when done."""
+    # jump offsets are known once both options are emitted
+    skip_first_addr = len(code)
+    code.append(branch)
+    translate_invoke_statement_argument(first, context, code)
+    skip_second = Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, 0))
+    skip_second_addr = len(code)
+    code.append(skip_second)
+    translate_invoke_statement_argument(second, context, code)
+    branch.arg.val = skip_second_addr + 1 - skip_first_addr
+    skip_second.arg.val = len(code) - skip_second_addr
+
+
+def is_comparison(statement: Statement) -> bool:
+    return statement.tag == Tag.INVOKE and statement.name in bool_opcode
+
+
+def zero_tested(condition: Statement) -> Statement | None:
+    """Argument of `(= x 0)` or `(= 0 x)` compared with zero."""
+    if condition.tag != Tag.INVOKE or condition.name != "=":
+        return None
+    for tested, other in (condition.args, condition.args[::-1]):
+        if other.tag == Tag.VALUE and other.val == 0:
+            return tested
+    return None
+
+
+def translate_if_statement(statement: Statement, context: ProgramContext, code: list[Term]):
+    condition, then_option, else_option = statement.args
+    tested = zero_tested(condition) if context.opt_level > 0 else None
+    if tested is not None:
+        # jmz tests the accumulator itself, the comparison with zero is not emitted
+        translate_invoke_statement_argument(tested, context, code)
+        branch = Term(Opcode.JUMP_ZERO, Address(AddressType.RELATIVE_IPR, 0))
+        translate_options(branch, else_option, then_option, context, code)
+    elif context.opt_level > 0 and is_comparison(condition):
+        # flags of the comparison pick the option, the else option comes first and the branch skips to then
+        translate_compare(condition, context, code)
+        branch = Term(bool_opcode[condition.name], Address(AddressType.RELATIVE_IPR, 0))
+        translate_options(branch, else_option, then_option, context, code)
+    elif context.opt_level > 0:
+        translate_invoke_statement_argument(condition, context, code)
+        branch = Term(Opcode.JUMP_ZERO, Address(AddressType.RELATIVE_IPR, 0))
+        translate_options(branch, then_option, else_option, context, code)
+    else:
+        translate_invoke_statement_argument(condition, context, code)
+        code.append(Term(Opcode.COMPARE, Address(AddressType.EXACT, 0)))
+        branch = Term(Opcode.JUMP_EQUAL, Address(AddressType.RELATIVE_IPR, 0))
+        translate_options(branch, then_option, else_option, context, code)
+
+
+def is_tail_callable(statement: Statement, context: ProgramContext, argc: int) -> bool:
+    # arguments of the callee must fit the cells the caller of the current function will pop
+    if statement.name not in context.defined_funcs or statement.name in special_invoke_statement_translators:
+        return False
+    return context.func_info(statement.name).argc <= argc
+
+
+def mark_tail_calls(statement: Statement, context: ProgramContext, argc: int):
+    """Calls in tail position: the body of a function itself and options of `if` in tail position."""
+    if statement.tag != Tag.INVOKE:
+        return
+    if statement.name == "if":
+        for option in statement.args[1:]:
+            mark_tail_calls(option, context, argc)
+    elif is_tail_callable(statement, context, argc):
+        statement.tail = True
+
+
+def translate_defun_statement(defun: Statement, context: ProgramContext, code: list[Term]):
     func_code = []
     func_name = defun.args[0].name
     arguments: list[Statement] = defun.args[1].args
-    func_context = FuncContext()
+    # optimized functions keep the first argument on the stack from the start, so every option
+    # of `if` finds it at the same place and a tail call knows where the return address is
+    spill = context.opt_level > 0 and len(arguments) > 0
+    func_context = FuncContext(ret_base=1 if spill else 0)
+    if spill:
+        func_code.append(Term(Opcode.PUSH))
+        mark_tail_calls(defun.args[2], context, len(arguments))
     if len(arguments) > 0:
         first_argument = arguments[0]
-        func_context.args_table[first_argument.name] = -1
+        func_context.define_arg(first_argument.name, 0 if spill else -1)
     for i, argument in enumerate(arguments[1:]):
-        func_context.args_table[argument.name] = 1 + i
+        func_context.define_arg(argument.name, func_context.ret_base + 1 + i)
     context.set_func_context(func_context)
-    func_code.extend(translate_invoke_statement_argument(defun.args[2], context))
+    translate_invoke_statement_argument(defun.args[2], context, func_code)
     context.set_func_context(None)
-    if 0 in func_context.args_table.values():
+    if func_context.has_arg_at(0):
         func_code.append(Term(Opcode.POPN))
     func_code.append(Term(Opcode.RETURN))
     context.implement_func(func_name, func_code)
-    return []
 
 
-def translate_loop_statement(statement: Statement, context: ProgramContext):
-    code = []
-    code.extend(translate_invoke_statement_argument(statement.args[0], context))
-    code.append(Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, -len(code))))
-    return code
+def translate_loop_statement(statement: Statement, context: ProgramContext, code: list[Term]):
+    start = len(code)
+    translate_invoke_statement_argument(statement.args[0], context, code)
+    code.append(Term(Opcode.JUMP, Address(AddressType.RELATIVE_IPR, start - len(code))))
+
 
+def translate_tail_call(statement: Statement, context: ProgramContext, code: list[Term]):
+    """Arguments replace the ones of the current function and the callee is jumped to.
 
-def translate_invoke_statement_common(statement: Statement, context: ProgramContext) -> list[Term]:
+    The callee returns straight to the caller of the current function, so recursion through
+    tail calls runs in constant stack.
+    """
+    fc = context.get_func_context()
+    args = statement.args
+    for arg in args[-1:0:-1]:
+        translate_invoke_statement_argument(arg, context, code)
+        code.append(Term(Opcode.PUSH))
+        fc.on_push()
+    if len(args) > 0:
+        translate_invoke_statement_argument(args[0], context, code)
+    temps = len(args) if len(args) > 1 else 0
+    if temps > 0:
+        code.append(Term(Opcode.PUSH))
+        fc.on_push()
+    ret = fc.ret_offset()
+    for index in range(1, temps):
+        code.append(Term(Opcode.LOAD, Address(AddressType.RELATIVE_SPR, index)))
+        code.append(Term(Opcode.STORE, Address(AddressType.RELATIVE_SPR, ret + index)))
+    if temps > 0:
+        code.append(Term(Opcode.POP))
+    code.extend(Term(Opcode.POPN) for _ in range(ret - (1 if temps > 0 else 0)))
+    code.append(Term(Opcode.JUMP, statement.name))
+    for _ in range(temps):
+        fc.on_pop()
+
+
+def translate_invoke_statement_common(statement: Statement, context: ProgramContext, code: list[Term]):
     args = statement.args
-    code = []
     for arg in args[-1:0:-1]:
-        code.extend(translate_invoke_statement_argument(arg, context))
+        translate_invoke_statement_argument(arg, context, code)
         code.append(Term(Opcode.PUSH))
         context.func_context_on_push()
     if len(args) > 0:
-        code.extend(translate_invoke_statement_argument(args[0], context))
+        translate_invoke_statement_argument(args[0], context, code)
     code.append(Term(Opcode.CALL, statement.name))
     for _ in range(len(args) - 1):
         code.append(Term(Opcode.POPN))
         context.func_context_on_pop()
-    return code
 
 
-special_invoke_statement_translators: dict[str, typing.Callable[[Statement, ProgramContext], list[Term]]] = {
+special_invoke_statement_translators: dict[str, typing.Callable[[Statement, ProgramContext, list[Term]], None]] = {
     stdlib.READLINE_FUNC.name: translate_read_statement,
     stdlib.PRINT_INTEGER_FUNC.name: translate_printi_statement,
 }
 
 
-def translate_invoke_statement(statement: Statement, context: ProgramContext) -> list[Term]:
+def translate_invoke_statement(statement: Statement, context: ProgramContext, code: list[Term]):
+    """Appends code of the statement to `code`, so nested statements are not copied on every level."""
     match statement.name:
         case "set":
-            return translate_set_statement(statement, context)
+            return translate_set_statement(statement, context, code)
         case "mod" | "+" | "-" | "/" | "*":
-            return translate_math_statement(statement, context)
+            return translate_math_statement(statement, context, code)
         case "=" | ">" | ">=":
-            return translate_bool_statement(statement, context)
+            return translate_bool_statement(statement, context, code)
         case "if":
-            return translate_if_statement(statement, context)
+            return translate_if_statement(statement, context, code)
         case "defun":
-            return translate_defun_statement(statement, context)
+            return translate_defun_statement(statement, context, code)
         case "loop":
-            return translate_loop_statement(statement, context)
+            return translate_loop_statement(statement, context, code)
     context.require_func(statement.name)
     if statement.name in special_invoke_statement_translators:
-        return special_invoke_statement_translators[statement.name](statement, context)
-    return translate_invoke_statement_common(statement, context)
+        return special_invoke_statement_translators[statement.name](statement, context, code)
+    if statement.tail:
+        return translate_tail_call(statement, context, code)
+    return translate_invoke_statement_common(statement, context, code)
 
 
-def translate_statement(statement: Statement, context: ProgramContext) -> list[Term]:
-    if statement.tag == Tag.INVOKE:
-        return translate_invoke_statement(statement, context)
-    raise NotImplementedError(f"unknown tag of statement to translate, got {statement.tag}")
+def translate_statement(statement: Statement, context: ProgramContext, code: list[Term]):
+    if statement.tag != Tag.INVOKE:
+        raise NotImplementedError(f"unknown tag of statement to translate, got {statement.tag}")
+    if context.opt_level > 0:
+        # a folded statement may be a value, it is loaded like an argument
+        return translate_invoke_statement_argument(fold_statement(statement, context), context, code)
+    return translate_invoke_statement(statement, context, code)
 
 
 def fill_instr_memory(
@@ -581,11 +904,84 @@ def resolve_symbols(
                 instr.arg = Address(AddressType.ABSOLUTE, const_table[instr.arg])
 
 
-def translate_into_code(statements: list[Statement], context: ProgramContext) -> Code:
-    start_code = []
-    for s in statements:
-        start_code.extend(translate_statement(s, context))
+def call_sites(start_code: list[Term], context: ProgramContext) -> collections.Counter[str]:
+    codes = [start_code, *(context.defined_funcs[name].code for name in context.function_table)]
+    return collections.Counter(name for code in codes for name in called_funcs(code))
+
+
+def inline_functions(start_code: list[Term], context: ProgramContext) -> list[Term]:
+    """Replaces calls of functions up to `inline_limit` instructions and of functions called once with their bodies.
+
+    A function called once is dropped after inlining, so the code only gets shorter. Functions are
+    defined before use, so a callee has its own calls inlined before its body is taken. Library
+    functions are inlined but not inlined into.
+    """
+    if context.inline_limit <= 0:
+        return start_code
+    sites = call_sites(start_code, context)
+    callees: dict[str, inliner.Callee] = {}
+    for func_name, func_info in context.defined_funcs.items():
+        if func_name not in context.function_table:
+            continue
+        if func_name not in predefined_funcs:
+            func_info.code = inliner.inline_calls(func_info.code, callees, func_name, context.inline_sites)
+        if sites[func_name] == 1 or len(func_info.code) <= context.inline_limit + 1:
+            body = inliner.inline_body(func_info.code)
+            if body is not None and (sites[func_name] == 1 or len(body) <= context.inline_limit):
+                callees[func_name] = inliner.Callee(func_info.code, body)
+    return inliner.inline_calls(start_code, callees, "start", context.inline_sites)
+
+
+def optimize_code(start_code: list[Term], context: ProgramContext) -> list[Term]:
+    """Runs the peephole pass over functions of the program, library functions are left as written."""
+    if not context.peephole_rules:
+        return start_code
+    for func_name in context.function_table:
+        if func_name not in predefined_funcs:
+            func_info = context.defined_funcs[func_name]
+            func_info.code = peephole.optimize(func_info.code, context.peephole_rules)
+    return peephole.optimize(start_code, context.peephole_rules)
+
+
+def called_funcs(code: list[Term]) -> list[str]:
+    # tail calls jump to the function by name
+    return [term.arg for term in code if term.op in (Opcode.CALL, Opcode.JUMP) and isinstance(term.arg, str)]
+
+
+def reachable_funcs(start_code: list[Term], context: ProgramContext) -> list[str]:
+    """Functions called from `start` directly or through other functions, in the order of the function table."""
+    reached: set[str] = set()
+    pending = called_funcs(start_code)
+    while pending:
+        name = pending.pop()
+        if name not in reached:
+            reached.add(name)
+            pending.extend(called_funcs(context.defined_funcs[name].code))
+    return [name for name in context.function_table if name in reached]
+
+
+def eliminate_dead_code(start_code: list[Term], context: ProgramContext):
+    """Drops functions no call reaches and data only they or folded expressions referred to."""
+    context.function_table = {name: index for index, name in enumerate(reachable_funcs(start_code, context))}
+    used: set[str | int] = set()
+    for code in (start_code, *(context.defined_funcs[name].code for name in context.function_table)):
+        used.update(term.arg for term in code if isinstance(term.arg, str | int))
+    context.str_const_table = {const: index for const, index in context.str_const_table.items() if const in used}
+    context.int_const_table = {const: index for const, index in context.int_const_table.items() if const in used}
+    context.var_table = {name: index for name, index in context.var_table.items() if name in used}
+    anon_vars = [(name, size) for name, (_, size) in context.anon_var_table.items() if name in used]
+    context.anon_var_table, context.anon_var_pointer = collections.OrderedDict(), 0
+    for name, size in anon_vars:
+        context.anon_var_table[name] = (context.anon_var_pointer, size)
+        context.anon_var_pointer += size
+
+
+def layout_code(start_code: list[Term], context: ProgramContext) -> Code:
     start_code.append(Term(Opcode.HALT))
+    start_code = inline_functions(start_code, context)
+    start_code = optimize_code(start_code, context)
+    if context.opt_level > 0:
+        eliminate_dead_code(start_code, context)
 
     symbols: set[str] = set()
     const_table: dict[str | int, int] = {}
@@ -600,28 +996,74 @@ def translate_into_code(statements: list[Statement], context: ProgramContext) ->
     return Code(instr_memory, data_memory)
 
 
-def translate(src: str) -> Code:
-    tokens = extract_tokens(src)
-    ast = build_ast(tokens)
-    program_context = ProgramContext()
-    statements = extract_statements(ast, program_context)
-    return translate_into_code(statements, program_context)
-
-
-def read_source(src: typing.TextIO) -> str:
-    return src.read()
-
-
-def write_code(dst: typing.TextIO, code: Code) -> (bytearray, str):
-    dst.write(serialize(code))
-
-
-def main(src: typing.TextIO, dst: typing.TextIO):
-    source = read_source(src)
-    code = translate(source)
-    write_code(dst, code)
-
-    loc, code_instr = len(source.split("\n")), len(code)
+def translate_into_code(statements: list[Statement], context: ProgramContext) -> Code:
+    start_code = []
+    for s in statements:
+        translate_statement(s, context, start_code)
+    return layout_code(start_code, context)
+
+
+@contextlib.contextmanager
+def recursion_limit(limit: int):
+    previous = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(previous, limit))
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(previous)
+
+
+def translate(
+    src: str | typing.Iterable[str],
+    opt_level: int = 1,
+    peephole_rules: typing.Collection[str] | None = None,
+    inline_limit: int | None = None,
+    inline_sites: list[inliner.Site] | None = None,
+) -> Code:
+    """Translates top-level expressions one by one as they are read, only the generated code is kept.
+
+    Expressions only add to the tables of the program context, so the code is the same as
+    after extracting all statements first. `opt_level` 0 turns optimizations off, `inline_sites`
+    collects calls replaced with bodies of functions up to `inline_limit` instructions.
+    """
+    program_context = ProgramContext(opt_level, peephole_rules, inline_limit, inline_sites)
+    start_code: list[Term] = []
+    base_limit = sys.getrecursionlimit()
+    for node in top_level_nodes(extract_tokens(src)):
+        # statements are extracted and translated recursively, a few frames per nesting level
+        with recursion_limit(base_limit + 8 * node.height):
+            translate_statement(ast_to_statement(node, program_context), program_context, start_code)
+    return layout_code(start_code, program_context)
+
+
+class LineCounter:
+    """Lines of a text stream passed through to the lexer, counted on the way."""
+
+    def __init__(self, src: typing.Iterable[str]):
+        self.src = src
+        self.newlines = 0
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for line in self.src:
+            self.newlines += line.endswith("\n")
+            yield line
+
+
+def write_code(dst: typing.TextIO | typing.BinaryIO, code: Code, output_format: str = "json"):
+    if output_format == "binary":
+        dst.write(serialize_binary(code))
+    elif isinstance(dst, io.TextIOBase):
+        dst.write(serialize(code))
+    else:
+        dst.write(serialize(code).encode("utf-8"))
+
+
+def main(src: typing.TextIO, dst: typing.TextIO | typing.BinaryIO, output_format: str = "json", opt_level: int = 1):
+    source = LineCounter(src)
+    code = translate(source, opt_level)
+    write_code(dst, code, output_format)
+
+    loc, code_instr = source.newlines + 1, len(code)
     print(f"LoC: {loc} code instr: {code_instr}")
 
 
@@ -634,10 +1076,28 @@ if __name__ == "__main__":
         "--output",
         "-o",
         dest="dst",
-        type=argparse.FileType("w", encoding="utf-8"),
+        type=argparse.FileType("wb"),
         default="output",
         metavar="output_file",
         help="file for storing an executable (default: output)",
     )
+    parser.add_argument(
+        "--format",
+        "-f",
+        dest="output_format",
+        choices=["binary", "json"],
+        default="binary",
+        help="executable format, json is for debugging (default: binary)",
+    )
+    parser.add_argument(
+        "-O",
+        dest="opt_level",
+        type=int,
+        nargs="?",
+        const=1,
+        default=1,
+        choices=[0, 1],
+        help="optimization level, -O0 turns optimizations off (default: 1)",
+    )
     namespace = parser.parse_args()
-    main(namespace.src, namespace.dst)
+    main(namespace.src, namespace.dst, namespace.output_format, namespace.opt_level)
@@ -0,0 +1,128 @@
+import isa
+import machine
+import pytest
+import translator
+
+
+def run(source: str, input_text: str = "", limit: int = 100_000) -> str:
+    code = isa.deserialize(isa.serialize(translator.translate(source)))
+    output, _, _ = machine.simulation(code, list(input_text), limit=limit, mode="fast")
+    return output
+
+
+def test_deep_nesting_translates():
+    source = "(set x 0) (printi " + "(+ 1 " * 500 + "x" + ")" * 500 + ")"
+    assert run(source) == "500"
+    assert len(translator.translate("(set x 0) (printi " + "(+ 1 " * 10_000 + "x" + ")" * 10_000 + ")")) > 10_000
+
+
+def test_top_level_nodes_are_streamed():
+    nodes = translator.top_level_nodes(translator.extract_tokens(["(set x 1)\n", '(print (+ "a" x))\n']))
+    first = next(nodes)
+    assert [child.token.string for child in first.children] == ["set", "x", "1"]
+    assert first.height == 1
+    assert next(nodes).height == 2
+
+
+optimized_expressions = [
+    "(+ 1 2 3)",
+    "(mod 10 3)",
+    "(/ 7 2)",
+    "(- 0 1 )",
+    "(* 65536 65536)",
+    "(* 1000 1000)",
+    "(+ 2147483647 2)",
+    "(> 2147483647 (- 0 2147483647))",
+    "(>= -5 -5)",
+    "(= 4294967295 -1)",
+    "(if (> 1 2) 5 (+ 3 4))",
+    "(+ 1 x 2 x 3)",
+    "(* 1000 x 1000)",
+    "(+ (set x 5) x)",
+    "(- x (set x 5))",
+    "(* x (+ x 1) 3)",
+    "(mod (+ x 10) 4)",
+    "(= 7 (+ x 0))",
+    "(> (* x 2) x)",
+    "(if (> x 3) (set x 1) (set x 2))",
+    "(if (= 7 x) (+ x 1) 2)",
+    "(if (>= (- 0 x) 1) 10 (if (> 8 x) 20 30))",
+    "(+ (if (= x (set x 3)) 1 2) x)",
+    "(if (= 0 (- x 7)) 1 2)",
+    "(if (= x 0) 1 (if (- x 7) 3 4))",
+]
+
+
+@pytest.mark.parametrize("expression", optimized_expressions)
+def test_optimization_keeps_result(expression):
+    source = f"(set x 7) (printi {expression})"
+    results = []
+    for opt_level in (0, 1):
+        code = isa.deserialize(isa.serialize(translator.translate(source, opt_level)))
+        results.append(machine.simulation(code, [], mode="fast")[0])
+    assert results[0] == results[1]
+
+
+def block_names(code: isa.Code) -> list[str]:
+    return [block[2] for block in code.text + code.data]
+
+
+def test_folding_drops_dead_code():
+    code = translator.translate('(defun g () (print "g")) (defun f () (g)) (printi (if (= 1 1) (* 3 4) (f)))')
+    assert block_names(code) == ["#", "print", "start"]
+    assert [str(term) for term in code.text[-1][3][:3]] == ["ld #0x31 ('anon$0' const)", "push", "ld #0xc"]
+    assert "'g'" in block_names(translator.translate('(defun g () (print "g")) (g)'))
+    assert block_names(translator.translate("(printi (* 1000 1000))"))[-1] == "1000000"
+    for faulting, opcode in (("(mod 1 0)", isa.Opcode.MODULO), ("(/ -7 2)", isa.Opcode.DIVIDE)):
+        assert opcode in {term.op for term in translator.translate(f"(printi {faulting})").text[-1][3]}
+
+
+def test_comparison_in_if_branches_on_flags():
+    code = translator.translate("(set x 7) (printi (if (> x 3) 1 2))")
+    assert [str(term) for term in code.text[-1][3][4:10]] == [
+        "ld *0x38 ('x' variable)",
+        "cmp #0x3",
+        "jmg *ip+0x3",
+        "ld #0x2",
+        "jmp *ip+0x2",
+        "ld #0x1",
+    ]
+
+
+def test_zero_tests_branch_on_accumulator():
+    for condition, first in (("(= 0 x)", "ld #0x2"), ("x", "ld #0x1")):
+        code = translator.translate(f"(set x 7) (printi (if {condition} 1 2))")
+        assert [str(term) for term in code.text[-1][3][4:7]] == ["ld *0x37 ('x' variable)", "jmz *ip+0x3", first]
+    assert isa.Opcode.JUMP_ZERO not in {
+        term.op for term in translator.translate("(set x 7) (printi (if x 1 2))", 0).text[-1][3]
+    }
+
+
+def test_tail_calls_run_in_constant_stack():
+    source = "(defun count (n acc) (if (= n 0) acc (count (- n 1) (+ acc n)))) (printi (count 20000 0))"
+    code = isa.deserialize(isa.serialize(translator.translate(source)))
+    data_path = machine.DataPath(0x1FFF, code, [])
+    lowest_sp = data_path.sp
+    control_unit = machine.FastControlUnit(data_path)
+    while control_unit.instr_counter < 1_000_000:
+        try:
+            control_unit.execute_next_instruction()
+        except StopIteration:
+            break
+        control_unit.instr_counter += 1
+        lowest_sp = min(lowest_sp, data_path.sp)
+    assert data_path.output_port.getvalue() == str(20000 * 20001 // 2)
+    assert data_path.sp - lowest_sp < 40
+
+
+@pytest.mark.parametrize(
+    ("source", "output"),
+    [
+        ("(defun g (a b c) (printi (+ a (* 10 b) (* 100 c)))) (defun f (a b c d) (g d c b)) (f 1 2 3 4)", "234"),
+        ('(defun greet (name) (print name)) (printi (greet "hi"))', "hi2"),
+        ("(defun h (a) (if (+ 1 a) a 0)) (printi (h 4))", "4"),
+        ("(defun h (a) (if a 5 (+ a 1))) (printi (h 0)) (printi (h 3))", "15"),
+    ],
+)
+def test_tail_calls_and_branches(source, output):
+    assert run(source) == output